@@ -0,0 +1,472 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from bgp_pipeline import BgpPipeline
+from cidr_index import CidrIndex
+from cname_targets import TargetCache, default_target_cache
+from doh_client import create_session
+from domain_store import DomainStore
+from colo_probe import ColoIndex, ColoProber
+from colo_probe import create_session as create_colo_session
+from dns_message import TYPE_A, TYPE_AAAA, TYPE_CNAME
+from latency_probe import LatencyProber, load_targets
+from native_dns import NativeResolver
+from query_ip import LIMITER_OPTIONS, process_backends, query_bgp, query_dns_json, query_dns_wire
+from rate_control import AdaptiveLimiter
+from source_fetch import fetch_sources, parse_adblock_line, parse_plain_line, parse_rule_line
+from stand_ins import (StandInConfig, bgp_app, doh_app, fake_records, list_app, self_signed_context, start_app,
+                       start_dns_server, start_tcp_listener, synthetic_list, trace_app)
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+RESULTS_FILE = 'benchmark_results.json'
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 单位为 KB；它是整个进程的最高值，所以多个阶段时每个阶段在单独的子进程中运行
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def percentiles(latencies):
+    if not latencies:
+        return {'p50': None, 'p95': None, 'p99': None}
+    ordered = sorted(latencies)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+def synthetic_domains(count, seed=0):
+    return [f"d{seed}-{i}.example{i % 97}.com" for i in range(count)]
+
+def synthetic_cidrs(v4_count=1000, v6_count=300, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(v4_count):
+        prefixlen = rng.randint(16, 24)
+        lines.append(str(ipaddress.IPv4Network((rng.getrandbits(32), prefixlen), strict=False)))
+    for _ in range(v6_count):
+        prefixlen = rng.randint(32, 48)
+        lines.append(str(ipaddress.IPv6Network((rng.getrandbits(128), prefixlen), strict=False)))
+    return lines
+
+def synthetic_ips(count, cidr_lines, seed=0):
+    """一半取自 CIDR 内部，一半随机，约 10% 为 IPv6"""
+    rng = random.Random(seed)
+    networks = [ipaddress.ip_network(line) for line in cidr_lines]
+    ips = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            network = rng.choice(networks)
+            ips.append(str(network.network_address + rng.randrange(network.num_addresses)))
+        elif rng.random() < 0.1:
+            ips.append(str(ipaddress.IPv6Address(rng.getrandbits(128))))
+        else:
+            ips.append(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+    return ips
+
+class Timed:
+    """包装查询函数，记录每次调用的延迟"""
+
+    def __init__(self, func):
+        self.func = func
+        self.latencies = []
+
+    async def __call__(self, *args):
+        start = time.perf_counter()
+        try:
+            return await self.func(*args)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+async def run_queries(domains, query, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    timed = Timed(query)
+    answered = 0
+
+    async def worker(domain):
+        nonlocal answered
+        async with semaphore:
+            result = await timed(domain)
+            if result.ips:
+                answered += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(domain) for domain in domains))
+    elapsed = time.perf_counter() - start
+    return {'domains': len(domains), 'answered': answered, 'seconds': round(elapsed, 3),
+            'qps': round(len(domains) / elapsed, 1), **percentiles(timed.latencies)}
+
+def bench_cidr(count, scan_sample=5000):
+    """CIDR 匹配：线性扫描（抽样后外推）、CidrIndex 与 numpy 批量匹配"""
+    cidr_lines = synthetic_cidrs()
+    ips = synthetic_ips(count, cidr_lines)
+
+    start = time.perf_counter()
+    index = CidrIndex.from_lines(cidr_lines)
+    build_time = time.perf_counter() - start
+
+    networks = [ipaddress.ip_network(line) for line in cidr_lines]
+    sample = ips[:scan_sample]
+    start = time.perf_counter()
+    for ip in sample:
+        ip_obj = ipaddress.ip_address(ip)
+        any(ip_obj in network for network in networks)
+    scan_rate = len(sample) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    hits = sum(1 for ip in ips if index.contains(ip))
+    index_time = time.perf_counter() - start
+
+    stats = {'cidrs': len(cidr_lines), 'ips': count, 'hits': hits, 'build_seconds': round(build_time, 4),
+             'scan_ips_per_second': round(scan_rate), 'index_seconds': round(index_time, 3),
+             'index_ips_per_second': round(count / index_time)}
+    try:
+        from cidr_batch import BatchClassifier
+    except ImportError:
+        return stats
+    start = time.perf_counter()
+    mask = BatchClassifier(index).classify(ips)[0]
+    batch_time = time.perf_counter() - start
+    if int(mask.sum()) != hits:
+        print(f"警告: 批量匹配命中数 {int(mask.sum())} 与索引 {hits} 不一致")
+    stats.update({'batch_seconds': round(batch_time, 3), 'batch_ips_per_second': round(count / batch_time)})
+    return stats
+
+async def bench_fetch(count, config):
+    """来源获取：三种格式的列表并发流式解析进 DomainStore，第二次为 304 条件请求"""
+    per_list = max(1, count // 4)
+    lists = {'rules.list': synthetic_list('rules', per_list), 'plain1.txt': synthetic_list('plain', per_list, 1),
+             'plain2.txt': synthetic_list('plain', per_list, 2), 'adblock.txt': synthetic_list('adblock', per_list)}
+    runner, base_url = await start_app(list_app(config, lists))
+    cache_dir = tempfile.mkdtemp(prefix='bench_sources_')
+    stats = {}
+    try:
+        for label in ('cold', 'warm'):
+            store = DomainStore()
+
+            def add_rule(item):
+                fields = item.split(',')
+                store.add(fields[1], suffix=(fields[0] == 'DOMAIN-SUFFIX'))
+
+            start = time.perf_counter()
+            async with aiohttp.ClientSession() as session:
+                await fetch_sources(session, [
+                    (f"{base_url}/lists/rules.list", parse_rule_line, add_rule),
+                    (f"{base_url}/lists/plain1.txt", parse_plain_line, store.add),
+                    (f"{base_url}/lists/plain2.txt", parse_plain_line, store.add),
+                    (f"{base_url}/lists/adblock.txt", parse_adblock_line, store.add),
+                ], cache_dir)
+            store.freeze()
+            elapsed = time.perf_counter() - start
+            stats[label] = {'seconds': round(elapsed, 3), 'domains': len(store), 'dropped': store.dropped,
+                            'lines_per_second': round(per_list * 4 / elapsed), 'store_bytes': store.nbytes}
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return stats
+
+async def bench_resolve(count, config, resolvers):
+    """解析：多个解析器共用工作窃取调度器，替身服务器带延迟、错误与 429"""
+    runner, base_url = await start_app(doh_app(config))
+    url = f"{base_url}/dns-query"
+    backends = {f"r{i}": Timed(lambda session, domain: query_dns_wire(session, url, domain)) for i in range(resolvers)}
+    try:
+        start = time.perf_counter()
+        results, failures, scheduler = await process_backends(synthetic_domains(count), backends)
+        elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    latencies = [latency for timed in backends.values() for latency in timed.latencies]
+    return {'domains': count, 'pairs': len(results), 'failures': len(failures), 'seconds': round(elapsed, 3),
+            'qps': round(count / elapsed, 1), 'upstream_requests': config.requests, **percentiles(latencies),
+            'cname_targets': default_target_cache().as_dict(),
+            'resolvers': {name: stats.as_dict() for name, stats in scheduler.stats.items()}}
+
+class TaskSampler:
+    """后台记录事件循环中同时存在的任务数峰值"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+
+    async def run(self):
+        while True:
+            self.peak = max(self.peak, len(asyncio.all_tasks()))
+            await asyncio.sleep(self.interval)
+
+async def sampled(coro):
+    sampler = TaskSampler()
+    task = asyncio.create_task(sampler.run())
+    start = time.perf_counter()
+    try:
+        await coro
+    finally:
+        task.cancel()
+    return time.perf_counter() - start, sampler.peak
+
+async def bench_bgp_gather(session, base_url, domains):
+    """改造前的写法：每个域名一个协程一次性 gather，整页 BeautifulSoup 解析"""
+    from bs4 import BeautifulSoup
+
+    async def query(domain):
+        async with session.get(f"{base_url}/dns/{domain}#_ipinfo") as response:
+            text = await response.text()
+        ip_info_div = BeautifulSoup(text, 'html.parser').find('div', id='ipinfo')
+        if ip_info_div:
+            return {a.get('title') for a in ip_info_div.find_all('a') if a.get('href', '').startswith('/ip/')}
+        return set()
+
+    results = []
+
+    async def run():
+        results.extend(await asyncio.gather(*(query(domain) for domain in domains), return_exceptions=True))
+
+    elapsed, peak = await sampled(run())
+    answered = sum(1 for ips in results if isinstance(ips, set) and ips)
+    return {'domains': len(domains), 'answered': answered, 'seconds': round(elapsed, 3),
+            'qps': round(len(domains) / elapsed, 1), 'peak_tasks': peak}
+
+async def bench_bgp_pipeline(session, base_url, domains, workers, parse_processes):
+    answered = 0
+
+    def on_result(domain, ips):
+        nonlocal answered
+        if ips:
+            answered += 1
+
+    # 替身服务器不需要对 bgp.he.net 的限速，只测流水线本身的吞吐
+    limiter = AdaptiveLimiter(rate=100000, concurrency=workers, max_concurrency=workers, max_rate=100000)
+    pipeline = BgpPipeline(session, on_result, base_url, fetch_workers=workers, parse_processes=parse_processes,
+                           limiter=limiter)
+    elapsed, peak = await sampled(pipeline.run(iter(domains)))
+    return {'domains': len(domains), 'answered': answered, 'failed': pipeline.failed, 'seconds': round(elapsed, 3),
+            'qps': round(len(domains) / elapsed, 1), 'peak_tasks': peak}
+
+async def bench_bgp(count, config, concurrency, parse_processes=0):
+    """bgp.he.net 路径：单次查询延迟，旧的无界 gather 与有界流水线的对比"""
+    runner, base_url = await start_app(bgp_app(config))
+    domains = synthetic_domains(count, seed=1)
+    try:
+        async with create_session() as session:
+            stats = {'query_bgp': await run_queries(domains, lambda domain: query_bgp(session, domain, base_url),
+                                                    concurrency),
+                     'pipeline': await bench_bgp_pipeline(session, base_url, domains, concurrency, parse_processes)}
+            try:
+                stats['gather'] = await bench_bgp_gather(session, base_url, domains)
+            except ImportError:
+                print("未安装 beautifulsoup4，跳过 gather 对照")
+    finally:
+        await runner.cleanup()
+    return stats
+
+async def bench_doh(count, config, concurrency):
+    """对比 JSON 两次顺序查询与二进制报文并发查询的吞吐"""
+    runner, base_url = await start_app(doh_app(config))
+    url = f"{base_url}/dns-query"
+    domains = synthetic_domains(count)
+    try:
+        async with create_session() as session:
+            json_stats = await run_queries(domains, lambda d: query_dns_json(
+                session, f"{url}?name={d}&type=A", f"{url}?name={d}&type=AAAA"), concurrency)
+            wire_stats = await run_queries(domains, lambda d: query_dns_wire(session, url, d), concurrency)
+    finally:
+        await runner.cleanup()
+    return {'json': json_stats, 'wire': wire_stats}
+
+# 探测类阶段使用的回环地址：127.0.<i>.1 上有监听，同一 /24 内的其他地址与 127.1.<i>.0/24 没有
+PROBE_PREFIXES = 6
+
+async def bench_probe(concurrency, handshake_step=0.004):
+    """延迟探测：127.0.<i>.1 上的 TLS 监听依次推迟 i × handshake_step 秒应答握手，
+    检查排名是否按延迟排序、全部拒绝连接的前缀是否提前停止"""
+    directory = tempfile.mkdtemp(prefix='bench_probe_')
+    context = self_signed_context(directory)
+    if context is None:
+        print("未找到 openssl，只测 TCP 连接")
+    servers = []
+    try:
+        port = 0
+        for i in range(PROBE_PREFIXES):
+            server, port = await start_tcp_listener(f"127.0.{i}.1", port, context, delay=i * handshake_step)
+            servers.append(server)
+        targets = os.path.join(directory, 'targets.txt')
+        with open(targets, 'w') as f:
+            f.writelines(f"127.0.{i}.{host}\n" for i in range(PROBE_PREFIXES) for host in range(1, 5))
+            f.writelines(f"127.1.{i}.{host}\n" for i in range(PROBE_PREFIXES) for host in range(1, 9))
+
+        prober = LatencyProber(port=port, tls=context is not None, timeout=1.0, concurrency=concurrency,
+                               per_prefix=2, min_samples=2, top=PROBE_PREFIXES)
+        start = time.perf_counter()
+        ranking = await prober.run(load_targets([targets]))
+        elapsed = time.perf_counter() - start
+    finally:
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        shutil.rmtree(directory, ignore_errors=True)
+    expected = [f"127.0.{i}.1" for i in range(PROBE_PREFIXES)]
+    return {'tls': context is not None, 'probed': prober.probed, 'failed': prober.failed, 'skipped': prober.skipped,
+            'stopped_prefixes': prober.stopped_prefixes, 'seconds': round(elapsed, 3),
+            'ranked_in_order': [result.ip for result in ranking] == expected,
+            'handshake_ms': [round((result.tls or 0) * 1000, 2) for result in ranking]}
+
+async def bench_colo(config, concurrency, samples=2):
+    """数据中心探测：trace 替身监听在 127.0.<i>.1，按本地地址返回不同的 colo；
+    第二次运行应全部命中索引，不再发出请求"""
+    runner = web.AppRunner(trace_app(config), access_log=None)
+    await runner.setup()
+    directory = tempfile.mkdtemp(prefix='bench_colo_')
+    try:
+        port = 0
+        for i in range(PROBE_PREFIXES):
+            site = web.TCPSite(runner, f"127.0.{i}.1", port)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+        targets = [f"127.0.{i}.{host}" for i in range(PROBE_PREFIXES) for host in (1, 2)]
+        index = ColoIndex(os.path.join(directory, 'colo_index.json'))
+        stats = {}
+        for label in ('cold', 'cached'):
+            requests = config.requests
+            start = time.perf_counter()
+            async with create_colo_session(samples, timeout=2) as session:
+                prober = ColoProber(session, index, host='stand-in.example', scheme='http', port=port,
+                                    concurrency=concurrency, per_colo=4, samples=samples)
+                results = await prober.run(targets)
+            stats[label] = {'seconds': round(time.perf_counter() - start, 3), 'probed': prober.probed,
+                            'failed': prober.failed, 'cached': prober.cached,
+                            'requests': config.requests - requests,
+                            'colos': len({colo for colo in results.values() if colo})}
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(directory, ignore_errors=True)
+    return stats
+
+def expected_ips(domain):
+    """替身 DNS 对 domain 应给出的全部地址"""
+    return {ipaddress.ip_address(value) for qtype in (TYPE_A, TYPE_AAAA)
+            for rtype, _, value in fake_records(domain, qtype) or () if rtype != TYPE_CNAME}
+
+async def bench_native(count, config, drop_rate, truncate_rate):
+    """直连 DNS：UDP 替身按比例丢包（触发重传）和截断（触发 TCP 回退），检查结果与替身一致"""
+    close, port = await start_dns_server(config, truncate_rate=truncate_rate, drop_rate=drop_rate)
+    # 替身与客户端共用一个事件循环，超时留足余量，重传主要来自替身的丢包
+    resolver = NativeResolver([('127.0.0.1', port)], timeout=0.5, retries=3)
+    targets = TargetCache()
+    backend = Timed(lambda session, domain: resolver.resolve(domain, targets))
+    limiter = AdaptiveLimiter(**LIMITER_OPTIONS['native'])
+    domains = synthetic_domains(count, seed=2)
+    try:
+        start = time.perf_counter()
+        results, failures, _ = await process_backends(domains, {'native': backend}, {'native': limiter})
+        elapsed = time.perf_counter() - start
+    finally:
+        resolver.close()
+        await close()
+    resolved = {}
+    for domain, ip in results:
+        resolved.setdefault(domain, set()).add(ipaddress.ip_address(ip))
+    mismatched = sum(1 for domain in domains
+                     if domain not in failures and resolved.get(domain, set()) != expected_ips(domain))
+    upstream = resolver.upstreams[0]
+    return {'domains': count, 'failed': len(failures), 'mismatched': mismatched, 'seconds': round(elapsed, 3),
+            'qps': round(count / elapsed, 1), 'sent': upstream.sent, 'retransmits': upstream.retransmits,
+            'tcp_fallbacks': upstream.tcp_fallbacks, 'cname_targets': targets.as_dict(),
+            **percentiles(backend.latencies)}
+
+async def run_stage(name, coro_or_func, report):
+    print(f"== {name}")
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    stats = await coro_or_func if asyncio.iscoroutine(coro_or_func) else coro_or_func()
+    stats['wall_seconds'] = round(time.perf_counter() - start, 3)
+    stats['cpu_seconds'] = round(time.process_time() - cpu_start, 3)
+    stats['peak_rss_mb'] = peak_rss_mb()
+    report['stages'][name] = stats
+    print(json.dumps(stats, ensure_ascii=False))
+
+async def run_isolated(args, name):
+    """在子进程中只运行一个阶段，返回它的统计；peak_rss_mb 因此只反映这一阶段"""
+    fd, output = tempfile.mkstemp(prefix=f'bench_{name}_', suffix='.json')
+    os.close(fd)
+    argv = []
+    for key, value in vars(args).items():
+        if key not in ('stages', 'output'):
+            argv += [f"--{key.replace('_', '-')}", str(value)]
+    try:
+        process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), *argv,
+                                                       '--stages', name, '--output', output)
+        if await process.wait() != 0:
+            return {'error': f"exit status {process.returncode}"}
+        with open(output, 'r') as f:
+            return json.load(f)['stages'].get(name, {})
+    finally:
+        os.remove(output)
+
+async def run(args):
+    count = SCALES[args.scale]
+    queries = min(count, args.max_queries)
+    config = lambda: StandInConfig(latency=args.latency, error_rate=args.error_rate,
+                                   rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, seed=args.seed)
+    report = {'scale': args.scale, 'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'stages': {}}
+
+    stages = args.stages.split(',')
+    if len(stages) > 1:
+        for name in stages:
+            report['stages'][name] = await run_isolated(args, name)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已写入 {os.path.abspath(args.output)}")
+        return report
+
+    if 'cidr' in stages:
+        await run_stage('cidr', lambda: bench_cidr(count), report)
+    if 'fetch' in stages:
+        await run_stage('fetch', bench_fetch(count, config()), report)
+    if 'resolve' in stages:
+        await run_stage('resolve', bench_resolve(queries, config(), args.resolvers), report)
+    if 'bgp' in stages:
+        await run_stage('bgp', bench_bgp(max(1, queries // 10), config(), args.concurrency, args.parse_processes),
+                        report)
+    if 'doh' in stages:
+        await run_stage('doh', bench_doh(queries, config(), args.concurrency), report)
+    if 'native' in stages:
+        await run_stage('native', bench_native(queries, config(), args.drop_rate, args.truncate_rate), report)
+    if 'probe' in stages:
+        await run_stage('probe', bench_probe(args.concurrency), report)
+    if 'colo' in stages:
+        await run_stage('colo', bench_colo(config(), args.concurrency), report)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"结果已写入 {os.path.abspath(args.output)}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地替身服务器上离线测试各阶段性能")
+    parser.add_argument('--scale', choices=SCALES, default='10k', help="合成数据规模")
+    parser.add_argument('--stages', default='cidr,fetch,resolve,bgp,doh,native,probe,colo', help="逗号分隔的阶段列表")
+    parser.add_argument('--max-queries', type=int, default=5000, help="网络查询阶段的域名数上限")
+    parser.add_argument('--resolvers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--parse-processes', type=int, default=0, help="bgp 流水线解析阶段的进程数")
+    parser.add_argument('--latency', type=float, default=0.005, help="替身服务器每个请求的延迟（秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 503 的比例")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument('--retry-after', type=float, default=1)
+    parser.add_argument('--drop-rate', type=float, default=0.02, help="DNS 替身丢弃 UDP 响应的比例")
+    parser.add_argument('--truncate-rate', type=float, default=0.05, help="DNS 替身回应截断（TC）的比例")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=RESULTS_FILE)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+from rate_control import BACKOFF_STATUSES, AdaptiveLimiter, parse_retry_after
+
+BGP_BASE_URL = 'https://bgp.he.net'
+
+# bgp.he.net 是公共服务：起步每秒 2 个请求，最多 10 个，遇到 429/5xx 或超时按 AIMD 退让
+BGP_LIMITER_OPTIONS = {'rate': 2.0, 'concurrency': 4, 'max_rate': 10.0}
+
+# #ipinfo 块里的地址链接形如 <a href="/ip/104.21.5.1" title="104.21.5.1">
+_IP_LINK = re.compile(r'<a\s[^>]*?href="/ip/([^"#?/]+)"', re.IGNORECASE)
+_IPINFO_START = re.compile(r'<div[^>]*\bid="ipinfo"[^>]*>', re.IGNORECASE)
+# #ipinfo 之后的下一个标签页或页脚即为块的结尾
+_IPINFO_END = re.compile(r'<div[^>]*(?:\bclass="tabdata"|\bid="footer")', re.IGNORECASE)
+
+def extract_ipinfo(html):
+    """只在 #ipinfo 块内查找 /ip/ 链接，不构建整页的 DOM，返回地址集合"""
+    start = _IPINFO_START.search(html)
+    if start is None:
+        return set()
+    end = _IPINFO_END.search(html, start.end())
+    block = html[start.end():end.start() if end else len(html)]
+    return set(_IP_LINK.findall(block))
+
+def default_limiter(fetch_workers):
+    return AdaptiveLimiter(max_concurrency=fetch_workers, **BGP_LIMITER_OPTIONS)
+
+async def fetch_page(session, domain, base_url=BGP_BASE_URL):
+    async with session.get(f"{base_url}/dns/{domain}") as response:
+        response.raise_for_status()
+        return await response.text()
+
+class BgpPipeline:
+    """有界队列流水线：域名 → 固定数量的抓取协程 → 解析阶段 → on_result(domain, ips)
+
+    两个队列都有上限，下游处理不过来时上游自动等待，内存占用与域名总数无关。
+    解析阶段默认在事件循环内执行；parse_processes > 0 时放到进程池中。
+    抓取经过 limiter 限速（默认 BGP_LIMITER_OPTIONS），fetch_workers 只是并发的上限。
+    抓取失败的域名以 ips=None 回调。
+    """
+
+    def __init__(self, session, on_result, base_url=BGP_BASE_URL, fetch_workers=32, parse_processes=0,
+                 queue_size=None, limiter=None):
+        self.session = session
+        self.on_result = on_result
+        self.base_url = base_url
+        self.fetch_workers = fetch_workers
+        self.limiter = limiter or default_limiter(fetch_workers)
+        self.parse_processes = parse_processes
+        self.queue_size = queue_size or fetch_workers * 2
+        self.fetched = 0
+        self.failed = 0
+
+    async def _produce(self, domains, queue):
+        for domain in domains:
+            await queue.put(domain)
+        for _ in range(self.fetch_workers):
+            await queue.put(None)
+
+    async def _fetch(self, domains, pages):
+        while True:
+            domain = await domains.get()
+            if domain is None:
+                break
+            await self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                html = await fetch_page(self.session, domain, self.base_url)
+            except Exception as e:
+                # 限流与服务端错误、超时、连接错误时退让；解码错误等只记为失败
+                if isinstance(e, aiohttp.ClientResponseError):
+                    if e.status in BACKOFF_STATUSES:
+                        self.limiter.on_failure(parse_retry_after((e.headers or {}).get('Retry-After')))
+                elif isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+                    self.limiter.on_failure()
+                print(f"查询 {domain} 失败: {e!r}")
+                self.failed += 1
+                self.on_result(domain, None)
+                continue
+            else:
+                self.limiter.on_success(time.monotonic() - start)
+            finally:
+                await self.limiter.release()
+            self.fetched += 1
+            await pages.put((domain, html))
+
+    async def _parse(self, pages, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await pages.get()
+            if item is None:
+                break
+            domain, html = item
+            if executor is None:
+                ips = extract_ipinfo(html)
+            else:
+                ips = await loop.run_in_executor(executor, extract_ipinfo, html)
+            self.on_result(domain, ips)
+
+    async def run(self, domains):
+        domain_queue = asyncio.Queue(self.queue_size)
+        page_queue = asyncio.Queue(self.queue_size)
+        parsers = max(1, self.parse_processes)
+        executor = ProcessPoolExecutor(self.parse_processes) if self.parse_processes else None
+        parse_tasks = [asyncio.create_task(self._parse(page_queue, executor)) for _ in range(parsers)]
+        fetch_tasks = [asyncio.create_task(self._produce(domains, domain_queue))]
+        fetch_tasks += [asyncio.create_task(self._fetch(domain_queue, page_queue)) for _ in range(self.fetch_workers)]
+        try:
+            await asyncio.gather(*fetch_tasks)
+            for _ in range(parsers):
+                await page_queue.put(None)
+            await asyncio.gather(*parse_tasks)
+        finally:
+            # 任一阶段出错时其余协程还在等待有界队列，全部取消以免挂起
+            for task in fetch_tasks + parse_tasks:
+                task.cancel()
+            if executor is not None:
+                executor.shutdown()
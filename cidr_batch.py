@@ -0,0 +1,114 @@
+import socket
+
+import numpy as np
+
+# IPv6 以高低两个 uint64 存储，结构化类型按字段顺序排序，等价于 128 位整数比较
+IPV6_DTYPE = np.dtype([('hi', '<u8'), ('lo', '<u8')])
+
+def _pack(strings, family):
+    """把 IP 字符串打包成连续的大端字节，返回 (字节串, 有效行号, 无效行号)"""
+    try:
+        return b''.join([socket.inet_pton(family, s) for s in strings]), None, []
+    except OSError:
+        pass
+    # 存在无效地址时逐行处理
+    chunks, valid, invalid = [], [], []
+    for i, s in enumerate(strings):
+        try:
+            chunks.append(socket.inet_pton(family, s))
+            valid.append(i)
+        except OSError:
+            invalid.append(i)
+    return b''.join(chunks), valid, invalid
+
+def _ipv6_from_bytes(buf):
+    halves = np.frombuffer(buf, dtype='>u8').reshape(-1, 2)
+    packed = np.empty(len(halves), dtype=IPV6_DTYPE)
+    packed['hi'] = halves[:, 0]
+    packed['lo'] = halves[:, 1]
+    return packed
+
+def pack_ips(ips):
+    """把 IP 字符串批量转换为整数数组
+
+    返回 (v4, v4_rows, v6, v6_rows, invalid_rows)：v4 为 uint32 数组，v6 为 IPV6_DTYPE 数组，
+    rows 为对应元素在输入中的行号。
+    """
+    ips = np.asarray(ips, dtype=object)
+    rows = np.arange(len(ips))
+    is_v6 = np.fromiter((':' in ip for ip in ips), dtype=bool, count=len(ips))
+
+    v4_rows, v6_rows = rows[~is_v6], rows[is_v6]
+    buf, valid, invalid4 = _pack(ips[v4_rows], socket.AF_INET)
+    v4 = np.frombuffer(buf, dtype='>u4').astype(np.uint32)
+    invalid = list(v4_rows[invalid4])
+    if valid is not None:
+        v4_rows = v4_rows[valid]
+
+    buf, valid, invalid6 = _pack(ips[v6_rows], socket.AF_INET6)
+    v6 = _ipv6_from_bytes(buf)
+    invalid.extend(v6_rows[invalid6])
+    if valid is not None:
+        v6_rows = v6_rows[valid]
+
+    return v4, v4_rows, v6, v6_rows, sorted(invalid)
+
+def format_ipv4(values):
+    buf = np.asarray(values, dtype='>u4').tobytes()
+    return [socket.inet_ntop(socket.AF_INET, buf[i:i + 4]) for i in range(0, len(buf), 4)]
+
+def format_ipv6(values):
+    halves = np.empty((len(values), 2), dtype='>u8')
+    halves[:, 0] = values['hi']
+    halves[:, 1] = values['lo']
+    buf = halves.tobytes()
+    return [socket.inet_ntop(socket.AF_INET6, buf[i:i + 16]) for i in range(0, len(buf), 16)]
+
+class BatchClassifier:
+    """基于 CidrIndex 的合并区间表，一次 searchsorted 完成整批 IP 的归属判断"""
+
+    def __init__(self, cidr_index):
+        starts, ends = cidr_index.intervals(4)
+        self._v4_starts = np.array(starts, dtype=np.uint32)
+        self._v4_ends = np.array(ends, dtype=np.uint32)
+
+        starts, ends = cidr_index.intervals(6)
+        self._v6_starts = self._ipv6_array(starts)
+        self._v6_ends = self._ipv6_array(ends)
+
+    @staticmethod
+    def _ipv6_array(values):
+        packed = np.empty(len(values), dtype=IPV6_DTYPE)
+        packed['hi'] = [v >> 64 for v in values]
+        packed['lo'] = [v & 0xFFFFFFFFFFFFFFFF for v in values]
+        return packed
+
+    def match_ipv4(self, v4):
+        if not len(self._v4_starts):
+            return np.zeros(len(v4), dtype=bool)
+        i = np.searchsorted(self._v4_starts, v4, side='right') - 1
+        return (i >= 0) & (v4 <= self._v4_ends[np.maximum(i, 0)])
+
+    def match_ipv6(self, v6):
+        if not len(self._v6_starts):
+            return np.zeros(len(v6), dtype=bool)
+        i = np.searchsorted(self._v6_starts, v6, side='right') - 1
+        end = self._v6_ends[np.maximum(i, 0)]
+        # 结构化数组不支持比较运算，按高低位分别比较
+        within = (v6['hi'] < end['hi']) | ((v6['hi'] == end['hi']) & (v6['lo'] <= end['lo']))
+        return (i >= 0) & within
+
+    def classify(self, ips):
+        """返回 (匹配掩码, 命中的 v4 数组, 命中的 v6 数组, 无效行号)"""
+        v4, v4_rows, v6, v6_rows, invalid = pack_ips(ips)
+        hit4 = self.match_ipv4(v4)
+        hit6 = self.match_ipv6(v6)
+
+        mask = np.zeros(len(ips), dtype=bool)
+        mask[v4_rows[hit4]] = True
+        mask[v6_rows[hit6]] = True
+        return mask, v4[hit4], v6[hit6], invalid
+
+def unique_sorted_ips(v4, v6):
+    """在整数数组上排序去重后再格式化，IPv4 在前，IPv6 在后"""
+    return format_ipv4(np.unique(v4)) + format_ipv6(np.unique(v6))
@@ -0,0 +1,141 @@
+import bisect
+import ipaddress
+import random
+import sys
+import time
+
+class CidrIndex:
+    """IPv4/IPv6 CIDR 索引：区间表二分判断归属，按前缀长度哈希做最长前缀匹配"""
+
+    def __init__(self, networks=()):
+        # 每个版本一份：合并后的不相交区间 [start, end]，以及 {前缀长度: {网络地址整数: 网络}}
+        self._starts = {4: [], 6: []}
+        self._ends = {4: [], 6: []}
+        self._by_len = {4: {}, 6: {}}
+        self._lens = {4: [], 6: []}
+        self._count = 0
+        self._build(networks)
+
+    @classmethod
+    def from_lines(cls, lines):
+        """从文本行构建索引，忽略空行与注释，无效的 CIDR 打印后跳过"""
+        networks = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                networks.append(ipaddress.ip_network(line, strict=False))
+            except ValueError as e:
+                print(f"无效的CIDR: {line}. 错误: {e}")
+        return cls(networks)
+
+    @classmethod
+    def from_text(cls, text):
+        return cls.from_lines(text.splitlines())
+
+    def _build(self, networks):
+        intervals = {4: [], 6: []}
+        for network in networks:
+            start = int(network.network_address)
+            intervals[network.version].append((start, start + network.num_addresses - 1))
+            self._by_len[network.version].setdefault(network.prefixlen, {})[start] = network
+            self._count += 1
+
+        for version, items in intervals.items():
+            items.sort()
+            starts, ends = self._starts[version], self._ends[version]
+            for start, end in items:
+                # 与上一个区间重叠或相邻时直接合并
+                if ends and start <= ends[-1] + 1:
+                    if end > ends[-1]:
+                        ends[-1] = end
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._lens[version] = sorted(self._by_len[version], reverse=True)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, ip):
+        return self.contains(ip)
+
+    @staticmethod
+    def _parse(ip):
+        if isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            return ip.version, int(ip)
+        ip_obj = ipaddress.ip_address(ip)
+        return ip_obj.version, int(ip_obj)
+
+    def contains(self, ip):
+        """判断 IP 是否落在任一 CIDR 内，O(log n)"""
+        version, value = self._parse(ip)
+        return self.contains_int(version, value)
+
+    def contains_int(self, version, value):
+        starts = self._starts[version]
+        i = bisect.bisect_right(starts, value) - 1
+        return i >= 0 and value <= self._ends[version][i]
+
+    def longest_match(self, ip):
+        """返回包含该 IP 的最长前缀网络，没有则返回 None，O(前缀长度)"""
+        version, value = self._parse(ip)
+        max_len = 32 if version == 4 else 128
+        for prefixlen in self._lens[version]:
+            key = value >> (max_len - prefixlen) << (max_len - prefixlen)
+            network = self._by_len[version][prefixlen].get(key)
+            if network is not None:
+                return network
+        return None
+
+    def intervals(self, version):
+        """合并后的 (starts, ends) 区间表，供批量匹配使用"""
+        return self._starts[version], self._ends[version]
+
+async def fetch_cidr_index(session, url):
+    async with session.get(url) as response:
+        text = await response.text()
+    return CidrIndex.from_text(text)
+
+def benchmark(cidr_lines, ip_count=20000, seed=0):
+    """与原来逐个 CIDR 线性扫描的方式对比匹配耗时"""
+    rng = random.Random(seed)
+    cidr_list = [ipaddress.ip_network(line.strip(), strict=False) for line in cidr_lines if line.strip()]
+    index = CidrIndex(cidr_list)
+
+    # 一半取自 CIDR 内部，一半随机，保证命中与未命中都有
+    ips = []
+    for _ in range(ip_count):
+        network = rng.choice(cidr_list)
+        if rng.random() < 0.5:
+            ips.append(str(network.network_address + rng.randrange(network.num_addresses)))
+        else:
+            ips.append(str(type(network.network_address)(rng.getrandbits(network.max_prefixlen))))
+
+    t0 = time.perf_counter()
+    scan_hits = 0
+    for ip in ips:
+        ip_obj = ipaddress.ip_address(ip)
+        if any(ip_obj in cidr for cidr in cidr_list):
+            scan_hits += 1
+    scan_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    index_hits = sum(1 for ip in ips if index.contains(ip))
+    index_time = time.perf_counter() - t0
+
+    if scan_hits != index_hits:
+        raise AssertionError(f"匹配结果不一致: 线性扫描 {scan_hits}, 索引 {index_hits}")
+
+    print(f"CIDR数量: {len(cidr_list)}, IP数量: {ip_count}, 命中: {index_hits}")
+    print(f"线性扫描: {scan_time:.3f}s ({ip_count / scan_time:.0f} IP/s)")
+    print(f"CIDR索引: {index_time:.3f}s ({ip_count / index_time:.0f} IP/s)")
+    return {'cidrs': len(cidr_list), 'ips': ip_count, 'scan_seconds': scan_time, 'index_seconds': index_time}
+
+if __name__ == "__main__":
+    # 用法: python cidr_index.py [CIDR文件] [IP数量]
+    cidr_file = sys.argv[1] if len(sys.argv) > 1 else 'ipv4_prefixes.txt'
+    ip_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    with open(cidr_file, 'r') as f:
+        benchmark(f.read().splitlines(), ip_count)
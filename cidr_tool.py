@@ -0,0 +1,162 @@
+import argparse
+import csv
+import ipaddress
+import sys
+
+from cidr_index import CidrIndex
+
+DEFAULT_CIDR_FILES = ['ipv4_prefixes.txt', 'ipv6_prefixes.txt', '关键CIDR2.txt']
+NOT_FOUND = '未找到'
+
+def read_lines(path):
+    """逐行读取，'-' 表示标准输入"""
+    handle = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8-sig')
+    try:
+        for line in handle:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+def read_networks(path):
+    for line in read_lines(path):
+        try:
+            yield ipaddress.ip_network(line, strict=False)
+        except ValueError as e:
+            print(f"无效的CIDR: {line}. 错误: {e}", file=sys.stderr)
+
+def open_output(path):
+    return sys.stdout if path in (None, '-') else open(path, 'w', encoding='utf-8', newline='')
+
+def load_index(paths):
+    lines = []
+    for path in paths:
+        lines.extend(read_lines(path))
+    return CidrIndex.from_lines(lines)
+
+def target_prefix(network, args):
+    """按地址族取 --v4-prefix / --v6-prefix，未指定时返回 None"""
+    return args.v4_prefix if network.version == 4 else args.v6_prefix
+
+def backfill(args):
+    """把测速后的 IP 映射回所属 CIDR，保留原有的列（取代 公式.txt 中的 Excel 公式）"""
+    index = load_index(args.cidr_files)
+    found = missing = short = 0
+    out = open_output(args.output)
+    try:
+        writer = csv.writer(out, delimiter=args.delimiter)
+        reader = csv.reader((line for line in read_lines(args.input)), delimiter=args.delimiter)
+        for row_number, row in enumerate(reader):
+            if not row:
+                continue
+            if len(row) <= args.ip_column:
+                print(f"跳过第 {row_number + 1} 行: 没有第 {args.ip_column} 列", file=sys.stderr)
+                short += 1
+                continue
+            ip = row[args.ip_column].strip().split('/')[0]
+            try:
+                network = index.longest_match(ip)
+            except ValueError:
+                if row_number == 0 and args.header:
+                    writer.writerow(['CIDR'] + row)
+                    continue
+                network = None
+            if network is None:
+                missing += 1
+            else:
+                found += 1
+            writer.writerow([str(network) if network is not None else NOT_FOUND] + row)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"匹配到 CIDR: {found}，{NOT_FOUND}: {missing}，列数不足跳过: {short}", file=sys.stderr)
+
+def split(args):
+    """把前缀短于目标长度的 CIDR 拆分为目标长度的子网，IPv4 与 IPv6 分别使用各自的目标长度"""
+    out = open_output(args.output)
+    try:
+        for network in read_networks(args.input):
+            prefix = target_prefix(network, args)
+            if prefix is None or network.prefixlen >= prefix:
+                out.write(f"{network}\n")
+                continue
+            if prefix > network.max_prefixlen or (1 << (prefix - network.prefixlen)) > args.max_per_cidr:
+                print(f"跳过 {network}: 拆分为 /{prefix} 数量过多", file=sys.stderr)
+                continue
+            out.writelines(f"{subnet}\n" for subnet in network.subnets(new_prefix=prefix))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+def collapse(args):
+    """合并为最小覆盖；指定 --v4-prefix / --v6-prefix 时先把对应地址族的网络截断到该长度（如 /24 与 /48 聚合）"""
+    v4, v6 = [], []
+    for network in read_networks(args.input):
+        prefix = target_prefix(network, args)
+        if prefix is not None and prefix < network.prefixlen:
+            network = network.supernet(new_prefix=prefix)
+        (v4 if network.version == 4 else v6).append(network)
+    out = open_output(args.output)
+    try:
+        # collapse_addresses 内部先排序再线性合并，O(n log n)
+        for networks in (v4, v6):
+            out.writelines(f"{network}\n" for network in ipaddress.collapse_addresses(networks))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+def strip(args):
+    """去除掩码，只保留网络地址（取代 去除掩码.bat）"""
+    out = open_output(args.output)
+    try:
+        out.writelines(f"{line.split('/')[0]}\n" for line in read_lines(args.input))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CIDR 回填、拆分与聚合工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('backfill', help="把测速结果中的 IP 映射回所属 CIDR")
+    p.add_argument('input', help="测速结果文件（CSV），'-' 表示标准输入")
+    p.add_argument('--cidr-files', nargs='+', default=DEFAULT_CIDR_FILES)
+    p.add_argument('--ip-column', type=int, default=0, help="IP 所在列（从 0 开始）")
+    p.add_argument('--delimiter', default=',')
+    p.add_argument('--header', action='store_true', help="第一行是表头")
+    p.add_argument('-o', '--output')
+    p.set_defaults(func=backfill)
+
+    p = subparsers.add_parser('split', help="拆分到目标前缀长度")
+    p.add_argument('input')
+    p.add_argument('--v4-prefix', type=int, help="IPv4 的目标前缀长度，未指定时 IPv4 原样输出")
+    p.add_argument('--v6-prefix', type=int, help="IPv6 的目标前缀长度，未指定时 IPv6 原样输出")
+    p.add_argument('--max-per-cidr', type=int, default=65536)
+    p.add_argument('-o', '--output')
+    p.set_defaults(func=split)
+
+    p = subparsers.add_parser('collapse', help="聚合为最小覆盖")
+    p.add_argument('input')
+    p.add_argument('--v4-prefix', type=int, help="IPv4 先截断到该前缀长度再聚合")
+    p.add_argument('--v6-prefix', type=int, help="IPv6 先截断到该前缀长度再聚合")
+    p.add_argument('-o', '--output')
+    p.set_defaults(func=collapse)
+
+    p = subparsers.add_parser('strip', help="去除掩码")
+    p.add_argument('input')
+    p.add_argument('-o', '--output')
+    p.set_defaults(func=strip)
+
+    args = parser.parse_args(argv)
+    if args.func is split and args.v4_prefix is None and args.v6_prefix is None:
+        parser.error("split 需要 --v4-prefix 或 --v6-prefix")
+    for option, limit in (('v4_prefix', 32), ('v6_prefix', 128)):
+        value = getattr(args, option, None)
+        if value is not None and not 0 <= value <= limit:
+            parser.error(f"--{option.replace('_', '-')} 必须在 0 到 {limit} 之间")
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
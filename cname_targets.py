@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from dns_message import RCODE_NOERROR, TYPE_A, TYPE_AAAA, TYPE_CNAME, build_result
+
+# 目标地址在缓存中至少保留的秒数；一次运行中同一个 CDN 目标会被成千上万个域名引用
+MIN_TARGET_TTL = 300
+
+def cname_target(name, response):
+    """沿应答中的 CNAME 链走到最终目标，没有 CNAME 时返回 None"""
+    links = {record.name: record.data for record in response.answers if record.type == TYPE_CNAME}
+    target = None
+    current = name.rstrip('.').lower()
+    for _ in range(len(links)):
+        if current not in links:
+            break
+        target = current = links[current]
+    return target
+
+class TargetCache:
+    """CNAME 目标 → 应答的共享缓存，所有解析器共用
+
+    同一目标的并发查询合并为一次上游请求，其余调用等待同一个结果。
+    只缓存 NOERROR 应答，SERVFAIL 等失败不会在 min_ttl 内挡住之后的查询。
+    """
+
+    def __init__(self, min_ttl=MIN_TARGET_TTL):
+        self.min_ttl = min_ttl
+        self._entries = {}   # (目标, 类型) -> (应答, 过期时间)
+        self._in_flight = {}  # (目标, 类型) -> Task
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    async def get(self, target, qtype, query):
+        """返回目标的应答，必要时调用 query(target, qtype) 查询一次"""
+        key = (target, qtype)
+        response = self._fresh(key)
+        if response is not None:
+            self.hits += 1
+            return response
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(query(target, qtype))
+        self._in_flight[key] = task
+        try:
+            response = await asyncio.shield(task)
+        finally:
+            if self._in_flight.get(key) is task:
+                del self._in_flight[key]
+        self.put(target, qtype, response)
+        return response
+
+    def put(self, target, qtype, response):
+        if response.rcode != RCODE_NOERROR:
+            return
+        ttls = [record.ttl for record in response.answers if record.type == qtype]
+        self._entries[(target, qtype)] = (response, time.monotonic() + max(self.min_ttl, min(ttls, default=0)))
+
+    def as_dict(self):
+        return {'targets': len(self._entries), 'hits': self.hits, 'coalesced': self.coalesced,
+                'misses': self.misses}
+
+async def resolve_via_targets(domain, query, cache):
+    """先单独查 A；应答经过 CNAME 时，AAAA 改为查询共享缓存中的最终目标
+
+    query(name, qtype) 返回 DnsResponse。A 与 AAAA 不同时发出：限速的上游按请求计费，
+    指向已知目标的域名只需要一次上游请求，同一目标的 AAAA 在所有域名之间只查一次。
+    没有 CNAME 的域名仍对自身查询 AAAA。
+    """
+    a_response = await query(domain, TYPE_A)
+    target = cname_target(domain, a_response) if a_response.rcode == RCODE_NOERROR else None
+    if target is None:
+        aaaa_response = await query(domain, TYPE_AAAA)
+    else:
+        aaaa_response = await cache.get(target, TYPE_AAAA, query)
+    return build_result([a_response, aaaa_response])
+
+_default_cache = None
+
+def default_target_cache():
+    """当前事件循环共用的目标缓存"""
+    global _default_cache
+    loop = asyncio.get_running_loop()
+    if _default_cache is None or _default_cache[0] is not loop:
+        _default_cache = (loop, TargetCache())
+    return _default_cache[1]
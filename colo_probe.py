@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+
+from latency_probe import prefix_of
+
+INDEX_FILE = 'colo_index.json'
+RESULT_FILE = 'colo_result.csv'
+RESULT_HEADER = 'IP 地址,数据中心'
+TRACE_PATH = '/cdn-cgi/trace'
+
+# 索引中的数据中心在该时间内视为有效，不再重复探测
+MAX_AGE = 7 * 24 * 3600
+
+# 还不知道属于哪个数据中心的目标共用一个并发池
+UNKNOWN = '?'
+
+def parse_cf_ray(value):
+    """CF-Ray 形如 8d2c6f0e9a1b2c3d-HKG，最后一段为数据中心代码"""
+    if not value or '-' not in value:
+        return None
+    return value.strip().rsplit('-', 1)[1].upper() or None
+
+def parse_trace(text):
+    """/cdn-cgi/trace 返回 key=value 行，取 colo 字段"""
+    for line in text.splitlines():
+        key, _, value = line.partition('=')
+        if key == 'colo' and value:
+            return value.strip().upper()
+    return None
+
+def is_ip(target):
+    try:
+        ipaddress.ip_address(target)
+        return True
+    except ValueError:
+        return False
+
+def read_targets(paths):
+    """读取 IP 或域名列表；CSV（如 latency_top.csv）取第一列，跳过表头"""
+    targets = []
+    seen = set()
+    for path in paths:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for line in f:
+                target = line.split(',', 1)[0].strip()
+                if not target or target.startswith('#') or ' ' in target or target in seen:
+                    continue
+                seen.add(target)
+                targets.append(target)
+    return targets
+
+class ColoIndex:
+    """IP（或域名）→ 数据中心的缓存索引，记录每次检测时间"""
+
+    def __init__(self, path=INDEX_FILE, max_age=MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, target):
+        entry = self.entries.get(target)
+        return entry[0] if entry else None
+
+    def is_fresh(self, target, now=None):
+        entry = self.entries.get(target)
+        return entry is not None and (now or time.time()) - entry[1] < self.max_age
+
+    def set(self, target, colo, now=None):
+        self.entries[target] = [colo, int(now or time.time())]
+
+    def by_colo(self, targets=None):
+        groups = {}
+        for target in (self.entries if targets is None else targets):
+            colo = self.get(target)
+            if colo:
+                groups.setdefault(colo, []).append(target)
+        return groups
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, sort_keys=True, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+def create_session(limit_per_host=2, timeout=10):
+    """按 IP 保持长连接；只读取响应头和 trace，不校验证书"""
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=limit_per_host, keepalive_timeout=60,
+                                     ssl=False, ttl_dns_cache=3600)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+class ColoProber:
+    """批量检测目标所在的 Cloudflare 数据中心
+
+    IP 目标连接该 IP 并把 Host/SNI 改为 host；域名目标直接访问。
+    method 为 'trace' 时请求 /cdn-cgi/trace 读取 colo 字段，为 'head' 时只发 HEAD
+    读取 CF-Ray。同一数据中心的在途请求不超过 per_colo，数据中心由索引中的旧记录
+    或本次运行中同一 /24、/48 的结果推测，推测不出的归入 UNKNOWN 池。
+    """
+
+    def __init__(self, session, index, host=None, method='trace', scheme='https', port=None,
+                 concurrency=200, per_colo=16, unknown_limit=None, samples=1):
+        self.session = session
+        self.index = index
+        self.host = host
+        self.method = method
+        self.scheme = scheme
+        self.port = port
+        self.concurrency = concurrency
+        self.per_colo = per_colo
+        self.unknown_limit = unknown_limit or concurrency
+        self.samples = samples
+        self.limits = {}
+        self.prefix_colos = {}
+        self.probed = 0
+        self.failed = 0
+        self.cached = 0
+
+    def url_for(self, target):
+        host = f"[{target}]" if ':' in target else target
+        port = f":{self.port}" if self.port else ''
+        path = TRACE_PATH if self.method == 'trace' else '/'
+        return f"{self.scheme}://{host}{port}{path}"
+
+    async def probe_once(self, target):
+        headers = {}
+        kwargs = {}
+        if self.host and is_ip(target):
+            headers['Host'] = self.host
+            if self.scheme == 'https':
+                kwargs['server_hostname'] = self.host
+        method = 'GET' if self.method == 'trace' else 'HEAD'
+        async with self.session.request(method, self.url_for(target), headers=headers,
+                                        allow_redirects=False, **kwargs) as response:
+            colo = parse_cf_ray(response.headers.get('CF-Ray'))
+            if self.method == 'trace' and response.status == 200:
+                colo = parse_trace(await response.text()) or colo
+            return colo
+
+    async def probe(self, target):
+        """多次采样时复用同一条长连接，取出现次数最多的数据中心"""
+        colos = Counter()
+        for _ in range(self.samples):
+            try:
+                colo = await self.probe_once(target)
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError):
+                continue
+            if colo:
+                colos[colo] += 1
+        return colos.most_common(1)[0][0] if colos else None
+
+    def _prefix(self, target):
+        return prefix_of(target) if is_ip(target) else None
+
+    def limit_for(self, target):
+        colo = self.index.get(target) or self.prefix_colos.get(self._prefix(target)) or UNKNOWN
+        if colo not in self.limits:
+            self.limits[colo] = asyncio.Semaphore(self.unknown_limit if colo == UNKNOWN else self.per_colo)
+        return self.limits[colo]
+
+    async def run(self, targets, now=None):
+        now = now or time.time()
+        pending = []
+        for target in targets:
+            if self.index.is_fresh(target, now):
+                self.cached += 1
+            else:
+                pending.append(target)
+        work = iter(pending)
+
+        async def worker():
+            for target in work:
+                async with self.limit_for(target):
+                    colo = await self.probe(target)
+                self.probed += 1
+                if colo is None:
+                    self.failed += 1
+                    continue
+                self.index.set(target, colo, now)
+                prefix = self._prefix(target)
+                if prefix is not None:
+                    self.prefix_colos[prefix] = colo
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return {target: self.index.get(target) for target in targets}
+
+def write_results(path, results):
+    """按数据中心分组输出，未检测到的排在最后"""
+    rows = sorted(results.items(), key=lambda item: (item[1] is None, item[1] or ''))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(RESULT_HEADER + '\n')
+        f.writelines(f"{target},{colo or ''}\n" for target, colo in rows)
+
+async def run(args):
+    targets = read_targets(args.inputs)
+    index = ColoIndex(args.index, args.max_age * 3600)
+    start = time.perf_counter()
+    async with create_session(args.samples, args.timeout) as session:
+        prober = ColoProber(session, index, host=args.host, method=args.method, scheme=args.scheme,
+                            port=args.port, concurrency=args.concurrency, per_colo=args.per_colo,
+                            samples=args.samples)
+        results = await prober.run(targets)
+    index.save()
+    write_results(args.output, results)
+
+    counts = Counter(colo for colo in results.values() if colo)
+    print(f"共 {len(targets)} 个目标：缓存命中 {prober.cached}，探测 {prober.probed}，失败 {prober.failed}，"
+          f"用时 {time.perf_counter() - start:.1f} 秒", file=sys.stderr)
+    print(' '.join(f"{colo}:{count}" for colo, count in counts.most_common()), file=sys.stderr)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="根据 CF-Ray 或 /cdn-cgi/trace 批量检测 IP/域名所在的数据中心")
+    parser.add_argument('inputs', nargs='+', help="IP 或域名列表文件，CSV 取第一列")
+    parser.add_argument('--host', help="连接 IP 时使用的 Host 与 SNI")
+    parser.add_argument('--method', choices=('trace', 'head'), default='trace')
+    parser.add_argument('--scheme', choices=('https', 'http'), default='https')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--concurrency', type=int, default=200, help="全局在途请求数")
+    parser.add_argument('--per-colo', type=int, default=16, help="单个数据中心的在途请求数")
+    parser.add_argument('--samples', type=int, default=1, help="每个目标的采样次数，复用同一连接")
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--max-age', type=float, default=MAX_AGE / 3600, help="索引记录的有效期（小时）")
+    parser.add_argument('--index', default=INDEX_FILE)
+    parser.add_argument('-o', '--output', default=RESULT_FILE)
+    return asyncio.run(run(parser.parse_args(argv)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import time
+
+# 增量文件与清单所在目录：<列表名>.added.txt / <列表名>.removed.txt / manifest.json
+DELTA_DIR = 'delta'
+MANIFEST_FILE = 'manifest.json'
+
+# 写入时每次拼接的行数
+WRITE_CHUNK = 4096
+
+_END = object()
+
+class UnsortedError(ValueError):
+    pass
+
+def iter_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _checked(items, key):
+    """按原顺序产出，发现未按 key 严格递增时抛出 UnsortedError"""
+    previous = _END
+    for item in items:
+        current = key(item)
+        if previous is not _END and current <= previous:
+            raise UnsortedError(item)
+        previous = current
+        yield item
+
+def sorted_diff(old, new, key=None):
+    """归并两个按 key 升序且无重复的序列，逐个产出 ('+', 新增项) 或 ('-', 删除项)
+
+    两边都只遍历一次，不需要把任何一边载入集合。
+    """
+    key = key or (lambda item: item)
+    old, new = iter(old), iter(new)
+    o, n = next(old, _END), next(new, _END)
+    while o is not _END or n is not _END:
+        if n is _END or (o is not _END and key(o) < key(n)):
+            yield '-', o
+            o = next(old, _END)
+        elif o is _END or key(n) < key(o):
+            yield '+', n
+            n = next(new, _END)
+        else:
+            o, n = next(old, _END), next(new, _END)
+
+def _write_lines(path, items):
+    """以 '\\n' 连接写入（末尾无换行，与原来的输出相同），按块写出并返回内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for i in range(0, len(items), WRITE_CHUNK):
+            data = (('\n' if i else '') + '\n'.join(items[i:i + WRITE_CHUNK])).encode('utf-8')
+            digest.update(data)
+            f.write(data)
+    return digest.hexdigest()
+
+def delta_paths(path, delta_dir=DELTA_DIR):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(delta_dir, f'{name}.added.txt'), os.path.join(delta_dir, f'{name}.removed.txt')
+
+def _write_delta(path, items, key, delta_dir):
+    added_path, removed_path = delta_paths(path, delta_dir)
+    old = iter_lines(path) if os.path.exists(path) else ()
+    try:
+        return _write_diff(sorted_diff(_checked(old, key or (lambda item: item)), items, key),
+                           added_path, removed_path)
+    except UnsortedError:
+        # 旧文件来自排序方式不同的版本，只在这一次整体排序后再归并
+        print(f"{path} 的顺序与当前不同，排序后再比较")
+        old = sorted(iter_lines(path), key=key)
+        return _write_diff(sorted_diff(old, items, key), added_path, removed_path)
+
+def _write_diff(diff, added_path, removed_path):
+    counts = {'+': 0, '-': 0}
+    with open(added_path + '.tmp', 'w', encoding='utf-8') as added, \
+            open(removed_path + '.tmp', 'w', encoding='utf-8') as removed:
+        outputs = {'+': added, '-': removed}
+        for sign, item in diff:
+            outputs[sign].write(item + '\n')
+            counts[sign] += 1
+    os.replace(added_path + '.tmp', added_path)
+    os.replace(removed_path + '.tmp', removed_path)
+    return counts['+'], counts['-']
+
+def update_list(path, items, key=None, delta_dir=DELTA_DIR):
+    """把按 key 排序去重的 items 写入 path，同时生成相对旧文件的增量，返回清单条目
+
+    内容与旧文件完全相同时列表和增量文件都不改动，返回的条目 changed 为 False。
+    """
+    base_hash = file_sha256(path) if os.path.exists(path) else None
+    tmp_path = path + '.tmp'
+    content_hash = _write_lines(tmp_path, items)
+    entry = {'count': len(items), 'sha256': content_hash}
+    if content_hash == base_hash:
+        os.remove(tmp_path)
+        entry['changed'] = False
+        return entry
+
+    os.makedirs(delta_dir, exist_ok=True)
+    added, removed = _write_delta(path, items, key, delta_dir)
+    os.replace(tmp_path, path)
+    added_path, removed_path = delta_paths(path, delta_dir)
+    entry.update({'changed': True, 'base_sha256': base_hash, 'added': added, 'removed': removed,
+                  'added_file': added_path, 'removed_file': removed_path})
+    return entry
+
+def load_manifest(delta_dir=DELTA_DIR):
+    try:
+        with open(os.path.join(delta_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(entries, delta_dir=DELTA_DIR):
+    """entries 为 {列表文件: update_list 的返回值}；消费者的本地内容与 base_sha256 相同时可直接应用增量
+
+    未变化的列表沿用上一份清单中的条目（它的增量文件也没有改动）；所有列表都未变化时不重写清单。
+    """
+    previous = load_manifest(delta_dir) or {'files': {}}
+    files = {}
+    for path, entry in entries.items():
+        old = previous['files'].get(path)
+        entry = dict(entry)
+        if entry.pop('changed'):
+            files[path] = entry
+        elif old is not None and old.get('sha256') == entry['sha256']:
+            files[path] = old
+        else:
+            files[path] = dict(entry, base_sha256=entry['sha256'], added=0, removed=0,
+                               added_file=None, removed_file=None)
+    if files == previous['files']:
+        return previous
+
+    manifest = {'generated_at': int(time.time()), 'files': files}
+    os.makedirs(delta_dir, exist_ok=True)
+    path = os.path.join(delta_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    return manifest
@@ -0,0 +1,154 @@
+import socket
+import struct
+from collections import namedtuple
+
+# 记录类型与响应码
+TYPE_A = 1
+TYPE_CNAME = 5
+TYPE_AAAA = 28
+CLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+FLAG_RD = 0x0100
+FLAG_TC = 0x0200
+
+DnsRecord = namedtuple('DnsRecord', 'name type ttl data')
+DnsResponse = namedtuple('DnsResponse', 'txid rcode truncated answers')
+# 一个域名的最终解析结果：ips 为 A/AAAA 地址，ttl 为地址记录的最小 TTL，cnames 为 CNAME 链
+DnsResult = namedtuple('DnsResult', 'ips ttl rcode cnames')
+
+_HEADER = struct.Struct('!HHHHHH')
+_RR = struct.Struct('!HHIH')
+
+class DnsFormatError(ValueError):
+    pass
+
+def encode_name(name):
+    name = name.strip().rstrip('.')
+    out = bytearray()
+    if name:
+        for label in name.split('.'):
+            raw = label.encode('idna') if not label.isascii() else label.encode('ascii')
+            if not raw or len(raw) > 63:
+                raise DnsFormatError(f"无效的域名标签: {name}")
+            out.append(len(raw))
+            out += raw
+    out.append(0)
+    if len(out) > 255:
+        raise DnsFormatError(f"域名过长: {name}")
+    return bytes(out)
+
+def encode_query(name, qtype, txid=0):
+    """构造一个递归查询报文；DoH 按 RFC 8484 建议使用 txid=0 以便缓存"""
+    header = _HEADER.pack(txid, FLAG_RD, 1, 0, 0, 0)
+    return header + encode_name(name) + struct.pack('!HH', qtype, CLASS_IN)
+
+def _decode_name(data, offset):
+    labels = []
+    jumped = False
+    end = offset
+    for _ in range(128):  # 防止压缩指针成环
+        if offset >= len(data):
+            raise DnsFormatError("报文被截断")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise DnsFormatError("报文被截断")
+            if not jumped:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            jumped = True
+        elif length == 0:
+            if not jumped:
+                end = offset + 1
+            return '.'.join(labels), end
+        else:
+            labels.append(data[offset + 1:offset + 1 + length].decode('ascii', 'replace').lower())
+            offset += 1 + length
+    raise DnsFormatError("压缩指针过多")
+
+def decode_response(data):
+    if len(data) < _HEADER.size:
+        raise DnsFormatError("报文过短")
+    txid, flags, qdcount, ancount, _, _ = _HEADER.unpack_from(data)
+    offset = _HEADER.size
+    for _ in range(qdcount):
+        _, offset = _decode_name(data, offset)
+        offset += 4
+
+    answers = []
+    for _ in range(ancount):
+        name, offset = _decode_name(data, offset)
+        if offset + _RR.size > len(data):
+            raise DnsFormatError("报文被截断")
+        rtype, _, ttl, rdlength = _RR.unpack_from(data, offset)
+        offset += _RR.size
+        rdata = data[offset:offset + rdlength]
+        if rtype == TYPE_A and rdlength == 4:
+            value = socket.inet_ntop(socket.AF_INET, rdata)
+        elif rtype == TYPE_AAAA and rdlength == 16:
+            value = socket.inet_ntop(socket.AF_INET6, rdata)
+        elif rtype == TYPE_CNAME:
+            value, _ = _decode_name(data, offset)
+        else:
+            value = rdata
+        answers.append(DnsRecord(name, rtype, ttl, value))
+        offset += rdlength
+
+    return DnsResponse(txid, flags & 0x000F, bool(flags & FLAG_TC), answers)
+
+def build_result(responses):
+    """合并同一域名 A/AAAA 两次查询的响应"""
+    ips = []
+    cnames = []
+    ttls = []
+    rcode = RCODE_NOERROR
+    for response in responses:
+        if response.rcode != RCODE_NOERROR:
+            rcode = response.rcode
+        for record in response.answers:
+            if record.type in (TYPE_A, TYPE_AAAA):
+                if record.data not in ips:
+                    ips.append(record.data)
+                ttls.append(record.ttl)
+            elif record.type == TYPE_CNAME and record.data not in cnames:
+                cnames.append(record.data)
+    # 任一查询拿到地址即视为成功
+    if ips:
+        rcode = RCODE_NOERROR
+    return DnsResult(ips, min(ttls) if ttls else None, rcode, tuple(cnames))
+
+def encode_response(query, records, rcode=RCODE_NOERROR):
+    """根据查询报文构造响应，records 为 (type, ttl, value) 列表；供本地替身服务器使用
+
+    与真实服务器相同，CNAME 之后的记录属于该 CNAME 的目标。
+    """
+    txid, flags, qdcount, _, _, _ = _HEADER.unpack_from(query)
+    _, offset = _decode_name(query, _HEADER.size)
+    question = query[_HEADER.size:offset + 4]
+    out = bytearray(_HEADER.pack(txid, 0x8000 | (flags & FLAG_RD) | 0x0080 | rcode, 1, len(records), 0, 0))
+    out += question
+    owner = b'\xc0\x0c'  # 压缩指针，指向问题区的域名
+    for rtype, ttl, value in records:
+        if rtype == TYPE_A:
+            rdata = socket.inet_pton(socket.AF_INET, value)
+        elif rtype == TYPE_AAAA:
+            rdata = socket.inet_pton(socket.AF_INET6, value)
+        elif rtype == TYPE_CNAME:
+            rdata = encode_name(value)
+        else:
+            rdata = bytes(value)
+        out += owner + _RR.pack(rtype, CLASS_IN, ttl, len(rdata)) + rdata
+        if rtype == TYPE_CNAME:
+            owner = rdata
+    return bytes(out)
+
+def question_of(query):
+    """解析查询报文，返回 (txid, name, qtype)"""
+    txid = _HEADER.unpack_from(query)[0]
+    name, offset = _decode_name(query, _HEADER.size)
+    qtype, _ = struct.unpack_from('!HH', query, offset)
+    return txid, name, qtype
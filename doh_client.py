@@ -0,0 +1,44 @@
+import base64
+
+import aiohttp
+
+from cname_targets import default_target_cache, resolve_via_targets
+from dns_message import DnsResult, decode_response, encode_query
+from rate_control import BACKOFF_STATUSES, RetryableError, parse_retry_after
+
+DNS_MESSAGE = 'application/dns-message'
+
+class DohError(RetryableError):
+    def __init__(self, url, status, retry_after=None):
+        super().__init__(f"{url} 返回状态码 {status}", status, retry_after)
+        self.url = url
+
+    @property
+    def retryable(self):
+        return self.status in BACKOFF_STATUSES
+
+def check_status(url, response):
+    if response.status != 200:
+        raise DohError(url, response.status, parse_retry_after(response.headers.get('Retry-After')))
+
+def create_session(limit_per_host=0):
+    """所有查询共用一个会话，按解析器保持长连接复用"""
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=limit_per_host, keepalive_timeout=60, ttl_dns_cache=3600)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=15))
+
+async def query_dns_message(session, url, name, qtype):
+    """发送一次 RFC 8484 GET 查询，返回解码后的 DnsResponse"""
+    message = encode_query(name, qtype)
+    params = {'dns': base64.urlsafe_b64encode(message).rstrip(b'=').decode('ascii')}
+    headers = {'accept': DNS_MESSAGE}
+    async with session.get(url, params=params, headers=headers) as response:
+        check_status(url, response)
+        return decode_response(await response.read())
+
+async def resolve(session, url, domain, targets=None):
+    """查询 A 与 AAAA，合并为一个 DnsResult；CNAME 目标的 AAAA 通过共享缓存只查一次"""
+    return await resolve_via_targets(domain, lambda name, qtype: query_dns_message(session, url, name, qtype),
+                                     targets or default_target_cache())
+
+def empty_result(rcode=0):
+    return DnsResult([], None, rcode, ())
@@ -0,0 +1,149 @@
+import heapq
+import re
+from array import array
+
+# 内部键使用反转后的标签，以 \x01 连接：它比任何合法域名字符都小，
+# 排序后某个域名的所有子域名紧跟在它后面
+SEP = '\x01'
+SEP_BYTE = SEP.encode()
+
+# 待合并的键达到该数量、且不少于已打包键数的一半时自动 freeze()，
+# 构建阶段常驻的只有打包后的 bytes 和一批待合并的键，合并的总开销仍是线性的
+FREEZE_BATCH = 100000
+
+# 规范化后的域名只允许这些字符；逗号等分隔符会破坏 domain,ip 结果格式
+DOMAIN_CHARS = re.compile(r'[a-z0-9._-]+')
+
+def normalize_domain(domain):
+    """小写、去掉末尾的点和通配前缀、非 ASCII 转为 IDNA，无效时返回 None"""
+    domain = domain.strip().lower().rstrip('.')
+    if domain.startswith('*.'):
+        domain = domain[2:]
+    domain = domain.lstrip('.')
+    if not domain or len(domain) > 253:
+        return None
+    if not domain.isascii():
+        try:
+            domain = domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+    if not DOMAIN_CHARS.fullmatch(domain):
+        return None
+    labels = domain.split('.')
+    if any(not label or len(label) > 63 for label in labels):
+        return None
+    return domain
+
+def reverse_key(domain):
+    return SEP.join(reversed(domain.split('.')))
+
+class DomainStore:
+    """紧凑的域名集合，支持 DOMAIN-SUFFIX 语义
+
+    add() 写入时就把键编码为 bytes，攒满一批后自动与已打包的部分归并；freeze() 后所有键按反转标签排序，
+    拼接进一个连续的 bytes，配合偏移表二分查找。被后缀规则覆盖的子域名在归并时丢弃。
+    """
+
+    def __init__(self, freeze_batch=FREEZE_BATCH):
+        self.freeze_batch = freeze_batch
+        self._pending = {}
+        self._blob = b''
+        self._offsets = array('I', [0])
+        self._suffix_flags = bytearray()
+        self.dropped = 0
+
+    def add(self, domain, suffix=False):
+        domain = normalize_domain(domain)
+        if domain is None:
+            return False
+        key = reverse_key(domain).encode('ascii')
+        self._pending[key] = self._pending.get(key, False) or suffix
+        if len(self._pending) >= max(self.freeze_batch, len(self._suffix_flags) // 2):
+            self.freeze()
+        return True
+
+    def freeze(self):
+        """把待写入的键归并进已打包的有序键中，可多次调用"""
+        if not self._pending:
+            return self
+        pending = sorted(self._pending.items())
+        self._pending = {}
+
+        blob = bytearray()
+        offsets = array('I', [0])
+        flags = bytearray()
+        root = None
+        previous = None
+        for key, suffix in heapq.merge(self._iter_raw(), pending):
+            if key == previous:
+                # 已打包与新写入的同一个键：合并后缀标志
+                if suffix and not flags[-1]:
+                    flags[-1] = 1
+                    root = key + SEP_BYTE
+                continue
+            if root is not None and key.startswith(root):
+                self.dropped += 1
+                continue
+            previous = key
+            blob += key
+            offsets.append(len(blob))
+            flags.append(suffix)
+            root = key + SEP_BYTE if suffix else None
+
+        self._blob = bytes(blob)
+        self._offsets = offsets
+        self._suffix_flags = flags
+        return self
+
+    def _key_at(self, i):
+        return self._blob[self._offsets[i]:self._offsets[i + 1]]
+
+    def _iter_raw(self):
+        for i in range(len(self._suffix_flags)):
+            yield self._key_at(i), bool(self._suffix_flags[i])
+
+    def _find(self, key):
+        raw = key.encode('ascii')
+        lo, hi = 0, len(self._suffix_flags)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < raw:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._suffix_flags) and self._key_at(lo) == raw:
+            return lo
+        return -1
+
+    def __len__(self):
+        return len(self._suffix_flags)
+
+    def __contains__(self, domain):
+        domain = normalize_domain(domain)
+        return domain is not None and self._find(reverse_key(domain)) >= 0
+
+    def covers(self, domain):
+        """domain 本身在集合中，或被某条后缀规则覆盖"""
+        domain = normalize_domain(domain)
+        if domain is None:
+            return False
+        labels = list(reversed(domain.split('.')))
+        for n in range(1, len(labels) + 1):
+            i = self._find(SEP.join(labels[:n]))
+            if i >= 0 and (self._suffix_flags[i] or n == len(labels)):
+                return True
+        return False
+
+    def is_suffix(self, domain):
+        domain = normalize_domain(domain)
+        i = self._find(reverse_key(domain)) if domain is not None else -1
+        return i >= 0 and bool(self._suffix_flags[i])
+
+    def __iter__(self):
+        """按反转标签顺序产出正常形式的域名"""
+        for i in range(len(self._suffix_flags)):
+            yield '.'.join(reversed(self._key_at(i).decode('ascii').split(SEP)))
+
+    @property
+    def nbytes(self):
+        return len(self._blob) + self._offsets.itemsize * len(self._offsets) + len(self._suffix_flags)
@@ -1,6 +1,11 @@
+import argparse
 import asyncio
 import aiohttp
 
+from domain_store import DomainStore
+from source_fetch import fetch_sources, parse_adblock_line, parse_plain_line, parse_rule_line
+from stage_profile import add_argument, profiling, stage
+
 # 定义URL常量
 GROUP_1_URL = 'https://raw.githubusercontent.com/GuangYu-yu/ACL4SSR/refs/heads/main/matching_domains.list'
 GROUP_2_URLS = [
@@ -12,35 +17,49 @@ GROUP_3_URL = 'https://raw.githubusercontent.com/blackmatrix7/ios_rule_script/re
 # 临时文件名
 TEMP_DOMAINS_FILE = 'temp_domains.txt'
 
-async def fetch_url(session, url):
-    async with session.get(url) as response:
-        return await response.text()
+def domain_sources(add):
+    """三组来源的 (url, parse_line, sink) 列表，sink 统一调用 add(domain, suffix)
 
-async def fetch_domains():
-    async with aiohttp.ClientSession() as session:
-        # 获取第一组域名
-        group1_content = await fetch_url(session, GROUP_1_URL)
-        group1_domains = [line.split(',')[1] for line in group1_content.splitlines() if line.startswith(('DOMAIN,', 'DOMAIN-SUFFIX,'))]
+    add 可以是协程函数，流式模式下用它把域名直接送进解析队列。
+    """
+    def add_rule(item):
+        # 规则可能带第三个字段（策略名），只取第二个字段
+        fields = item.split(',')
+        return add(fields[1], fields[0] == 'DOMAIN-SUFFIX')
+
+    def add_domain(domain):
+        return add(domain, False)
 
-        # 获取第二组域名
-        group2_domains = []
-        for url in GROUP_2_URLS:
-            content = await fetch_url(session, url)
-            group2_domains.extend(content.splitlines())
+    return ([(GROUP_1_URL, parse_rule_line, add_rule)]
+            + [(url, parse_plain_line, add_domain) for url in GROUP_2_URLS]
+            + [(GROUP_3_URL, parse_adblock_line, add_domain)])
 
-        # 获取第三组域名
-        group3_content = await fetch_url(session, GROUP_3_URL)
-        group3_domains = [line.strip('|^') for line in group3_content.splitlines() if line.startswith('||') and line.endswith('^')]
+async def fetch_domains():
+    store = DomainStore()
+
+    with stage('fetch_sources'):
+        async with aiohttp.ClientSession() as session:
+            # 三组来源并发获取，逐行解析后直接写入同一个域名集合
+            await fetch_sources(session, domain_sources(lambda domain, suffix: store.add(domain, suffix=suffix)))
 
-        # 合并去重
-        all_domains = list(set(group1_domains + group2_domains + group3_domains))
+    # 规范化后去重，并丢弃已被 DOMAIN-SUFFIX 规则覆盖的子域名
+    with stage('freeze'):
+        store.freeze()
+        print(f"被后缀规则覆盖或重复的域名: {store.dropped}")
 
-        # 将所有域名保存到一个文件中
+    # 将所有域名保存到一个文件中，逐个从打包的集合中解出，不再展开为列表
+    with stage('write_temp_domains'):
         with open(TEMP_DOMAINS_FILE, 'w') as f:
-            f.write('\n'.join(all_domains))
+            for i, domain in enumerate(store):
+                f.write(f"\n{domain}" if i else domain)
 
-        print(f"Total domains: {len(all_domains)}")
-        return all_domains
+    print(f"Total domains: {len(store)}")
+    return store
 
 if __name__ == "__main__":
-    asyncio.run(fetch_domains())
+    parser = argparse.ArgumentParser()
+    add_argument(parser)
+    args = parser.parse_args()
+
+    with profiling('fetch_domains', args.profile):
+        asyncio.run(fetch_domains())
@@ -1,116 +1,188 @@
-import requests
-from bs4 import BeautifulSoup
+import argparse
+import asyncio
+import codecs
 import ipaddress
+import json
+import os
+from html.parser import HTMLParser
+
+import aiohttp
+
+from stage_profile import add_argument, profiling, stage
+
+EXISTING_URL_V6 = 'https://raw.githubusercontent.com/GuangYu-yu/About-Cloudflare/refs/heads/main/ipv6_prefixes.txt'
+EXISTING_URL_V4 = 'https://raw.githubusercontent.com/GuangYu-yu/About-Cloudflare/refs/heads/main/ipv4_prefixes.txt'
+SOURCE_URL_V6 = 'https://www.wetest.vip/page/cloudflare/address_v6.html'
+SOURCE_URL_V4 = 'https://www.wetest.vip/page/cloudflare/address_v4.html'
+
+IPV6_FILE = 'ipv6_prefixes.txt'
+IPV4_FILE = 'ipv4_prefixes.txt'
+
+# 各来源的 ETag/Last-Modified 与上次提取出的前缀，未变化的来源不再下载和解析
+STATE_FILE = '.prefix_sources.json'
+
+# 默认前缀长度与对应的整数掩码
+PREFIX_LEN = {4: 24, 6: 48}
+MAX_LEN = {4: 32, 6: 128}
+
+def mask_for(version, prefixlen):
+    return ((1 << prefixlen) - 1) << (MAX_LEN[version] - prefixlen)
 
 def get_prefix_from_address(address, ip_version='IPv6'):
-    """转换前缀：IPv6 转 /48，IPv4 转 /24"""
+    """转换前缀：IPv6 转 /48，IPv4 转 /24，返回 (网络地址整数, 前缀长度)，无效时返回 None"""
+    clean_addr = address.strip()
+    version = 6 if ip_version == 'IPv6' else 4
     try:
-        clean_addr = address.strip()
-        
         if '/' in clean_addr:
             network = ipaddress.ip_network(clean_addr, strict=False)
-        else:
-            if ip_version == 'IPv6':
-                ip = ipaddress.IPv6Address(clean_addr)
-                full_ip = format(int(ip), '032x')
-                prefix = ':'.join([full_ip[i:i+4] for i in range(0, 12, 4)])
-                network = ipaddress.IPv6Network(f"{prefix}::/48")
-            else:  # IPv4
-                octets = clean_addr.split('.')
-                prefix = f"{octets[0]}.{octets[1]}.{octets[2]}.0/24"
-                network = ipaddress.IPv4Network(prefix, strict=False)
-        
-        return str(network)
-    except Exception as e:
+            if network.version != version:
+                return None
+            return int(network.network_address), network.prefixlen
+        ip = ipaddress.IPv6Address(clean_addr) if version == 6 else ipaddress.IPv4Address(clean_addr)
+        prefixlen = PREFIX_LEN[version]
+        return int(ip) & mask_for(version, prefixlen), prefixlen
+    except ValueError as e:
         print(f"处理地址时出错 {clean_addr}: {e}")
         return None
 
-def get_ipv6_prefixes():
+def format_prefix(version, prefix):
+    network, prefixlen = prefix
+    cls = ipaddress.IPv6Network if version == 6 else ipaddress.IPv4Network
+    return str(cls((network, prefixlen)))
+
+class CellParser(HTMLParser):
+    """只收集 <td> 单元格里的文本，不构建 DOM，可以分块喂入"""
+
+    def __init__(self, on_cell):
+        super().__init__(convert_charrefs=True)
+        self.on_cell = on_cell
+        self._depth = 0
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'td':
+            self._depth += 1
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag == 'td' and self._depth:
+            self._depth -= 1
+            text = ''.join(self._text).strip()
+            if text:
+                self.on_cell(text)
+            self._text = []
+
+    def handle_data(self, data):
+        if self._depth:
+            self._text.append(data)
+
+def load_state():
     try:
-        prefixes = set()
-        
-        # IPv6 existing_url
-        existing_url_v6 = 'https://raw.githubusercontent.com/GuangYu-yu/About-Cloudflare/refs/heads/main/ipv6_prefixes.txt'
-        try:
-            resp = requests.get(existing_url_v6)
-            resp.raise_for_status()
-            for line in resp.text.splitlines():
-                line = line.strip()
-                if line:
-                    prefix = get_prefix_from_address(line, 'IPv6')
-                    if prefix:
-                        prefixes.add(prefix)
-                        print(f"从现有文件添加 (IPv6): {prefix}")
-        except requests.exceptions.RequestException as e:
-            print(f"获取现有IPv6前缀时发生错误: {e}")
-
-        # IPv6 网页源
-        source_url_v6 = 'https://www.wetest.vip/page/cloudflare/address_v6.html'
-        response = requests.get(source_url_v6)
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state):
+    tmp_path = STATE_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, STATE_FILE)
+
+async def fetch_prefixes(session, url, version, is_html, state):
+    """条件请求获取一个来源，返回其中的前缀集合；未变化时直接使用上次的结果"""
+    entry = state.get(url)
+    headers = {}
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    async with session.get(url, headers=headers) as response:
+        if response.status == 304 and entry:
+            return {tuple(prefix) for prefix in entry['prefixes']}
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for td in soup.find_all('td'):
-            if td.string:
-                text = td.string.strip()
-                if ':' in text:
-                    prefix = get_prefix_from_address(text, 'IPv6')
-                    if prefix:
-                        prefixes.add(prefix)
-                        print(f"从网页提取 (IPv6): {prefix}")
-
-        sorted_prefixes = sorted(prefixes, key=lambda x: ipaddress.ip_network(x))
-        with open('ipv6_prefixes.txt', 'w') as f:
-            for prefix in sorted_prefixes:
-                f.write(prefix + '\n')
-
-        print(f"成功提取 {len(prefixes)} 个IPv6前缀并保存到 ipv6_prefixes.txt")
-
-    except Exception as e:
-        print(f"处理IPv6时发生错误: {e}")
-
-def get_ipv4_prefixes():
-    try:
+
         prefixes = set()
-        
-        # IPv4 existing_url
-        existing_url_v4 = 'https://raw.githubusercontent.com/GuangYu-yu/About-Cloudflare/refs/heads/main/ipv4_prefixes.txt'
-        try:
-            resp = requests.get(existing_url_v4)
-            resp.raise_for_status()
-            for line in resp.text.splitlines():
-                line = line.strip()
+        marker = ':' if version == 6 else '.'
+        ip_version = 'IPv6' if version == 6 else 'IPv4'
+
+        def add(text):
+            if marker in text:
+                prefix = get_prefix_from_address(text, ip_version)
+                if prefix:
+                    prefixes.add(prefix)
+
+        if is_html:
+            parser = CellParser(add)
+            decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')('replace')
+            async for chunk in response.content.iter_chunked(65536):
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+        else:
+            async for line in response.content:
+                line = line.decode('utf-8', 'replace').strip()
                 if line:
-                    prefix = get_prefix_from_address(line, 'IPv4')
-                    if prefix:
-                        prefixes.add(prefix)
-                        print(f"从现有文件添加 (IPv4): {prefix}")
-        except requests.exceptions.RequestException as e:
-            print(f"获取现有IPv4前缀时发生错误: {e}")
-
-        # IPv4 网页源
-        source_url_v4 = 'https://www.wetest.vip/page/cloudflare/address_v4.html'
-        response = requests.get(source_url_v4)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for td in soup.find_all('td'):
-            if td.string:
-                text = td.string.strip()
-                if '.' in text:
-                    prefix = get_prefix_from_address(text, 'IPv4')
-                    if prefix:
-                        prefixes.add(prefix)
-                        print(f"从网页提取 (IPv4): {prefix}")
-
-        sorted_prefixes = sorted(prefixes, key=lambda x: ipaddress.ip_network(x))
-        with open('ipv4_prefixes.txt', 'w') as f:
-            for prefix in sorted_prefixes:
-                f.write(prefix + '\n')
-
-        print(f"成功提取 {len(prefixes)} 个IPv4前缀并保存到 ipv4_prefixes.txt")
-
-    except Exception as e:
-        print(f"处理IPv4时发生错误: {e}")
+                    add(line)
+
+        state[url] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'prefixes': sorted(prefixes),
+        }
+        return prefixes
+
+def read_existing(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+async def update_prefixes(session, version, existing_url, source_url, output_file, state):
+    ip_version = 'IPv6' if version == 6 else 'IPv4'
+    existing, source = await asyncio.gather(
+        fetch_prefixes(session, existing_url, version, False, state),
+        fetch_prefixes(session, source_url, version, True, state),
+        return_exceptions=True)
+
+    if isinstance(existing, Exception):
+        print(f"获取现有{ip_version}前缀时发生错误: {existing}")
+        existing = set()
+    if isinstance(source, Exception):
+        print(f"处理{ip_version}时发生错误: {source}")
+        return
+
+    with stage(f'format_{ip_version}'):
+        prefixes = existing | source
+        # 元组 (网络地址整数, 前缀长度) 的自然顺序即为网络顺序
+        content = ''.join(format_prefix(version, prefix) + '\n' for prefix in sorted(prefixes))
+        if content == read_existing(output_file):
+            print(f"{ip_version}前缀没有变化 ({len(prefixes)} 个)，跳过写入 {output_file}")
+            return
+
+        with open(output_file, 'w') as f:
+            f.write(content)
+    print(f"成功提取 {len(prefixes)} 个{ip_version}前缀并保存到 {output_file}")
+
+async def main():
+    state = load_state()
+    # IPv6 与 IPv4 并发获取和解析，各自的排序写入是 fetch_and_parse 的子阶段
+    with stage('fetch_and_parse'):
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+            await asyncio.gather(
+                update_prefixes(session, 6, EXISTING_URL_V6, SOURCE_URL_V6, IPV6_FILE, state),
+                update_prefixes(session, 4, EXISTING_URL_V4, SOURCE_URL_V4, IPV4_FILE, state),
+            )
+    with stage('save_state'):
+        save_state(state)
 
 if __name__ == "__main__":
-    get_ipv6_prefixes()
-    get_ipv4_prefixes()
+    parser = argparse.ArgumentParser()
+    add_argument(parser)
+    args = parser.parse_args()
+
+    with profiling('ipv6_extractor', args.profile):
+        asyncio.run(main())
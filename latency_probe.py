@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import heapq
+import ipaddress
+import os
+import random
+import ssl
+import sys
+import time
+from collections import namedtuple
+
+DEFAULT_INPUTS = ['优选域名ip.txt']
+TOP_FILE = 'latency_top.csv'
+TOP_HEADER = 'IP 地址,TCP延迟(ms),TLS握手(ms),总延迟(ms)'
+
+# 按 /24、/48 划分前缀，单个前缀内的 IP 共享探测预算和提前停止判断
+PREFIX_LEN = {4: 24, 6: 48}
+
+class ProbeResult(namedtuple('ProbeResult', 'ip connect tls error')):
+    """connect/tls 单位为秒，失败时为 None 且 error 为异常名"""
+
+    @property
+    def total(self):
+        if self.error is not None:
+            return None
+        return self.connect + (self.tls or 0.0)
+
+def prefix_of(ip):
+    address = ipaddress.ip_address(ip)
+    return ipaddress.ip_network((address, PREFIX_LEN[address.version]), strict=False)
+
+def _sample_range(rng, start, stop, count):
+    """从 [start, stop) 中不重复地随机取 count 个整数，IPv6 的区间远超 random.sample 的上限"""
+    count = min(count, stop - start)
+    if stop - start <= 4 * count:
+        return sorted(rng.sample(range(start, stop), count))
+    picked = set()
+    while len(picked) < count:
+        picked.add(rng.randrange(start, stop))
+    return sorted(picked)
+
+def _sample_hosts(network, count, rng):
+    """在网络内随机取 count 个地址（IPv4 跳过网络地址）"""
+    size = network.num_addresses
+    first = 1 if network.version == 4 and size > 2 else 0
+    base = int(network.network_address)
+    cls = ipaddress.IPv4Address if network.version == 4 else ipaddress.IPv6Address
+    return [str(cls(base + offset)) for offset in _sample_range(rng, first, size, count)]
+
+def load_targets(paths, hosts_per_prefix=4, max_prefixes_per_cidr=256, seed=0):
+    """读取 IP 列表或 CIDR 列表，返回 {前缀: [IP, ...]}
+
+    单个 IP 按所在 /24、/48 分组；CIDR 先拆到 /24、/48（过大时随机抽取
+    max_prefixes_per_cidr 个），每个前缀再随机抽取 hosts_per_prefix 个地址。
+    """
+    rng = random.Random(seed)
+    groups = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    if '/' not in line:
+                        groups.setdefault(prefix_of(line), []).append(line)
+                        continue
+                    network = ipaddress.ip_network(line, strict=False)
+                except ValueError as e:
+                    print(f"无效的地址: {line}. 错误: {e}", file=sys.stderr)
+                    continue
+                group_len = PREFIX_LEN[network.version]
+                if network.prefixlen >= group_len:
+                    prefix = network.supernet(new_prefix=group_len)
+                    groups.setdefault(prefix, []).extend(_sample_hosts(network, hosts_per_prefix, rng))
+                    continue
+                subnet_count = 1 << (group_len - network.prefixlen)
+                step = 1 << (network.max_prefixlen - group_len)
+                indices = _sample_range(rng, 0, subnet_count, max_prefixes_per_cidr)
+                base = int(network.network_address)
+                cls = ipaddress.IPv4Network if network.version == 4 else ipaddress.IPv6Network
+                for index in indices:
+                    prefix = cls((base + index * step, group_len))
+                    groups.setdefault(prefix, []).extend(_sample_hosts(prefix, hosts_per_prefix, rng))
+    return groups
+
+def interleave(groups):
+    """轮流从每个前缀取一个 IP，让各前缀尽早得到样本以便判断是否提前停止"""
+    iterators = [(prefix, iter(ips)) for prefix, ips in groups.items()]
+    while iterators:
+        remaining = []
+        for prefix, ips in iterators:
+            ip = next(ips, None)
+            if ip is not None:
+                yield prefix, ip
+                remaining.append((prefix, ips))
+        iterators = remaining
+
+class PrefixState:
+    __slots__ = ('semaphore', 'probes', 'failures', 'best', 'stopped')
+
+    def __init__(self, budget):
+        self.semaphore = asyncio.Semaphore(budget)
+        self.probes = 0
+        self.failures = 0
+        self.best = None
+        self.stopped = False
+
+class LatencyProber:
+    """并发测量 TCP 连接与 TLS 握手延迟
+
+    concurrency 为全局在途探测上限，per_prefix 为单个前缀的在途上限。
+    某前缀已有 min_samples 个结果且全部失败，或最好成绩仍慢于当前前 N 名
+    最慢者的 slow_factor 倍（或 max_latency）时，不再探测该前缀的其余 IP。
+    """
+
+    def __init__(self, port=443, sni=None, tls=True, timeout=2.0, concurrency=500, per_prefix=4,
+                 min_samples=3, slow_factor=2.0, max_latency=None, top=100, on_result=None):
+        self.port = port
+        self.sni = sni
+        self.tls = tls
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.per_prefix = per_prefix
+        self.min_samples = min_samples
+        self.slow_factor = slow_factor
+        self.max_latency = max_latency
+        self.top = top
+        self.on_result = on_result
+        self.ssl_context = ssl.create_default_context()
+        # 只测握手耗时，不校验证书
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.prefixes = {}
+        self.best = []  # 最大堆 (-总延迟, IP, 结果)，保留前 top 名
+        self.probed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    async def probe(self, ip):
+        start = time.perf_counter()
+        writer = None
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip, self.port), self.timeout)
+            connect = time.perf_counter() - start
+            tls = None
+            if self.tls:
+                start = time.perf_counter()
+                await asyncio.wait_for(writer.start_tls(self.ssl_context, server_hostname=self.sni), self.timeout)
+                tls = time.perf_counter() - start
+            return ProbeResult(ip, connect, tls, None)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError) as e:
+            return ProbeResult(ip, None, None, type(e).__name__)
+        finally:
+            if writer is not None:
+                writer.transport.abort()
+
+    def cutoff(self):
+        """慢于该值的前缀视为明显偏慢，前 N 名未满且未设 max_latency 时不截断"""
+        limits = []
+        if self.max_latency is not None:
+            limits.append(self.max_latency)
+        if len(self.best) >= self.top:
+            limits.append(-self.best[0][0] * self.slow_factor)
+        return min(limits) if limits else None
+
+    def record(self, state, result):
+        self.probed += 1
+        state.probes += 1
+        total = result.total
+        if total is None:
+            self.failed += 1
+            state.failures += 1
+        else:
+            if state.best is None or total < state.best:
+                state.best = total
+            entry = (-total, result.ip, result)
+            if len(self.best) < self.top:
+                heapq.heappush(self.best, entry)
+            elif entry > self.best[0]:
+                heapq.heapreplace(self.best, entry)
+        if state.probes >= self.min_samples and not state.stopped:
+            cutoff = self.cutoff()
+            if state.failures == state.probes or (cutoff is not None and state.best > cutoff):
+                state.stopped = True
+        if self.on_result is not None:
+            self.on_result(result)
+
+    def ranking(self):
+        return [result for _, _, result in sorted(self.best, key=lambda entry: (-entry[0], entry[1]))]
+
+    async def run(self, groups):
+        for prefix in groups:
+            self.prefixes[prefix] = PrefixState(self.per_prefix)
+        work = interleave(groups)
+
+        async def worker():
+            # 所有 worker 共享同一个迭代器，worker 数即全局预算
+            for prefix, ip in work:
+                state = self.prefixes[prefix]
+                if state.stopped:
+                    self.skipped += 1
+                    continue
+                async with state.semaphore:
+                    if state.stopped:
+                        self.skipped += 1
+                        continue
+                    result = await self.probe(ip)
+                self.record(state, result)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return self.ranking()
+
+    @property
+    def stopped_prefixes(self):
+        return sum(1 for state in self.prefixes.values() if state.stopped)
+
+def _ms(seconds):
+    return '' if seconds is None else f"{seconds * 1000:.2f}"
+
+def format_row(result):
+    return f"{result.ip},{_ms(result.connect)},{_ms(result.tls)},{_ms(result.total)}"
+
+def write_ranking(path, ranking):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(TOP_HEADER + '\n')
+        f.writelines(format_row(result) + '\n' for result in ranking)
+    os.replace(tmp_path, path)
+
+async def flush_periodically(prober, path, interval):
+    """运行期间定期把当前前 N 名写入文件，中途中断也能拿到结果"""
+    last = None
+    while True:
+        await asyncio.sleep(interval)
+        ranking = prober.ranking()
+        if ranking != last:
+            write_ranking(path, ranking)
+            last = ranking
+
+async def run(args):
+    groups = load_targets(args.inputs, args.hosts_per_prefix, args.max_prefixes_per_cidr, args.seed)
+    total = sum(len(ips) for ips in groups.values())
+    print(f"共 {len(groups)} 个前缀，{total} 个待测 IP", file=sys.stderr)
+
+    all_file = open(args.all, 'w', encoding='utf-8', buffering=1 << 16) if args.all else None
+    if all_file is not None:
+        all_file.write(TOP_HEADER + ',错误\n')
+
+    def on_result(result):
+        if all_file is not None:
+            all_file.write(f"{format_row(result)},{result.error or ''}\n")
+
+    prober = LatencyProber(port=args.port, sni=args.sni, tls=not args.no_tls, timeout=args.timeout,
+                           concurrency=args.concurrency, per_prefix=args.per_prefix, min_samples=args.min_samples,
+                           slow_factor=args.slow_factor,
+                           max_latency=args.max_latency / 1000 if args.max_latency else None,
+                           top=args.top, on_result=on_result)
+    start = time.perf_counter()
+    flusher = asyncio.create_task(flush_periodically(prober, args.output, args.flush_interval))
+    try:
+        ranking = await prober.run(groups)
+    finally:
+        flusher.cancel()
+        if all_file is not None:
+            all_file.close()
+    write_ranking(args.output, ranking)
+    elapsed = time.perf_counter() - start
+    print(f"探测 {prober.probed} 个 IP（失败 {prober.failed}，跳过 {prober.skipped}，"
+          f"提前停止 {prober.stopped_prefixes} 个前缀），用时 {elapsed:.1f} 秒", file=sys.stderr)
+    print(f"前 {len(ranking)} 名已写入 {args.output}", file=sys.stderr)
+    return ranking
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="并发测量候选 IP 的 TCP 连接与 TLS 握手延迟并排序")
+    parser.add_argument('inputs', nargs='*', default=DEFAULT_INPUTS, help="IP 或 CIDR 列表文件")
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--sni', help="TLS 握手使用的 SNI，不指定则不发送")
+    parser.add_argument('--no-tls', action='store_true', help="只测 TCP 连接")
+    parser.add_argument('--timeout', type=float, default=2.0, help="单次连接/握手超时（秒）")
+    parser.add_argument('--concurrency', type=int, default=1000, help="全局在途探测数")
+    parser.add_argument('--per-prefix', type=int, default=4, help="单个 /24、/48 的在途探测数")
+    parser.add_argument('--hosts-per-prefix', type=int, default=4, help="CIDR 输入时每个前缀抽取的地址数")
+    parser.add_argument('--max-prefixes-per-cidr', type=int, default=256)
+    parser.add_argument('--min-samples', type=int, default=3, help="判断前缀是否偏慢前需要的样本数")
+    parser.add_argument('--slow-factor', type=float, default=2.0, help="慢于前 N 名最慢者该倍数的前缀提前停止")
+    parser.add_argument('--max-latency', type=float, help="总延迟上限（毫秒），超过的前缀提前停止")
+    parser.add_argument('--top', type=int, default=200)
+    parser.add_argument('--flush-interval', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--all', help="另外逐条写出全部结果的 CSV")
+    parser.add_argument('-o', '--output', default=TOP_FILE)
+    return asyncio.run(run(parser.parse_args(argv)))
+
+if __name__ == "__main__":
+    main()
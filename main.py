@@ -1,8 +1,26 @@
+import argparse
 import asyncio
 import aiohttp
-import ipaddress
+import itertools
+import json
 import os
-from fetch_domains import fetch_domains, TEMP_DOMAINS_FILE
+from fetch_domains import domain_sources, fetch_domains, TEMP_DOMAINS_FILE
+from cidr_index import CidrIndex
+from delta_output import update_list, write_manifest
+from metrics import RunMetrics, aggregate_reports
+from native_dns import UPSTREAMS_ENV
+from packed_set import OPTIMIZED_DOMAINS_BIN, OPTIMIZED_IPS_BIN, write_domain_set, write_ip_set
+from query_ip import QUERY_FUNCTIONS, default_limiters
+from resolution_cache import ResolutionCache, add_freshness_arguments, apply_freshness_arguments
+from result_journal import iter_journal
+from scheduler import load_weights, merge_weights, save_weights
+from stage_profile import add_argument, profiling, stage
+from stream_pipeline import StreamPipeline, ip_sort_key
+
+try:
+    from cidr_batch import BatchClassifier, unique_sorted_ips
+except ImportError:  # 未安装 numpy 时退回逐个匹配
+    BatchClassifier = None
 
 # 定义URL常量
 CIDR_URL = 'https://raw.githubusercontent.com/GuangYu-yu/ACL4SSR/refs/heads/main/Clash/Cloudflare.txt'
@@ -10,68 +28,219 @@ CIDR_URL = 'https://raw.githubusercontent.com/GuangYu-yu/ACL4SSR/refs/heads/main
 # 结果文件名
 OPTIMIZED_DOMAINS_FILE = '优选域名.txt'
 OPTIMIZED_IPS_FILE = '优选域名ip.txt'
+RUN_REPORT_FILE = 'run_report.json'
+STREAM_METRICS_FILE = 'metrics_stream.json'
+PARTIAL_SUFFIX = '.partial.txt'
 
 async def fetch_url(session, url):
     async with session.get(url) as response:
         return await response.text()
 
-async def main():
-    # 获取并分割域名列表
-    await fetch_domains()
-    
-    query_methods = ['de_fra', 'google', 'quad9', 'twnic', 'uk_lon', 'sb', 'kr_sel', 'sg_sin', 'jp_nrt', 'hk_hkg']
-    
-    results = []
-    for method in query_methods:
-        file_path = f'ip-results-{method}/ip_results_{method}.txt'
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                method_results = [line.strip().split(',') for line in f]
-                results.extend(method_results)
-        else:
-            print(f"警告: 文件 {file_path} 不存在")
-    
-    # 获取CIDR列表
-    async with aiohttp.ClientSession() as session:
-        cidr_content = await fetch_url(session, CIDR_URL)
-    cidr_list = []
-    for line in cidr_content.splitlines():
-        line = line.strip()
-        if line:
-            try:
-                cidr_list.append(ipaddress.ip_network(line))
-            except ValueError as e:
-                print(f"无效的CIDR: {line}. 错误: {e}")
-
-    print(f"有效的CIDR数量: {len(cidr_list)}")
-
-    # 匹配IP和CIDR
+def match_results(results, cidr_index):
+    """返回排序去重后的 (优选域名列表, 优选IP列表)；results 可以是只能遍历一次的流"""
+    if BatchClassifier is not None:
+        return match_results_batch(results, cidr_index)
+
     optimized_domains = set()
     optimized_ips = set()
 
     for domain, ip in results:
         try:
-            ip_obj = ipaddress.ip_address(ip)
-            if any(ip_obj in cidr for cidr in cidr_list):
+            if cidr_index.contains(ip):
                 optimized_domains.add(domain)
                 optimized_ips.add(ip)
         except ValueError:
             print(f"无效的IP地址: {ip}")
 
-    # 保存结果
-    with open(OPTIMIZED_DOMAINS_FILE, 'w') as f:
-        f.write('\n'.join(sorted(optimized_domains)))
+    # 与 numpy 路径相同的顺序，增量比较依赖两次运行的顺序一致
+    return sorted(optimized_domains), sorted(optimized_ips, key=ip_sort_key)
 
-    with open(OPTIMIZED_IPS_FILE, 'w') as f:
-        f.write('\n'.join(sorted(optimized_ips)))
+def match_results_batch(results, cidr_index):
+    import numpy as np
+
+    domain_list = []
+    ips = []
+    for domain, ip in results:
+        domain_list.append(domain)
+        ips.append(ip)
+    domains = np.array(domain_list, dtype=object)
+
+    mask, v4, v6, invalid = BatchClassifier(cidr_index).classify(ips)
+    for row in invalid:
+        print(f"无效的IP地址: {ips[row]}")
+
+    optimized_domains = np.unique(domains[mask].astype(str)).tolist() if mask.any() else []
+    return optimized_domains, unique_sorted_ips(v4, v6)
+
+def load_results_from_cache(cache_path, query_methods, domains):
+    """把各分片上传的缓存更新合并进完整缓存，再直接从缓存生成 (domain, ip) 列表"""
+    with ResolutionCache(cache_path) as cache:
+        for method in query_methods:
+            update_path = f'ip-results-{method}/cache_updates_{method}.sqlite'
+            if os.path.exists(update_path):
+                cache.merge_from(update_path)
+            else:
+                print(f"警告: 文件 {update_path} 不存在")
+        print(f"解析缓存条目数: {len(cache)}")
+        # 包含已过期的条目：本次未刷新的域名沿用上次的地址
+        return list(cache.iter_pairs(domains))
+
+def update_resolver_weights(query_methods):
+    """汇总各分片的实测吞吐，写入下次分片使用的权重文件"""
+    measured = {}
+    for method in query_methods:
+        stats_path = f'ip-results-{method}/resolver_stats_{method}.json'
+        if os.path.exists(stats_path):
+            with open(stats_path, 'r') as f:
+                for name, stats in json.load(f).items():
+                    measured[name] = stats['throughput']
+    if measured:
+        save_weights(merge_weights(load_weights(), measured))
+        print(f"已更新解析器权重: {measured}")
+
+def write_run_report(paths):
+    """汇总各分片的指标文件为一份运行报告"""
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return
+    report = aggregate_reports(paths)
+    with open(RUN_REPORT_FILE, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    for name, metrics in sorted(report['resolvers'].items()):
+        print(f"{name}: 请求 {metrics['requests']}，重试 {metrics['retries']}，失败 {metrics['failures']}，"
+              f"空应答 {metrics['empty']}，NXDOMAIN {metrics['nxdomain']}，平均延迟 {metrics['mean_latency']}s")
+
+def write_outputs(optimized_domains, optimized_ips):
+    """写入结果列表与相对上次结果的增量；内容没有变化的列表不重写"""
+    entries = {
+        OPTIMIZED_DOMAINS_FILE: update_list(OPTIMIZED_DOMAINS_FILE, optimized_domains),
+        OPTIMIZED_IPS_FILE: update_list(OPTIMIZED_IPS_FILE, optimized_ips, key=ip_sort_key),
+    }
+    for path, entry in entries.items():
+        if entry['changed']:
+            print(f"{path}: {entry['count']} 条，新增 {entry['added']}，删除 {entry['removed']}")
+        else:
+            print(f"{path}: 没有变化")
+    write_manifest(entries)
+
+    # 同时输出可以直接 mmap 查询的打包格式
+    if entries[OPTIMIZED_DOMAINS_FILE]['changed'] or not os.path.exists(OPTIMIZED_DOMAINS_BIN):
+        write_domain_set(OPTIMIZED_DOMAINS_BIN, optimized_domains)
+    if entries[OPTIMIZED_IPS_FILE]['changed'] or not os.path.exists(OPTIMIZED_IPS_BIN):
+        write_ip_set(OPTIMIZED_IPS_BIN, optimized_ips)
+
+def write_partial(optimized_domains, optimized_ips):
+    """流式模式中途的部分结果写到单独的文件，不影响增量的基准"""
+    for path, lines in ((OPTIMIZED_DOMAINS_FILE, optimized_domains), (OPTIMIZED_IPS_FILE, optimized_ips)):
+        partial_path = os.path.splitext(path)[0] + PARTIAL_SUFFIX
+        with open(partial_path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines))
+        os.replace(partial_path + '.tmp', partial_path)
+
+def emit_outputs(optimized_domains, optimized_ips, final):
+    if final:
+        with stage('write_outputs'):
+            write_outputs(optimized_domains, optimized_ips)
+    else:
+        write_partial(optimized_domains, optimized_ips)
+
+async def main(cache_path=None):
+    # 获取并分割域名列表
+    with stage('fetch_domains'):
+        domain_store = await fetch_domains()
+    
+    query_methods = ['de_fra', 'google', 'quad9', 'twnic', 'uk_lon', 'sb', 'kr_sel', 'sg_sin', 'jp_nrt', 'hk_hkg']
+    
+    if cache_path:
+        with stage('load_results'):
+            results = load_results_from_cache(cache_path, query_methods, domain_store)
+    else:
+        # 直接流式读取各分片的结果日志
+        journals = []
+        for method in query_methods:
+            file_path = f'ip-results-{method}/ip_results_{method}.txt'
+            if os.path.exists(file_path):
+                journals.append(file_path)
+            else:
+                print(f"警告: 文件 {file_path} 不存在")
+        results = itertools.chain.from_iterable(iter_journal(path) for path in journals)
+    
+    update_resolver_weights(query_methods)
+    write_run_report([f'ip-results-{method}/metrics_{method}.json' for method in query_methods])
+
+    # 获取CIDR列表
+    with stage('fetch_cidr'):
+        async with aiohttp.ClientSession() as session:
+            cidr_content = await fetch_url(session, CIDR_URL)
+        cidr_index = CidrIndex.from_text(cidr_content)
+
+    print(f"有效的CIDR数量: {len(cidr_index)}")
+
+    # 匹配IP和CIDR；从结果日志读取时逐行读取也计入这一阶段
+    with stage('match'):
+        optimized_domains, optimized_ips = match_results(results, cidr_index)
+
+    with stage('write_outputs'):
+        write_outputs(optimized_domains, optimized_ips)
 
     # 清理临时文件
     if os.path.exists(TEMP_DOMAINS_FILE):
         os.remove(TEMP_DOMAINS_FILE)
     for method in query_methods:
-        file_path = f'ip-results-{method}/ip_results_{method}.txt'
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        for file_path in (f'ip-results-{method}/ip_results_{method}.txt',
+                          f'ip-results-{method}/cache_updates_{method}.sqlite',
+                          f'ip-results-{method}/resolver_stats_{method}.json',
+                          f'ip-results-{method}/metrics_{method}.json',
+                          f'ip-results-{method}/metrics_{method}.prom'):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+async def stream_main(methods=None, cache_path=None, emit_interval=60.0):
+    """单进程流式模式：来源、解析、匹配之间只经过内存队列，不读写中间文件"""
+    backends = {name: QUERY_FUNCTIONS[name] for name in methods} if methods else QUERY_FUNCTIONS
+    metrics = RunMetrics(backends)
+    cache = ResolutionCache(cache_path) if cache_path else None
+    pipeline = StreamPipeline(domain_sources, CIDR_URL, backends, emit_outputs, default_limiters(backends),
+                              cache=cache, metrics=metrics, emit_interval=emit_interval)
+    try:
+        with stage('stream_pipeline'):
+            await pipeline.run()
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if pipeline.failures:
+        print(f"{len(pipeline.failures)} 个域名多次重试后仍查询失败")
+    for path in (OPTIMIZED_DOMAINS_FILE, OPTIMIZED_IPS_FILE):
+        partial_path = os.path.splitext(path)[0] + PARTIAL_SUFFIX
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    save_weights(merge_weights(load_weights(), pipeline.scheduler.weights()))
+    metrics.write_json(STREAM_METRICS_FILE)
+    write_run_report([STREAM_METRICS_FILE])
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', help="合并分片的缓存更新并直接从解析缓存生成结果；流式模式下为读写的解析缓存")
+    parser.add_argument('--stream', action='store_true', help="在一个进程中完成获取、解析与匹配，不依赖分片结果")
+    parser.add_argument('--methods', help="流式模式使用的解析器，逗号分隔，默认全部")
+    parser.add_argument('--emit-interval', type=float, default=60.0,
+                        help="流式模式每隔多少秒输出一次部分结果，0 表示只在结束时输出（也可发送 SIGUSR1）")
+    parser.add_argument('--upstreams', help="native 方法使用的上游，逗号分隔的 host[:port]")
+    add_freshness_arguments(parser)
+    add_argument(parser)
+    args = parser.parse_args()
+    if args.upstreams:
+        os.environ[UPSTREAMS_ENV] = args.upstreams
+    apply_freshness_arguments(args)
+
+    if args.stream:
+        methods = [name.strip() for name in args.methods.split(',')] if args.methods else None
+        unknown = [name for name in methods or () if name not in QUERY_FUNCTIONS]
+        if unknown:
+            parser.error(f"未知的查询方法: {', '.join(unknown)}")
+        with profiling('main_stream', args.profile):
+            asyncio.run(stream_main(methods, args.cache, args.emit_interval))
+    else:
+        with profiling('main', args.profile):
+            asyncio.run(main(args.cache))
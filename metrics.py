@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+
+from dns_message import RCODE_NXDOMAIN
+
+# 延迟直方图的桶上界（秒），与 Prometheus histogram 的 le 标签一致
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class ResolverMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.answered = 0
+        self.empty = 0
+        self.nxdomain = 0
+        self.statuses = {}
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.inflight = []
+
+    def observe(self, latency, status):
+        self.requests += 1
+        self.latency_sum += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.bucket_counts[i] += 1
+                break
+        key = str(status)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def outcome(self, result):
+        if result is None:
+            self.failures += 1
+        elif result.ips:
+            self.answered += 1
+        elif result.rcode == RCODE_NXDOMAIN:
+            self.nxdomain += 1
+        else:
+            self.empty += 1
+
+    def as_dict(self):
+        cumulative = []
+        total = 0
+        for count in self.bucket_counts:
+            total += count
+            cumulative.append(total)
+        completed = self.answered + self.empty + self.nxdomain
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'answered': self.answered,
+            'empty': self.empty,
+            'nxdomain': self.nxdomain,
+            'empty_rate': round(self.empty / completed, 4) if completed else 0.0,
+            'nxdomain_rate': round(self.nxdomain / completed, 4) if completed else 0.0,
+            'statuses': self.statuses,
+            'latency': {
+                'sum': round(self.latency_sum, 3),
+                'count': self.requests,
+                'buckets': {('+Inf' if bound == float('inf') else str(bound)): count
+                            for bound, count in zip(LATENCY_BUCKETS, cumulative)},
+            },
+            'inflight': self.inflight,
+        }
+
+class RunMetrics:
+    """一次运行中所有解析器的请求数、延迟直方图、状态码、重试与应答统计"""
+
+    def __init__(self, names=()):
+        self.started_at = time.time()
+        self.resolvers = {name: ResolverMetrics() for name in names}
+
+    def get(self, name):
+        if name not in self.resolvers:
+            self.resolvers[name] = ResolverMetrics()
+        return self.resolvers[name]
+
+    def observe(self, name, latency, status):
+        self.get(name).observe(latency, status)
+
+    def retry(self, name):
+        self.get(name).retries += 1
+
+    def outcome(self, name, result):
+        self.get(name).outcome(result)
+
+    async def sample_inflight(self, limiters, interval=1.0):
+        """定期记录各解析器的在途请求数与并发上限，直到被取消"""
+        while True:
+            offset = round(time.time() - self.started_at, 1)
+            for name, limiter in limiters.items():
+                self.get(name).inflight.append([offset, limiter.in_flight, round(limiter.concurrency, 2)])
+            await asyncio.sleep(interval)
+
+    def as_dict(self):
+        return {
+            'started_at': round(self.started_at, 3),
+            'duration': round(time.time() - self.started_at, 3),
+            'resolvers': {name: metrics.as_dict() for name, metrics in self.resolvers.items()},
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def write_prometheus(self, path):
+        """node_exporter textfile 格式"""
+        lines = [
+            '# TYPE doh_requests_total counter',
+            '# TYPE doh_retries_total counter',
+            '# TYPE doh_failures_total counter',
+            '# TYPE doh_answers_total counter',
+            '# TYPE doh_responses_total counter',
+            '# TYPE doh_request_seconds histogram',
+        ]
+        for name, metrics in sorted(self.resolvers.items()):
+            data = metrics.as_dict()
+            label = f'resolver="{name}"'
+            lines.append(f'doh_requests_total{{{label}}} {data["requests"]}')
+            lines.append(f'doh_retries_total{{{label}}} {data["retries"]}')
+            lines.append(f'doh_failures_total{{{label}}} {data["failures"]}')
+            for kind in ('answered', 'empty', 'nxdomain'):
+                lines.append(f'doh_answers_total{{{label},kind="{kind}"}} {data[kind]}')
+            for status, count in sorted(data['statuses'].items()):
+                lines.append(f'doh_responses_total{{{label},status="{status}"}} {count}')
+            for bound, count in data['latency']['buckets'].items():
+                lines.append(f'doh_request_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'doh_request_seconds_sum{{{label}}} {data["latency"]["sum"]}')
+            lines.append(f'doh_request_seconds_count{{{label}}} {data["latency"]["count"]}')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+COUNTERS = ('requests', 'retries', 'failures', 'answered', 'empty', 'nxdomain')
+
+def merge_resolver(merged, metrics):
+    """把同一解析器在另一个指标文件中的计数累加进 merged"""
+    if merged is None:
+        merged = {key: 0 for key in COUNTERS}
+        merged.update(statuses={}, latency={'sum': 0.0, 'count': 0, 'buckets': {}})
+    for key in COUNTERS:
+        merged[key] += metrics[key]
+    for status, count in metrics['statuses'].items():
+        merged['statuses'][status] = merged['statuses'].get(status, 0) + count
+    latency = merged['latency']
+    latency['sum'] = round(latency['sum'] + metrics['latency']['sum'], 3)
+    latency['count'] += metrics['latency']['count']
+    for bound, count in metrics['latency']['buckets'].items():
+        latency['buckets'][bound] = latency['buckets'].get(bound, 0) + count
+    return merged
+
+def aggregate_reports(paths):
+    """合并多个分片的指标文件为一份运行报告；同一解析器出现在多个文件中时累加后重新计算比例与平均延迟"""
+    report = {'shards': [], 'resolvers': {}, 'totals': {}}
+    for path in paths:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        report['shards'].append({'file': path, 'duration': data.get('duration')})
+        for name, metrics in data['resolvers'].items():
+            report['resolvers'][name] = merge_resolver(report['resolvers'].get(name), metrics)
+
+    totals = {key: 0 for key in COUNTERS}
+    for metrics in report['resolvers'].values():
+        completed = metrics['answered'] + metrics['empty'] + metrics['nxdomain']
+        metrics['empty_rate'] = round(metrics['empty'] / completed, 4) if completed else 0.0
+        metrics['nxdomain_rate'] = round(metrics['nxdomain'] / completed, 4) if completed else 0.0
+        latency = metrics['latency']
+        metrics['mean_latency'] = round(latency['sum'] / latency['count'], 4) if latency['count'] else None
+        for key in COUNTERS:
+            totals[key] += metrics[key]
+    report['totals'] = totals
+    return report
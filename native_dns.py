@@ -0,0 +1,197 @@
+import asyncio
+import os
+import random
+import socket
+import struct
+
+from cname_targets import default_target_cache, resolve_via_targets
+from dns_message import decode_response, encode_query
+from rate_control import RetryableError
+
+# 接收缓冲区，突发大量响应时避免内核丢包（实际大小受 net.core.rmem_max 限制）
+RECV_BUFFER = 4 * 1024 * 1024
+
+# 上游列表，逗号分隔的 host[:port]，IPv6 写成 [addr]:port
+UPSTREAMS_ENV = 'DNS_UPSTREAMS'
+DEFAULT_UPSTREAMS = ['1.1.1.1', '8.8.8.8', '9.9.9.9', '208.67.222.222']
+
+class DnsTimeout(RetryableError):
+    def __init__(self, upstream, name):
+        super().__init__(f"{upstream} 查询 {name} 超时", 'timeout')
+
+def parse_upstream(value):
+    """'1.1.1.1'、'1.1.1.1:5353'、'[2606:4700::1111]:53' → (host, port)"""
+    value = value.strip()
+    if value.startswith('['):
+        host, _, port = value[1:].partition(']')
+        return host, int(port.lstrip(':') or 53)
+    if value.count(':') == 1:
+        host, port = value.split(':')
+        return host, int(port)
+    return value, 53
+
+def configured_upstreams():
+    value = os.environ.get(UPSTREAMS_ENV)
+    if not value:
+        return [parse_upstream(item) for item in DEFAULT_UPSTREAMS]
+    return [parse_upstream(item) for item in value.split(',') if item.strip()]
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, upstream):
+        self.upstream = upstream
+
+    def datagram_received(self, data, addr):
+        self.upstream._on_datagram(data)
+
+    def error_received(self, exc):
+        # ICMP 不可达等错误无法对应到具体查询，交给超时重传处理
+        pass
+
+    def connection_lost(self, exc):
+        self.upstream._transport = None
+
+class UpstreamResolver:
+    """单个上游：一个 UDP socket，按 txid 区分同时在途的查询
+
+    每次发送后等待 timeout 秒，超时则重传并把等待时间翻倍，共发送 retries + 1 次；
+    响应带 TC 标志时改用 TCP 重新查询。
+    """
+
+    def __init__(self, host, port=53, timeout=1.0, retries=2, tcp_timeout=5.0, max_in_flight=1024):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.tcp_timeout = tcp_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._pending = {}  # txid -> (future, 查询报文)
+        self._transport = None
+        self._connecting = None
+        self.sent = 0
+        self.retransmits = 0
+        self.tcp_fallbacks = 0
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    async def _ensure_transport(self):
+        if self._transport is not None:
+            return self._transport
+        if self._connecting is None:
+            loop = asyncio.get_running_loop()
+            self._connecting = loop.create_task(
+                loop.create_datagram_endpoint(lambda: _UdpProtocol(self), remote_addr=(self.host, self.port)))
+        try:
+            self._transport, _ = await self._connecting
+        finally:
+            self._connecting = None
+        sock = self._transport.get_extra_info('socket')
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        except OSError:
+            pass
+        return self._transport
+
+    def _on_datagram(self, data):
+        if len(data) < 12:
+            return
+        txid = struct.unpack_from('!H', data)[0]
+        entry = self._pending.get(txid)
+        if entry is None:
+            return  # 重传后迟到的重复响应
+        future, message = entry
+        # 问题区必须与查询一致，忽略 txid 碰巧相同的伪造或错位响应
+        if data[12:len(message)] != message[12:] or future.done():
+            return
+        future.set_result(data)
+
+    def _new_txid(self):
+        while True:
+            txid = random.getrandbits(16)
+            if txid not in self._pending:
+                return txid
+
+    async def query(self, name, qtype):
+        async with self._slots:
+            transport = await self._ensure_transport()
+            txid = self._new_txid()
+            message = encode_query(name, qtype, txid)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[txid] = (future, message)
+            try:
+                timeout = self.timeout
+                for attempt in range(self.retries + 1):
+                    if attempt:
+                        self.retransmits += 1
+                    transport.sendto(message)
+                    self.sent += 1
+                    try:
+                        data = await asyncio.wait_for(asyncio.shield(future), timeout)
+                        break
+                    except asyncio.TimeoutError:
+                        timeout *= 2
+                else:
+                    raise DnsTimeout(self, name)
+            finally:
+                del self._pending[txid]
+                future.cancel()
+
+        response = decode_response(data)
+        if response.truncated:
+            self.tcp_fallbacks += 1
+            response = await self.query_tcp(message)
+        return response
+
+    async def query_tcp(self, message):
+        """RFC 1035 4.2.2：两字节长度前缀 + 报文"""
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                    self.tcp_timeout)
+        except asyncio.TimeoutError:
+            raise DnsTimeout(self, 'TCP') from None
+        try:
+            writer.write(struct.pack('!H', len(message)) + message)
+            length = struct.unpack('!H', await asyncio.wait_for(reader.readexactly(2), self.tcp_timeout))[0]
+            data = await asyncio.wait_for(reader.readexactly(length), self.tcp_timeout)
+        except asyncio.TimeoutError:
+            raise DnsTimeout(self, 'TCP') from None
+        finally:
+            writer.close()
+        return decode_response(data)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+class NativeResolver:
+    """直接用 DNS 协议查询多个上游，每个查询发给在途请求最少的上游"""
+
+    def __init__(self, upstreams=None, **options):
+        upstreams = upstreams or configured_upstreams()
+        self.upstreams = [UpstreamResolver(host, port, **options) for host, port in upstreams]
+
+    def pick(self):
+        return min(self.upstreams, key=lambda upstream: upstream.in_flight)
+
+    async def resolve(self, domain, targets=None):
+        """查询 A 与 AAAA，合并为一个 DnsResult；CNAME 目标的 AAAA 通过共享缓存只查一次"""
+        return await resolve_via_targets(domain, self.pick().query, targets or default_target_cache())
+
+    def close(self):
+        for upstream in self.upstreams:
+            upstream.close()
+
+_default_resolver = None
+
+def default_resolver():
+    """当前事件循环共用的解析器，换了事件循环（如多次 asyncio.run）时重新创建"""
+    global _default_resolver
+    loop = asyncio.get_running_loop()
+    if _default_resolver is None or _default_resolver[0] is not loop:
+        _default_resolver = (loop, NativeResolver())
+    return _default_resolver[1]
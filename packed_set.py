@@ -0,0 +1,290 @@
+import argparse
+import bisect
+import ipaddress
+import mmap
+import os
+import socket
+import struct
+import sys
+from array import array
+
+from domain_store import SEP, SEP_BYTE, normalize_domain, reverse_key
+
+# IP 集合：头部 + 排序后的大端 IPv4 (4 字节) 数组 + 排序后的大端 IPv6 (16 字节) 数组。
+# 大端字节串的字典序即数值顺序，查询时直接比较 mmap 中的切片，无需解析
+IP_MAGIC = b'CFIPSET1'
+IP_HEADER = struct.Struct('<8sII')  # magic, IPv4 数量, IPv6 数量
+
+# 域名集合：头部 + (数量 + 1) 个 uint32 偏移 + 字符串拼接区。
+# 键为反转标签（与 DomainStore 相同），某个域名的所有子域名在排序后连续
+DOMAIN_MAGIC = b'CFDOMST1'
+DOMAIN_HEADER = struct.Struct('<8sII')  # magic, 域名数量, 拼接区长度
+
+OPTIMIZED_IPS_BIN = '优选域名ip.bin'
+OPTIMIZED_DOMAINS_BIN = '优选域名.bin'
+
+def _atomic_write(path, chunks):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def write_ip_set(path, ips):
+    """把 IP 字符串写成排序去重的打包文件，无效地址忽略"""
+    v4, v6 = set(), set()
+    for ip in ips:
+        ip = ip.strip()
+        try:
+            if ':' in ip:
+                v6.add(socket.inet_pton(socket.AF_INET6, ip))
+            else:
+                v4.add(socket.inet_pton(socket.AF_INET, ip))
+        except OSError:
+            continue
+    _atomic_write(path, [IP_HEADER.pack(IP_MAGIC, len(v4), len(v6)), b''.join(sorted(v4)), b''.join(sorted(v6))])
+    return len(v4), len(v6)
+
+def write_domain_set(path, domains):
+    keys = set()
+    for domain in domains:
+        domain = normalize_domain(domain)
+        if domain is not None:
+            keys.add(reverse_key(domain).encode('ascii'))
+    keys = sorted(keys)
+    offsets = array('I', [0])
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+    blob = b''.join(keys)
+    _atomic_write(path, [DOMAIN_HEADER.pack(DOMAIN_MAGIC, len(keys), len(blob)),
+                         _little_endian(offsets).tobytes(), blob])
+    return len(keys)
+
+class _FixedEntries:
+    """mmap 中定长记录的只读序列视图，供 bisect 使用"""
+
+    def __init__(self, buf, start, width, count):
+        self.buf = buf
+        self.start = start
+        self.width = width
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        offset = self.start + i * self.width
+        return self.buf[offset:offset + self.width]
+
+class _BlobEntries:
+    """偏移表 + 拼接区的只读序列视图"""
+
+    def __init__(self, buf, offsets_start, blob_start, count):
+        self.buf = buf
+        self.offsets_start = offsets_start
+        self.blob_start = blob_start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        begin, end = struct.unpack_from('<II', self.buf, self.offsets_start + 4 * i)
+        return self.buf[self.blob_start + begin:self.blob_start + end]
+
+class _Mapped:
+    def __init__(self, path, magic, header):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        found, *fields = header.unpack_from(self._mmap, 0)
+        if found != magic:
+            self.close()
+            raise ValueError(f"{path} 不是有效的打包集合文件")
+        self._fields = fields
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if not self._mmap.closed:
+            self._mmap.close()
+        self._file.close()
+
+class PackedIpSet(_Mapped):
+    """mmap 打开的 IP 集合，打开耗时与集合大小无关，查询为 O(log n)"""
+
+    def __init__(self, path=OPTIMIZED_IPS_BIN):
+        super().__init__(path, IP_MAGIC, IP_HEADER)
+        v4_count, v6_count = self._fields
+        self._v4 = _FixedEntries(self._mmap, IP_HEADER.size, 4, v4_count)
+        self._v6 = _FixedEntries(self._mmap, IP_HEADER.size + 4 * v4_count, 16, v6_count)
+
+    def __len__(self):
+        return len(self._v4) + len(self._v6)
+
+    def count(self, version):
+        return len(self._v4 if version == 4 else self._v6)
+
+    def _entries(self, packed):
+        return self._v4 if len(packed) == 4 else self._v6
+
+    def __contains__(self, ip):
+        packed = ipaddress.ip_address(ip).packed
+        entries = self._entries(packed)
+        i = bisect.bisect_left(entries, packed)
+        return i < len(entries) and entries[i] == packed
+
+    def range(self, first, last):
+        """产出 [first, last] 之间的所有地址（同一地址族）"""
+        first, last = ipaddress.ip_address(first), ipaddress.ip_address(last)
+        if first.version != last.version:
+            raise ValueError("起止地址必须属于同一地址族")
+        entries = self._entries(first.packed)
+        family = socket.AF_INET if first.version == 4 else socket.AF_INET6
+        start = bisect.bisect_left(entries, first.packed)
+        end = bisect.bisect_right(entries, last.packed)
+        for i in range(start, end):
+            yield socket.inet_ntop(family, entries[i])
+
+    def in_network(self, network):
+        """产出落在某个 CIDR 内的所有地址"""
+        network = ipaddress.ip_network(network, strict=False)
+        return self.range(network.network_address, network.broadcast_address)
+
+    def __iter__(self):
+        for entries, family in ((self._v4, socket.AF_INET), (self._v6, socket.AF_INET6)):
+            for i in range(len(entries)):
+                yield socket.inet_ntop(family, entries[i])
+
+class PackedDomainSet(_Mapped):
+    """mmap 打开的域名集合，支持精确查询与按父域名列出子域名"""
+
+    def __init__(self, path=OPTIMIZED_DOMAINS_BIN):
+        super().__init__(path, DOMAIN_MAGIC, DOMAIN_HEADER)
+        count, _ = self._fields
+        offsets_start = DOMAIN_HEADER.size
+        self._keys = _BlobEntries(self._mmap, offsets_start, offsets_start + 4 * (count + 1), count)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _key(domain):
+        domain = normalize_domain(domain)
+        return None if domain is None else reverse_key(domain).encode('ascii')
+
+    @staticmethod
+    def _domain(key):
+        return '.'.join(reversed(key.decode('ascii').split(SEP)))
+
+    def __contains__(self, domain):
+        key = self._key(domain)
+        if key is None:
+            return False
+        i = bisect.bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def subdomains(self, domain, include_self=True):
+        """产出 domain 本身（若存在）及其所有子域名"""
+        key = self._key(domain)
+        if key is None:
+            return
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            if include_self:
+                yield self._domain(key)
+            i += 1
+        # 子域名的键都以 key + SEP 开头，以 SEP 的下一个字节作为上界
+        end = bisect.bisect_left(self._keys, key + bytes([SEP_BYTE[0] + 1]), i)
+        for j in range(i, end):
+            yield self._domain(self._keys[j])
+
+    def __iter__(self):
+        for i in range(len(self._keys)):
+            yield self._domain(self._keys[i])
+
+def open_packed(path):
+    """按文件头自动选择 PackedIpSet 或 PackedDomainSet"""
+    with open(path, 'rb') as f:
+        magic = f.read(8)
+    if magic == IP_MAGIC:
+        return PackedIpSet(path)
+    if magic == DOMAIN_MAGIC:
+        return PackedDomainSet(path)
+    raise ValueError(f"{path} 不是有效的打包集合文件")
+
+def read_lines(path):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="打包集合文件的生成与查询（mmap + 二分查找）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('build', help="从文本列表生成打包文件")
+    p.add_argument('kind', choices=('ips', 'domains'))
+    p.add_argument('input')
+    p.add_argument('output')
+
+    p = subparsers.add_parser('contains', help="判断 IP/域名是否在集合中，全部存在时返回 0")
+    p.add_argument('file')
+    p.add_argument('items', nargs='+')
+
+    p = subparsers.add_parser('range', help="列出 CIDR 内的 IP，或某个域名及其子域名")
+    p.add_argument('file')
+    p.add_argument('query')
+
+    p = subparsers.add_parser('info', help="显示集合大小")
+    p.add_argument('file')
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        if args.kind == 'ips':
+            v4, v6 = write_ip_set(args.output, read_lines(args.input))
+            print(f"已写入 {args.output}: IPv4 {v4} 个，IPv6 {v6} 个")
+        else:
+            print(f"已写入 {args.output}: 域名 {write_domain_set(args.output, read_lines(args.input))} 个")
+        return 0
+
+    with open_packed(args.file) as packed:
+        if args.command == 'info':
+            if isinstance(packed, PackedIpSet):
+                print(f"IPv4: {packed.count(4)}，IPv6: {packed.count(6)}")
+            else:
+                print(f"域名: {len(packed)}")
+            return 0
+        if args.command == 'contains':
+            missing = 0
+            for item in args.items:
+                try:
+                    found = item in packed
+                except ValueError:
+                    found = False
+                missing += not found
+                print(f"{item}\t{'是' if found else '否'}")
+            return 1 if missing else 0
+        if isinstance(packed, PackedIpSet):
+            try:
+                results = packed.in_network(args.query)
+            except ValueError as e:
+                print(f"无效的 CIDR/IP: {e}", file=sys.stderr)
+                return 1
+        else:
+            results = packed.subdomains(args.query)
+        sys.stdout.writelines(f"{item}\n" for item in results)
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import argparse
+import json
+import sys
+
+# 与 bat/优选域名批处理tls.bat、优选域名批处理notls.bat 相同的端口
+TLS_PORTS = (443, 8443, 2053, 2083, 2087, 2096)
+NOTLS_PORTS = (80, 8080, 8880, 2052, 2082, 2086, 2095)
+# 备注后缀默认是端口号，443 与 80 沿用批处理里的 1111 与 1180
+PORT_TAGS = {443: '1111', 80: '1180'}
+
+DEFAULT_INPUTS = ['优选域名.txt', '优选域名ip.txt']
+DEFAULT_OUTPUTS = {'plain': '优选域名导出.txt', 'clash': '优选域名导出.yaml', 'sing-box': '优选域名导出.json'}
+
+# 每次写入前拼接的行数
+WRITE_CHUNK = 8192
+
+def read_hosts(paths):
+    """逐行读取域名/IP，'-' 表示标准输入"""
+    for path in paths:
+        handle = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8-sig')
+        try:
+            for line in handle:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+
+def parse_ports(value):
+    return tuple(int(port) for port in value.split(',') if port.strip())
+
+def tag_for(host, port):
+    return f"{host}{PORT_TAGS.get(port, port)}d"
+
+def _address(host):
+    # IPv6 地址需要方括号才能与端口区分
+    return f"[{host}]" if ':' in host else host
+
+def _literal(text):
+    """模板中的固定部分，转义花括号以便整体用 str.format 填充"""
+    return text.replace('{', '{{').replace('}', '}}')
+
+def _quoted(host):
+    """JSON 字符串中的地址（不含引号）；普通的域名和 IP 不需要转义"""
+    if host.isascii() and host.isprintable() and '"' not in host and '\\' not in host:
+        return host
+    return json.dumps(host, ensure_ascii=False)[1:-1]
+
+def _json_fields(template, skip):
+    """模板中除 skip 以外的字段，序列化为 ', "键": 值' 的形式"""
+    return ''.join(f", {json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}"
+                   for key, value in template.items() if key not in skip)
+
+# 每种格式是 (开头, 每个地址的格式, 地址之间的分隔, 结尾)。每个地址的格式一次展开全部端口，
+# 以 {0}（地址，IPv6 带方括号）、{1}（原样的地址）、{2}（JSON 转义后的地址）填充
+
+def plain_layout(ports, tls_ports, template):
+    """host:port#备注，与批处理的输出相同"""
+    entry = ''.join('{0}:' + str(port) + '#{1}' + _literal(tag_for('', port)) + '\n' for port in ports)
+    return '', entry, '', ''
+
+def clash_layout(ports, tls_ports, template):
+    """Clash 的 proxies 列表，每个节点一行 flow 映射（JSON 对象本身就是合法的 YAML）"""
+    extra = _literal(_json_fields(template, ('name', 'server', 'port', 'tls')))
+    entry = ''.join('  - {{"name": "{2}' + _literal(tag_for('', port)) + '", "server": "{2}", "port": ' + str(port)
+                    + ', "tls": ' + json.dumps(port in tls_ports) + extra + '}}\n' for port in ports)
+    return 'proxies:\n', entry, '', ''
+
+def sing_box_layout(ports, tls_ports, template):
+    """sing-box 的 outbounds 数组，TLS 端口在模板的 tls 设置上启用 TLS"""
+    extra = _literal(_json_fields(template, ('tag', 'server', 'server_port', 'tls')))
+    tls = _literal(', "tls": ' + json.dumps(dict(template.get('tls') or {}, enabled=True), ensure_ascii=False))
+    entry = ',\n'.join('    {{"tag": "{2}' + _literal(tag_for('', port)) + '", "server": "{2}", "server_port": '
+                        + str(port) + (tls if port in tls_ports else '') + extra + '}}' for port in ports)
+    return '{\n  "outbounds": [\n', entry, ',\n', '\n  ]\n}\n'
+
+LAYOUTS = {'plain': plain_layout, 'clash': clash_layout, 'sing-box': sing_box_layout}
+
+def render(hosts, fmt='plain', ports=TLS_PORTS, tls_ports=TLS_PORTS, template=None):
+    """每个地址按 ports 的顺序展开，逐个产出输出片段"""
+    header, entry, separator, footer = LAYOUTS[fmt](ports, frozenset(tls_ports), template or {})
+    yield header
+    fill = entry.format
+    fill_next = (_literal(separator) + entry).format
+    for host in hosts:
+        yield fill(_address(host), host, _quoted(host))
+        fill = fill_next
+    yield footer
+
+def write_chunks(handle, pieces, chunk=WRITE_CHUNK):
+    """把生成器产出的片段攒成大块再写"""
+    buffer = []
+    for piece in pieces:
+        buffer.append(piece)
+        if len(buffer) >= chunk:
+            handle.write(''.join(buffer))
+            buffer = []
+    if buffer:
+        handle.write(''.join(buffer))
+
+def export(paths, output, fmt='plain', ports=TLS_PORTS, tls_ports=TLS_PORTS, template=None):
+    """流式读取 paths，展开端口后按 fmt 写入 output，返回节点数"""
+    count = 0
+
+    def counted(hosts):
+        nonlocal count
+        for host in hosts:
+            count += 1
+            yield host
+
+    pieces = render(counted(read_hosts(paths)), fmt, ports, tls_ports, template)
+    if output == '-':
+        write_chunks(sys.stdout, pieces)
+    else:
+        with open(output, 'w', encoding='utf-8', newline='\n', buffering=1 << 20) as f:
+            write_chunks(f, pieces)
+    return count * len(ports)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把优选域名/IP 展开为 host:port 节点，取代 bat/优选域名批处理*.bat")
+    parser.add_argument('inputs', nargs='*', default=DEFAULT_INPUTS, help="输入列表，'-' 表示标准输入")
+    parser.add_argument('-f', '--format', choices=sorted(LAYOUTS), default='plain')
+    parser.add_argument('-p', '--ports', choices=('tls', 'notls', 'all'), default='tls',
+                        help="展开的端口组，all 为先 TLS 后非 TLS")
+    parser.add_argument('--tls-ports', type=parse_ports, default=TLS_PORTS, help="TLS 端口，逗号分隔")
+    parser.add_argument('--notls-ports', type=parse_ports, default=NOTLS_PORTS, help="非 TLS 端口，逗号分隔")
+    parser.add_argument('--template', help="代理模板 JSON 文件（type、uuid 等），clash/sing-box 格式必需，节点在其基础上填入地址与端口")
+    parser.add_argument('-o', '--output', help="输出文件，'-' 表示标准输出，默认按格式取 优选域名导出.*")
+    args = parser.parse_args(argv)
+
+    ports = {'tls': args.tls_ports, 'notls': args.notls_ports, 'all': args.tls_ports + args.notls_ports}[args.ports]
+    if not ports:
+        parser.error("端口列表为空")
+    template = None
+    if args.template:
+        with open(args.template, 'r', encoding='utf-8') as f:
+            template = json.load(f)
+    elif args.format != 'plain':
+        # 没有 type、uuid 等字段的节点无法被 clash/sing-box 加载
+        parser.error(f"{args.format} 格式需要 --template 提供代理类型等字段")
+    if template is not None and 'type' not in template and args.format != 'plain':
+        parser.error("模板中缺少 type 字段")
+    output = args.output or DEFAULT_OUTPUTS[args.format]
+    count = export(args.inputs, output, args.format, ports, args.tls_ports, template)
+    if output != '-':
+        print(f"已写入 {output}: {count} 个节点", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,34 @@
+import argparse
 import asyncio
-import random
 import time
-from bs4 import BeautifulSoup
 import aiohttp
-import sys
 import math
 import json
+import os
 
-async def query_with_rate_limit(func, *args):
-    while True:
-        try:
-            await asyncio.sleep(random.uniform(1, 2))
-            return await func(*args)
-        except Exception as e:
-            print(f"查询失败: {e}")
-            await asyncio.sleep(2)
-
-async def query_bgp(session, domain):
-    query_url = f"https://bgp.he.net/dns/{domain}#_ipinfo"
-    async with session.get(query_url) as response:
-        content = await response.text()
-    soup = BeautifulSoup(content, 'html.parser')
-    ip_info_div = soup.find('div', id='ipinfo')
-    if ip_info_div:
-        ips = [a.get('title') for a in ip_info_div.find_all('a') if a.get('href', '').startswith('/ip/')]
-        return list(set(ips))
-    return []
+from bgp_pipeline import BGP_BASE_URL, extract_ipinfo, fetch_page
+from dns_message import DnsResult
+from doh_client import DohError, check_status, create_session, empty_result, resolve
+from resolution_cache import ResolutionCache, add_freshness_arguments, apply_freshness_arguments
+from result_journal import ResultJournal, completed_results, mark_done, start_journal
+from metrics import RunMetrics
+from cname_targets import default_target_cache
+from native_dns import UPSTREAMS_ENV, default_resolver
+from rate_control import AdaptiveLimiter
+from scheduler import WorkStealingScheduler, load_weights
+from stage_profile import add_argument, profiling, stage
+
+async def query_bgp(session, domain, base_url=BGP_BASE_URL):
+    ips = extract_ipinfo(await fetch_page(session, domain, base_url))
+    return DnsResult(list(ips), None, 0, ()) if ips else empty_result()
+
+def parse_dns_json(data):
+    answers = data.get('Answer') or []
+    addresses = [answer for answer in answers if answer['type'] in (1, 28)]
+    return DnsResult([answer['data'] for answer in addresses],
+                     min((answer.get('TTL', 0) for answer in addresses), default=None),
+                     data.get('Status', 0),
+                     tuple(answer['data'].rstrip('.') for answer in answers if answer['type'] == 5))
 
 async def query_dns_json(session, ipv4_url, ipv6_url):
     async def fetch_ip(url):
@@ -33,142 +36,237 @@ async def query_dns_json(session, ipv4_url, ipv6_url):
             'accept': 'application/dns-json'
         }
         async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                try:
-                    data = await response.json()
-                    if data.get('Answer'):
-                        return [answer['data'] for answer in data['Answer'] if answer['type'] in (1, 28)]
-                except aiohttp.ContentTypeError:
-                    print(f"解析JSON失败: {url}")
-            else:
-                print(f"查询失败: {url} 返回状态码 {response.status}")
-            return []
+            try:
+                check_status(url, response)
+                return parse_dns_json(await response.json(content_type=None))
+            except DohError as e:
+                if e.retryable:
+                    raise
+                print(f"查询失败: {e}")
+            except (aiohttp.ContentTypeError, ValueError):
+                print(f"解析JSON失败: {url}")
+            return empty_result()
 
     ipv4 = await fetch_ip(ipv4_url)
     ipv6 = await fetch_ip(ipv6_url)
-    return list(set(ipv4 + ipv6))
+    ttls = [ttl for ttl in (ipv4.ttl, ipv6.ttl) if ttl is not None]
+    return DnsResult(list(set(ipv4.ips + ipv6.ips)), min(ttls) if ttls else None,
+                     0 if ipv4.ips or ipv6.ips else ipv4.rcode or ipv6.rcode,
+                     ipv4.cnames or ipv6.cnames)
+
+async def query_dns_wire(session, url, domain):
+    """4xx 等不可重试的 DohError 也向上抛出，由调度器记为空应答，指标中保留真实状态码"""
+    return await resolve(session, url, domain)
 
 async def query_dns_google(session, domain):
-    return await query_dns_json(session, 
-        f"https://dns.google/resolve?name={domain}&type=A",
-        f"https://dns.google/resolve?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://dns.google/dns-query", domain)
 
 async def query_dns_quad9(session, domain):
-    return await query_dns_json(session, 
-        f"https://dns10.quad9.net:5053/dns-query?name={domain}&type=A",
-        f"https://dns10.quad9.net:5053/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://dns10.quad9.net/dns-query", domain)
 
 async def query_dns_twnic(session, domain):
-    return await query_dns_json(session, 
-        f"https://dns.twnic.tw/dns-query?name={domain}&type=A",
-        f"https://dns.twnic.tw/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://dns.twnic.tw/dns-query", domain)
 
 async def query_dns_sb(session, domain):
-    return await query_dns_json(session, 
-        f"https://doh.sb/dns-query?name={domain}&type=A",
-        f"https://doh.sb/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://doh.sb/dns-query", domain)
 
 async def query_dns_kr_sel(session, domain):
-    return await query_dns_json(session, 
-        f"https://kr-sel.doh.sb/dns-query?name={domain}&type=A",
-        f"https://kr-sel.doh.sb/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://kr-sel.doh.sb/dns-query", domain)
 
 async def query_dns_sg_sin(session, domain):
-    return await query_dns_json(session, 
-        f"https://sg-sin.doh.sb/dns-query?name={domain}&type=A",
-        f"https://sg-sin.doh.sb/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://sg-sin.doh.sb/dns-query", domain)
 
 async def query_dns_jp_nrt(session, domain):
-    return await query_dns_json(session, 
-        f"https://jp-nrt.doh.sb/dns-query?name={domain}&type=A",
-        f"https://jp-nrt.doh.sb/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://jp-nrt.doh.sb/dns-query", domain)
 
 async def query_dns_hk_hkg(session, domain):
-    return await query_dns_json(session, 
-        f"https://hk-hkg.doh.sb/dns-query?name={domain}&type=A",
-        f"https://hk-hkg.doh.sb/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://hk-hkg.doh.sb/dns-query", domain)
 
 async def query_dns_uk_lon(session, domain):
-    return await query_dns_json(session, 
-        f"https://uk-lon.doh.sb/dns-query?name={domain}&type=A",
-        f"https://uk-lon.doh.sb/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://uk-lon.doh.sb/dns-query", domain)
 
 async def query_dns_de_fra(session, domain):
-    return await query_dns_json(session, 
-        f"https://de-fra.doh.sb/dns-query?name={domain}&type=A",
-        f"https://de-fra.doh.sb/dns-query?name={domain}&type=AAAA")
+    return await query_dns_wire(session, "https://de-fra.doh.sb/dns-query", domain)
+
+async def query_dns_native(session, domain):
+    """不经过 DoH，直接用 UDP（截断时 TCP）查询 DNS_UPSTREAMS 中的上游"""
+    return await default_resolver().resolve(domain)
+
+QUERY_METHODS = ['de_fra', 'google', 'quad9', 'twnic', 'uk_lon', 'sb', 'kr_sel', 'sg_sin', 'jp_nrt', 'hk_hkg']
+# 没有实测吞吐时使用的默认比例
+METHOD_RATIOS = {'de_fra': 60, 'google': 71, 'quad9': 71, 'twnic': 58, 'uk_lon': 62, 'sb': 68, 'kr_sel': 62, 'sg_sin': 38, 'jp_nrt': 51, 'hk_hkg': 45}
+
+# 各解析器限速器的初始参数，未列出的使用 AdaptiveLimiter 默认值；
+# native 直连 UDP 没有 HTTP 开销，起点和上限都高得多
+LIMITER_OPTIONS = {
+    'native': {'rate': 200, 'concurrency': 32, 'max_concurrency': 128, 'max_rate': 3000},
+}
+
+QUERY_FUNCTIONS = {
+    'de_fra': query_dns_de_fra,
+    'google': query_dns_google,
+    'quad9': query_dns_quad9,
+    'twnic': query_dns_twnic,
+    'uk_lon': query_dns_uk_lon,
+    'sb': query_dns_sb,
+    'kr_sel': query_dns_kr_sel,
+    'sg_sin': query_dns_sg_sin,
+    'jp_nrt': query_dns_jp_nrt,
+    'hk_hkg': query_dns_hk_hkg,
+    'native': query_dns_native,
+}
 
-async def process_domains(domains, query_func, semaphore):
+def default_limiters(backends):
+    return {name: AdaptiveLimiter(**LIMITER_OPTIONS.get(name, {})) for name in backends}
+
+async def process_backends(domains, backends, limiters=None, cache=None, metrics=None, journal=None):
+    """在同一个进程中用工作窃取调度器跑多个解析器，返回 (结果列表, 失败域名列表, 调度器)
+
+    传入 journal 时结果直接追加到日志，不在内存中累积，返回的结果列表为空。
+    """
     results = []
-    async with aiohttp.ClientSession() as session:
-        async def worker(domain):
-            async with semaphore:
-                ips = await query_with_rate_limit(query_func, session, domain)
-                results.extend((domain, ip) for ip in ips)
-
-        tasks = [asyncio.create_task(worker(domain)) for domain in domains]
-        await asyncio.gather(*tasks)
-    
-    return results
-
-async def main(query_method):
-    with open('temp_domains.txt', 'r') as f:
-        all_domains = f.read().splitlines()
-
-    # 新的查询方法和比例
-    query_methods = ['de_fra', 'google', 'quad9', 'twnic', 'uk_lon', 'sb', 'kr_sel', 'sg_sin', 'jp_nrt', 'hk_hkg']
-    method_ratios = {'de_fra': 60, 'google': 71, 'quad9': 71, 'twnic': 58, 'uk_lon': 62, 'sb': 68, 'kr_sel': 62, 'sg_sin': 38, 'jp_nrt': 51, 'hk_hkg': 45}
-    total_ratio = sum(method_ratios.values())
-
-    total_domains = len(all_domains)
-    method_index = query_methods.index(query_method)
-
-    # 计算每个方法应处理的域名数量
+    failures = []
+
+    def on_result(domain, result, resolver):
+        if result is None:
+            failures.append(domain)
+            return
+        if journal is not None:
+            journal.record(domain, result.ips)
+        else:
+            results.extend((domain, ip) for ip in result.ips)
+        if cache is not None:
+            cache.store(domain, result, resolver)
+
+    if limiters is None:
+        limiters = default_limiters(backends)
+    scheduler = WorkStealingScheduler(backends, limiters, on_result=on_result, metrics=metrics)
+    scheduler.add(domains)
+    async with create_session() as session:
+        await scheduler.run(session)
+    return results, failures, scheduler
+
+async def process_domains(domains, query_func, limiter, cache=None, resolver=None):
+    """单个解析器的分片：返回 (结果列表, 多次重试后仍失败的域名列表)"""
+    resolver = resolver or 'default'
+    results, failures, _ = await process_backends(domains, {resolver: query_func}, {resolver: limiter}, cache)
+    return results, failures
+
+def shard_range(total_domains, query_method, weights=None):
+    """按比例计算某个解析器分片的 [start, end)；weights 为实测吞吐，缺失时用默认比例"""
+    ratios = dict(METHOD_RATIOS)
+    if weights:
+        # 没有实测数据的解析器按已测解析器的平均值估计
+        average = sum(weights.values()) / len(weights)
+        ratios = {method: weights.get(method, average) for method in QUERY_METHODS}
+    total_ratio = sum(ratios.values())
+
     domains_per_ratio = total_domains / total_ratio
     start = 0
-    for i in range(method_index):
-        start += math.ceil(domains_per_ratio * method_ratios[query_methods[i]])
-    
-    end = start + math.ceil(domains_per_ratio * method_ratios[query_method])
-    end = min(end, total_domains)  # 确保不超过总域名数
+    for method in QUERY_METHODS[:QUERY_METHODS.index(query_method)]:
+        start += math.ceil(domains_per_ratio * ratios[method])
+    start = min(start, total_domains)
 
-    domains = all_domains[start:end]
+    end = start + math.ceil(domains_per_ratio * ratios[query_method])
+    end = min(end, total_domains)  # 确保不超过总域名数
+    return start, end
 
-    print(f"Processing {len(domains)} domains for method: {query_method}")
+async def main(query_method, cache_path=None, refresh_limit=None, fresh_start=False):
+    with stage('load_domains'):
+        with open('temp_domains.txt', 'r') as f:
+            all_domains = f.read().splitlines()
 
-    semaphore = asyncio.Semaphore(10)  # 限制并发查询数为10
-
-    query_functions = {
-        'de_fra': query_dns_de_fra,
-        'google': query_dns_google,
-        'quad9': query_dns_quad9,
-        'twnic': query_dns_twnic,
-        'uk_lon': query_dns_uk_lon,
-        'sb': query_dns_sb,
-        'kr_sel': query_dns_kr_sel,
-        'sg_sin': query_dns_sg_sin,
-        'jp_nrt': query_dns_jp_nrt,
-        'hk_hkg': query_dns_hk_hkg
-    }
-
-    if query_method in query_functions:
-        try:
-            results = await process_domains(domains, query_functions[query_method], semaphore)
-        except Exception as e:
-            print(f"处理 {query_method} 时发生错误: {e}")
-            return
+    if query_method == 'all':
+        # 单进程模式：所有解析器共享一个队列
+        backends = QUERY_FUNCTIONS
+        domains = all_domains
+    elif query_method in QUERY_METHODS:
+        # 分片模式：同一个调度器，只跑一个解析器
+        backends = {query_method: QUERY_FUNCTIONS[query_method]}
+        start, end = shard_range(len(all_domains), query_method, load_weights())
+        domains = all_domains[start:end]
+    elif query_method in QUERY_FUNCTIONS:
+        # 不参与分片的解析器（如 native）单独处理全部域名
+        backends = {query_method: QUERY_FUNCTIONS[query_method]}
+        domains = all_domains
     else:
         print(f"未知的查询方法: {query_method}")
         return
 
-    with open(f'ip_results_{query_method}.txt', 'w') as f:
-        for domain, ip in results:
-            f.write(f"{domain},{ip}\n")
+    cache = None
+    started_at = int(time.time())
+    if cache_path:
+        with stage('cache_split'):
+            cache = ResolutionCache(cache_path)
+            domains, fresh = cache.split_stale(domains, refresh_limit)
+        print(f"{query_method}: 缓存中 {len(fresh)} 个域名仍然新鲜，跳过查询")
+
+    # 结果边查询边追加到日志；重启时跳过日志里已经完成的域名
+    journal_path = f'ip_results_{query_method}.txt'
+    start_journal(journal_path, fresh_start)
+    with stage('journal_resume'):
+        completed = completed_results(journal_path)
+        if completed:
+            if cache is not None:
+                # 上次中断前完成的结果补回缓存，否则它们不会出现在本次导出的缓存更新里
+                for domain in domains:
+                    ips = completed.get(domain)
+                    if ips is not None:
+                        cache.store(domain, DnsResult(ips, None, 0, ()), 'journal')
+            domains = [domain for domain in domains if domain not in completed]
+            print(f"{query_method}: 日志中已有 {len(completed)} 个域名完成，从中断处继续")
+
+    print(f"Processing {len(domains)} domains for method: {query_method}")
+
+    metrics = RunMetrics(backends)
+    journal = ResultJournal(journal_path)
+    try:
+        with stage('resolve'):
+            _, failures, scheduler = await process_backends(domains, backends, cache=cache, metrics=metrics,
+                                                            journal=journal)
+    except Exception as e:
+        print(f"处理 {query_method} 时发生错误: {e}")
+        return
+    finally:
+        journal.close()
+        if cache is not None:
+            # 只上传本次更新的条目，由 main.py 合并回完整缓存
+            with stage('export_cache'):
+                cache.export_updates(f'cache_updates_{query_method}.sqlite', started_at)
+                cache.close()
+    mark_done(journal_path)
+
+    if failures:
+        print(f"{query_method}: {len(failures)} 个域名多次重试后仍查询失败")
+        with open(f'failed_domains_{query_method}.txt', 'w') as f:
+            f.write('\n'.join(failures))
+
+    metrics.write_json(f'metrics_{query_method}.json')
+    metrics.write_prometheus(f'metrics_{query_method}.prom')
+
+    # 实测吞吐，由 main.py 汇总为下次分片的比例
+    stats = {name: stat.as_dict() for name, stat in scheduler.stats.items()}
+    with open(f'resolver_stats_{query_method}.json', 'w') as f:
+        json.dump(stats, f, indent=2)
+    for name, stat in stats.items():
+        print(f"{name}: 完成 {stat['completed']}，失败 {stat['failed']}，转交 {stat['handed_off']}，{stat['throughput']} 域名/秒")
+    targets = default_target_cache().as_dict()
+    print(f"CNAME 目标 {targets['targets']} 个：命中 {targets['hits']}，合并 {targets['coalesced']}，"
+          f"查询 {targets['misses']}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python query_ip.py <query_method>")
-        sys.exit(1)
-    
-    query_method = sys.argv[1]
-    asyncio.run(main(query_method))
+    parser = argparse.ArgumentParser(usage="python query_ip.py <query_method> [--cache FILE] [--refresh-limit N] [--fresh] [--upstreams LIST] [--cache-* SECONDS] [--profile [MODE]]")
+    parser.add_argument('query_method', help="解析器名称，或 all 表示单进程跑全部解析器")
+    parser.add_argument('--cache', help="解析缓存文件，仍新鲜的域名不再查询")
+    parser.add_argument('--refresh-limit', type=int, help="本次最多刷新的过期域名数量")
+    parser.add_argument('--fresh', action='store_true', help="丢弃已有的结果日志，从头查询")
+    parser.add_argument('--upstreams', help="native 方法使用的上游，逗号分隔的 host[:port]")
+    add_freshness_arguments(parser)
+    add_argument(parser)
+    args = parser.parse_args()
+    if args.upstreams:
+        os.environ[UPSTREAMS_ENV] = args.upstreams
+    apply_freshness_arguments(args)
+
+    with profiling(f'query_ip_{args.query_method}', args.profile):
+        asyncio.run(main(args.query_method, args.cache, args.refresh_limit, args.fresh))
@@ -0,0 +1,130 @@
+import asyncio
+import email.utils
+import random
+import time
+
+# 需要退避的 HTTP 状态码
+BACKOFF_STATUSES = {429, 500, 502, 503, 504}
+
+class RetryableError(Exception):
+    """解析器限流或服务端错误，携带状态码与可选的 Retry-After 秒数
+
+    子类可以把 retryable 置为 False（如 4xx），调度器不再重试，记为空应答并保留状态码。
+    """
+
+    retryable = True
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def parse_retry_after(value, now=None):
+    """Retry-After 可以是秒数，也可以是 HTTP 日期（RFC 9110 10.2.3），统一换算为秒"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        return None
+    return max(0.0, when.timestamp() - (now if now is not None else time.time()))
+
+class AdaptiveLimiter:
+    """单个解析器的令牌桶 + AIMD 并发控制
+
+    每次成功且延迟正常时加性增加并发与速率；遇到 429/5xx、超时或延迟明显变差时乘性减少，
+    并遵守 Retry-After 暂停发送。
+    """
+
+    def __init__(self, rate=10.0, concurrency=4, min_concurrency=1, max_concurrency=64,
+                 max_rate=200.0, min_rate=0.5, latency_factor=3.0, decrease_interval=1.0):
+        self.rate = rate
+        self.concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.latency_factor = latency_factor
+        self.decrease_interval = decrease_interval
+
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._min_latency = None
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def _refill(self, now):
+        self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self):
+        await self.reserve()
+        await self.wait_token()
+
+    async def reserve(self):
+        """只占用一个并发名额，之后需要 wait_token() 或 release()"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < int(self.concurrency))
+            self._in_flight += 1
+
+    async def wait_token(self):
+        """在已占用的名额上等待令牌桶与 Retry-After 暂停；被取消时归还名额，调用方不会再 release()"""
+        try:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+        except asyncio.CancelledError:
+            await asyncio.shield(self.release())
+            raise
+
+    async def release(self):
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency):
+        if self._min_latency is None or latency < self._min_latency:
+            self._min_latency = latency
+        if latency > self._min_latency * self.latency_factor and latency > 0.2:
+            self._decrease()
+            return
+        # 每完成一个并发窗口约增加 1 个并发，速率每次成功增加 1 qps
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+        self.rate = min(self.max_rate, self.rate + 1)
+
+    def on_failure(self, retry_after=None):
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        self._decrease()
+
+    def _decrease(self):
+        # 短时间内的多次失败只减少一次
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_interval:
+            return
+        self._last_decrease = now
+        self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = min(self._tokens, 0.0)
+
+    def backoff(self, attempt):
+        return min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
@@ -0,0 +1,223 @@
+import os
+import random
+import sqlite3
+import time
+from collections import namedtuple
+from collections.abc import Collection, Sequence
+
+from dns_message import RCODE_NXDOMAIN
+
+CACHE_FILE = 'resolution_cache.sqlite'
+
+# 新鲜期 = 应答 TTL × TTL_SCALE，限制在 [MIN_FRESH, MAX_FRESH] 之间，再加 ±FRESH_JITTER 的随机抖动，
+# 让同一批写入的条目在之后几次运行中分散过期。
+#
+# 这里关心的不是地址本身，而是"域名是否解析到 Cloudflare 段内"。CDN 会在自己的段内轮换地址，
+# 这个结论比 DNS TTL（通常 300 秒）稳定得多；而每次运行要查询上百万个域名，公共 DoH 的限速
+# 不允许每次全部重查。所以 TTL 只用来排先后：300 秒约为 3.5 天，TTL 越短越早刷新；
+# 下限 1 天对应工作流的运行间隔，上限 30 天保证迁出 Cloudflare 的域名最终会被发现。
+# 以上数值都可以用 CACHE_* 环境变量或 query_ip.py / main.py 的 --cache-* 参数调整。
+TTL_SCALE = 1000
+MIN_FRESH = 24 * 3600
+MAX_FRESH = 30 * 24 * 3600
+NEGATIVE_FRESH = 3 * 24 * 3600
+FRESH_JITTER = 0.25
+
+FRESHNESS_ENV = {
+    'ttl_scale': 'CACHE_TTL_SCALE',
+    'min_fresh': 'CACHE_MIN_FRESH',
+    'max_fresh': 'CACHE_MAX_FRESH',
+    'negative_fresh': 'CACHE_NEGATIVE_FRESH',
+}
+
+# 新鲜期参数，单位为秒（ttl_scale 为倍数）
+Freshness = namedtuple('Freshness', 'ttl_scale min_fresh max_fresh negative_fresh')
+
+def configured_freshness():
+    """默认值被 CACHE_* 环境变量覆盖后的新鲜期参数"""
+    values = {'ttl_scale': TTL_SCALE, 'min_fresh': MIN_FRESH, 'max_fresh': MAX_FRESH,
+              'negative_fresh': NEGATIVE_FRESH}
+    for field, name in FRESHNESS_ENV.items():
+        value = os.environ.get(name)
+        if value:
+            try:
+                values[field] = float(value)
+            except ValueError:
+                print(f"警告: {name}={value!r} 不是数字，使用默认值 {values[field]}")
+    if values['min_fresh'] > values['max_fresh']:
+        print(f"警告: 最短新鲜期大于最长新鲜期，改用 {values['max_fresh']} 秒")
+        values['min_fresh'] = values['max_fresh']
+    return Freshness(**values)
+
+def add_freshness_arguments(parser):
+    parser.add_argument('--cache-ttl-scale', type=float, metavar='N',
+                        help=f"新鲜期为 TTL 的多少倍，默认 {TTL_SCALE}（也可设置 {FRESHNESS_ENV['ttl_scale']}）")
+    parser.add_argument('--cache-min-fresh', type=float, metavar='SECONDS',
+                        help=f"最短新鲜期，默认 {MIN_FRESH}（也可设置 {FRESHNESS_ENV['min_fresh']}）")
+    parser.add_argument('--cache-max-fresh', type=float, metavar='SECONDS',
+                        help=f"最长新鲜期，默认 {MAX_FRESH}（也可设置 {FRESHNESS_ENV['max_fresh']}）")
+    parser.add_argument('--cache-negative-fresh', type=float, metavar='SECONDS',
+                        help=f"NXDOMAIN 与空应答的新鲜期，默认 {NEGATIVE_FRESH}"
+                             f"（也可设置 {FRESHNESS_ENV['negative_fresh']}）")
+
+def apply_freshness_arguments(args):
+    """把命令行给出的新鲜期参数写入环境变量，之后创建的缓存都会使用"""
+    for field, name in FRESHNESS_ENV.items():
+        value = getattr(args, f'cache_{field}')
+        if value is not None:
+            os.environ[name] = str(value)
+
+STATUS_OK = 0
+STATUS_EMPTY = 1
+STATUS_NXDOMAIN = 3
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS resolutions (
+    domain TEXT PRIMARY KEY,
+    ips TEXT NOT NULL,
+    ttl INTEGER,
+    status INTEGER NOT NULL,
+    resolver TEXT,
+    checked_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS resolutions_expires ON resolutions (expires_at);
+'''
+
+def fresh_seconds(result, freshness=None, rng=random):
+    freshness = freshness or configured_freshness()
+    if not result.ips:
+        base = freshness.negative_fresh
+    else:
+        base = min(freshness.max_fresh, max(freshness.min_fresh, (result.ttl or 0) * freshness.ttl_scale))
+    return int(base * rng.uniform(1 - FRESH_JITTER, 1 + FRESH_JITTER))
+
+def result_status(result):
+    if result.ips:
+        return STATUS_OK
+    return STATUS_NXDOMAIN if result.rcode == RCODE_NXDOMAIN else STATUS_EMPTY
+
+class ResolutionCache:
+    """按域名缓存 A/AAAA 解析结果，包括 NXDOMAIN 与空应答的负缓存"""
+
+    def __init__(self, path=CACHE_FILE, batch_size=500, freshness=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.freshness = freshness or configured_freshness()
+        self._pending = []
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def store(self, domain, result, resolver, now=None):
+        now = int(now if now is not None else time.time())
+        self._pending.append((domain, ','.join(result.ips), result.ttl, result_status(result),
+                              resolver, now, now + fresh_seconds(result, self.freshness)))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?, ?, ?)', self._pending)
+            self._pending.clear()
+
+    def split_stale(self, domains, refresh_limit=None, now=None):
+        """把域名分成需要查询的与仍然新鲜的两部分
+
+        从未查询过的域名总是需要查询；已过期的按过期时间从早到晚排序，最多刷新 refresh_limit 个，
+        其余留到之后的运行中刷新。
+        """
+        now = int(now if now is not None else time.time())
+        self.flush()
+        expires = {}
+        domains = list(domains)
+        for i in range(0, len(domains), 900):
+            chunk = domains[i:i + 900]
+            rows = self._conn.execute(
+                f"SELECT domain, expires_at FROM resolutions WHERE domain IN ({','.join('?' * len(chunk))})", chunk)
+            expires.update(rows)
+
+        missing = [d for d in domains if d not in expires]
+        stale = sorted((d for d in domains if d in expires and expires[d] <= now), key=expires.get)
+        if refresh_limit is not None:
+            stale = stale[:max(0, refresh_limit)]
+        to_query = missing + stale
+        queued = set(to_query)
+        fresh = [d for d in domains if d not in queued]
+        return to_query, fresh
+
+    def lookup(self, domains, now=None):
+        """返回 domains 中仍然新鲜的条目 {domain: [ip, ...]}，没有地址的域名对应空列表"""
+        now = int(now if now is not None else time.time())
+        self.flush()
+        fresh = {}
+        domains = list(domains)
+        for i in range(0, len(domains), 900):
+            chunk = domains[i:i + 900]
+            rows = self._conn.execute(
+                f"SELECT domain, ips FROM resolutions WHERE expires_at > ? AND domain IN ({','.join('?' * len(chunk))})",
+                [now] + chunk)
+            for domain, ips in rows:
+                fresh[domain] = ips.split(',') if ips else []
+        return fresh
+
+    def iter_pairs(self, domains=None):
+        """逐条产出缓存中有地址的 (domain, ip)；指定 domains 时只包含其中的域名
+
+        不检查 expires_at，已过期的条目也会产出：受 --refresh-limit 限制本次没有刷新的域名
+        沿用上一次的结果，而不是从输出中消失。
+
+        domains 为集合或 DomainStore 时直接用 in 查询，不另外复制；列表等其他可迭代对象先转为集合。
+        """
+        self.flush()
+        wanted = domains
+        if domains is not None and (not isinstance(domains, Collection) or isinstance(domains, Sequence)):
+            wanted = set(domains)
+        for domain, ips in self._conn.execute('SELECT domain, ips FROM resolutions WHERE status = ?', (STATUS_OK,)):
+            if wanted is not None and domain not in wanted:
+                continue
+            for ip in ips.split(','):
+                yield domain, ip
+
+    def export_updates(self, path, since):
+        """把 checked_at >= since 的条目导出到一个新的数据库文件，供分片上传"""
+        self.flush()
+        if os.path.exists(path):
+            os.remove(path)
+        with ResolutionCache(path) as target:
+            rows = self._conn.execute('SELECT * FROM resolutions WHERE checked_at >= ?', (since,))
+            with target._conn:
+                target._conn.executemany('INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def merge_from(self, path):
+        """合并另一个缓存文件，同一域名保留检查时间更新的一条"""
+        self.flush()
+        self._conn.execute('ATTACH DATABASE ? AS other', (path,))
+        try:
+            with self._conn:
+                self._conn.execute('''
+                    INSERT INTO resolutions SELECT * FROM other.resolutions WHERE true
+                    ON CONFLICT(domain) DO UPDATE SET
+                        ips = excluded.ips, ttl = excluded.ttl, status = excluded.status,
+                        resolver = excluded.resolver, checked_at = excluded.checked_at,
+                        expires_at = excluded.expires_at
+                    WHERE excluded.checked_at > resolutions.checked_at
+                ''')
+        finally:
+            self._conn.execute('DETACH DATABASE other')
+
+    def __len__(self):
+        self.flush()
+        return self._conn.execute('SELECT COUNT(*) FROM resolutions').fetchone()[0]
@@ -0,0 +1,116 @@
+import os
+import time
+
+class ResultJournal:
+    """追加写入的查询结果日志，格式与原来的 ip_results_<method>.txt 相同：
+
+    每个解析到的地址一行 domain,ip；没有地址的域名写一行 domain, 作为完成标记。
+    结果先攒在内存里，满 batch_size 条或距上次写入超过 flush_interval 秒时整批写入
+    并 fsync，中途被杀掉最多丢失最后一批。
+    """
+
+    def __init__(self, path, batch_size=1000, flush_interval=5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        repair(path)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self.recorded = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, domain, ips):
+        if ips:
+            self._pending.extend(f"{domain},{ip}\n" for ip in ips)
+        else:
+            self._pending.append(f"{domain},\n")
+        self.recorded += 1
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._file.write(''.join(self._pending))
+            self._pending = []
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+def repair(path):
+    """截掉崩溃时写了一半的最后一行"""
+    try:
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # 向前找到最后一个换行符
+            position = size
+            while position > 0:
+                step = min(65536, position)
+                position -= step
+                f.seek(position)
+                newline = f.read(step).rfind(b'\n')
+                if newline != -1:
+                    f.truncate(position + newline + 1)
+                    return
+            f.truncate(0)
+    except FileNotFoundError:
+        pass
+
+def iter_journal(path):
+    """逐行读取日志，产出 (domain, ip)，跳过完成标记和不完整的行"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            domain, _, ip = line.rstrip('\n').partition(',')
+            if domain and ip:
+                yield domain, ip
+
+def completed_results(path):
+    """日志中已经完成的域名及其地址 {domain: [ip, ...]}，用于重启后跳过并补回解析缓存"""
+    completed = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                domain, _, ip = line.rstrip('\n').partition(',')
+                ips = completed.setdefault(domain, [])
+                if ip:
+                    ips.append(ip)
+    except FileNotFoundError:
+        pass
+    return completed
+
+def done_marker(path):
+    return path + '.done'
+
+def mark_done(path):
+    """本次运行正常结束；日志保留给上传与合并，下次启动时由 start_journal 丢弃"""
+    with open(done_marker(path), 'w'):
+        pass
+
+def start_journal(path, fresh=False):
+    """开始一次运行前调用：fresh 或上次运行已正常结束时丢弃旧日志，否则保留以便从中断处继续"""
+    marker = done_marker(path)
+    if fresh or os.path.exists(marker):
+        for stale in (path, marker):
+            if os.path.exists(stale):
+                os.remove(stale)
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+from dns_message import DnsResult
+from rate_control import AdaptiveLimiter, RetryableError
+
+WEIGHTS_FILE = 'resolver_weights.json'
+
+class ResolverStats:
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.handed_off = 0
+        self.first_start = None
+        self.last_end = None
+
+    def record(self, start, end, ok):
+        if self.first_start is None:
+            self.first_start = start
+        self.last_end = end
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    @property
+    def throughput(self):
+        """实测吞吐（域名/秒）"""
+        if not self.completed or self.last_end is None:
+            return 0.0
+        return self.completed / max(self.last_end - self.first_start, 1e-3)
+
+    def as_dict(self):
+        return {'completed': self.completed, 'failed': self.failed, 'handed_off': self.handed_off,
+                'throughput': round(self.throughput, 3)}
+
+class WorkStealingScheduler:
+    """多个解析器共享一个域名队列，各自按限速器允许的速度取任务
+
+    某个解析器失败的域名优先转交给实测吞吐最高且尚未尝试过的解析器；所有解析器都试过后，
+    在总尝试次数内退避重试，仍失败则记为失败。
+
+    默认 run() 之前用 add() 放入全部域名，队列清空即结束；流式输入时先调用 hold()，
+    运行中用 feed() 逐个放入，输入结束后调用 close()。
+    """
+
+    def __init__(self, backends, limiters=None, max_attempts=5, on_result=None, metrics=None, max_backlog=10000):
+        self.backends = backends
+        self.limiters = limiters or {name: AdaptiveLimiter() for name in backends}
+        self.max_attempts = max_attempts
+        self.on_result = on_result
+        self.metrics = metrics
+        self.stats = {name: ResolverStats() for name in backends}
+
+        self._shared = deque()
+        self._handoff = {name: deque() for name in backends}
+        self._pending = 0
+        self._wakeup = asyncio.Condition()
+        self._open = False
+        self.max_backlog = max_backlog
+        self._room = asyncio.Event()
+        self._tasks = set()  # 等待重试或转交的任务；事件循环只持有弱引用，需要在这里保留
+
+    def add(self, domains):
+        for domain in domains:
+            self._shared.append((domain, ()))
+            self._pending += 1
+
+    def hold(self):
+        """队列暂时为空时工作协程继续等待，直到 close()"""
+        self._open = True
+
+    async def feed(self, domain):
+        """运行中放入一个域名；积压超过 max_backlog 时等待解析器取走"""
+        while len(self._shared) >= self.max_backlog:
+            self._room.clear()
+            await self._room.wait()
+        self._shared.append((domain, ()))
+        self._pending += 1
+        async with self._wakeup:
+            self._wakeup.notify()
+
+    async def close(self):
+        self._open = False
+        await self._notify()
+
+    async def _notify(self):
+        async with self._wakeup:
+            self._wakeup.notify_all()
+
+    async def _next(self, name):
+        async with self._wakeup:
+            while True:
+                if self._handoff[name]:
+                    return self._handoff[name].popleft()
+                if self._shared:
+                    item = self._shared.popleft()
+                    if len(self._shared) < self.max_backlog:
+                        self._room.set()
+                    return item
+                if self._pending == 0 and not self._open:
+                    return None
+                await self._wakeup.wait()
+
+    def _handoff_target(self, tried):
+        candidates = [name for name in self.backends if name not in tried]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda name: (self.stats[name].throughput, -self.stats[name].failed))
+
+    def _requeue(self, name, domain, tried, delay):
+        async def push():
+            if delay:
+                await asyncio.sleep(delay)
+            self._handoff[name].append((domain, tried))
+            await self._notify()
+        task = asyncio.get_running_loop().create_task(push())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _finish(self, domain, result, name):
+        self._pending -= 1
+        if self.metrics is not None:
+            self.metrics.outcome(name, result)
+        if self.on_result is not None:
+            self.on_result(domain, result, name)
+        if self._pending == 0:
+            await self._notify()
+
+    async def _worker(self, session, name):
+        limiter = self.limiters[name]
+        query_func = self.backends[name]
+        while True:
+            # 先占并发名额再取任务：慢解析器最多只拿走 concurrency 个域名，其余留给其他解析器；
+            # 令牌在取到任务之后再等，空闲等待时不消耗令牌
+            await limiter.reserve()
+            try:
+                item = await self._next(name)
+            except asyncio.CancelledError:
+                await asyncio.shield(limiter.release())
+                raise
+            if item is None:
+                await limiter.release()
+                return
+            domain, tried = item
+            await limiter.wait_token()
+            start = time.monotonic()
+            retry_after = None
+            status = 200
+            try:
+                result = await query_func(session, domain)
+            except RetryableError as e:
+                status = e.status or type(e).__name__
+                print(f"{name} 查询失败: {e}")
+                if e.retryable:
+                    limiter.on_failure(e.retry_after)
+                    retry_after = e.retry_after
+                    result = None
+                else:
+                    # 解析器明确拒绝（如 4xx）：不重试，记为空应答
+                    limiter.on_success(time.monotonic() - start)
+                    result = DnsResult([], None, 0, ())
+            except Exception as e:
+                limiter.on_failure()
+                status = type(e).__name__
+                result = None
+                print(f"{name} 查询失败: {e!r}")
+            else:
+                limiter.on_success(time.monotonic() - start)
+            finally:
+                await limiter.release()
+            end = time.monotonic()
+            self.stats[name].record(start, end, result is not None)
+            if self.metrics is not None:
+                self.metrics.observe(name, end - start, status)
+
+            if result is not None:
+                await self._finish(domain, result, name)
+                continue
+
+            tried = tried + (name,)
+            if len(tried) >= self.max_attempts:
+                await self._finish(domain, None, name)
+                continue
+            if self.metrics is not None:
+                self.metrics.retry(name)
+            target = self._handoff_target(tried)
+            if target is not None:
+                self.stats[name].handed_off += 1
+                self._requeue(target, domain, tried, 0)
+            else:
+                # 所有解析器都试过，退避后交回吞吐最高的解析器
+                target = self._handoff_target(()) or name
+                delay = retry_after if retry_after is not None else limiter.backoff(len(tried) - 1)
+                self._requeue(target, domain, tried, delay)
+
+    async def run(self, session):
+        workers = [asyncio.create_task(self._worker(session, name))
+                   for name in self.backends
+                   for _ in range(self.limiters[name].max_concurrency)]
+        sampler = None
+        if self.metrics is not None:
+            sampler = asyncio.create_task(self.metrics.sample_inflight(self.limiters))
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            if sampler is not None:
+                sampler.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+
+    def weights(self):
+        return {name: round(stats.throughput, 3) for name, stats in self.stats.items()}
+
+def load_weights(path=WEIGHTS_FILE):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            weights = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"读取 {path} 失败: {e}")
+        return None
+    return {name: float(value) for name, value in weights.items() if float(value) > 0} or None
+
+def save_weights(weights, path=WEIGHTS_FILE):
+    with open(path, 'w') as f:
+        json.dump(weights, f, indent=2, sort_keys=True)
+
+def merge_weights(old, new, alpha=0.5):
+    """对多次运行的实测吞吐做指数平均，避免单次波动"""
+    merged = dict(old or {})
+    for name, value in new.items():
+        if value <= 0:
+            continue
+        merged[name] = round(alpha * value + (1 - alpha) * merged[name], 3) if name in merged else value
+    return merged
@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+
+SOURCE_CACHE_DIR = '.source_cache'
+VALIDATORS_FILE = 'validators.json'
+
+def parse_rule_line(line):
+    """DOMAIN,x / DOMAIN-SUFFIX,x 规则，原样保留规则类型"""
+    if line.startswith(('DOMAIN,', 'DOMAIN-SUFFIX,')):
+        return line
+    return None
+
+def parse_plain_line(line):
+    return line or None
+
+def parse_adblock_line(line):
+    """||example.com^ 形式的广告规则"""
+    if line.startswith('||') and line.endswith('^'):
+        return line.strip('|^')
+    return None
+
+def cache_key(url, parse_line):
+    """缓存按 URL 与解析函数区分：不同脚本用不同的解析函数处理同一来源时，互不复用对方的条目"""
+    return f"{url} {parse_line.__module__}.{parse_line.__qualname__}"
+
+class SourceCache:
+    """保存每个来源的 ETag/Last-Modified 以及上次解析出的条目，键为 cache_key()"""
+
+    def __init__(self, cache_dir=SOURCE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._validators_path = os.path.join(cache_dir, VALIDATORS_FILE)
+        self.validators = self._load()
+        self._updated = {}
+
+    def _load(self):
+        try:
+            with open(self._validators_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def items_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.txt')
+
+    def request_headers(self, key):
+        entry = self.validators.get(key)
+        if not entry or not os.path.exists(self.items_path(key)):
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, key, response):
+        self._updated[key] = self.validators[key] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+
+    def save(self):
+        # 重新读取再合并，避免多个 SourceCache 实例互相覆盖
+        if not self._updated:
+            return
+        validators = self._load()
+        validators.update(self._updated)
+        tmp_path = self._validators_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(validators, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._validators_path)
+        self._updated.clear()
+
+async def fetch_source(session, url, parse_line, sink, cache):
+    """流式获取一个来源，逐行解析后交给 sink；未变化时直接读取上次解析的结果
+
+    sink 可以是协程函数（如写入有界队列），此时等待它完成再读下一行。
+    """
+    key = cache_key(url, parse_line)
+    async with session.get(url, headers=cache.request_headers(key)) as response:
+        if response.status == 304:
+            count = 0
+            with open(cache.items_path(key), 'r', encoding='utf-8') as f:
+                for line in f:
+                    added = sink(line.rstrip('\n'))
+                    if inspect.isawaitable(added):
+                        await added
+                    count += 1
+            print(f"未变化，使用缓存 ({count} 条): {url}")
+            return count
+        response.raise_for_status()
+
+        count = 0
+        tmp_path = cache.items_path(key) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            async for raw in response.content:
+                item = parse_line(raw.decode('utf-8', 'ignore').strip())
+                if item:
+                    added = sink(item)
+                    if inspect.isawaitable(added):
+                        await added
+                    out.write(item + '\n')
+                    count += 1
+        os.replace(tmp_path, cache.items_path(key))
+        cache.update(key, response)
+        print(f"已下载 ({count} 条): {url}")
+        return count
+
+async def fetch_sources(session, sources, cache_dir=SOURCE_CACHE_DIR):
+    """并发获取多个来源，sources 为 (url, parse_line, sink) 列表"""
+    cache = SourceCache(cache_dir)
+    try:
+        return await asyncio.gather(*(fetch_source(session, url, parse_line, sink, cache)
+                                      for url, parse_line, sink in sources))
+    finally:
+        cache.save()
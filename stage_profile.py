@@ -0,0 +1,247 @@
+import argparse
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 开启方式：环境变量 PROFILE_STAGES 或各脚本的 --profile 参数，取值
+#   1 / timers  只记录各阶段的墙钟时间、CPU 时间与 tracemalloc 峰值（tracemalloc 会让运行慢数倍）
+#   cprofile    另外用 cProfile 记录整个运行，输出 .prof 与按累计时间排序的 .prof.txt
+#   sample      另外每隔 SAMPLE_INTERVAL 秒采样一次主线程调用栈，输出 flamegraph 使用的 .folded
+PROFILE_ENV = 'PROFILE_STAGES'
+PROFILE_DIR_ENV = 'PROFILE_DIR'
+PROFILE_DIR = 'profile'
+MODES = ('timers', 'cprofile', 'sample')
+SAMPLE_INTERVAL = 0.005
+
+_profiler = None
+_current = contextvars.ContextVar('stage_profile_current', default=None)
+
+def _max_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+class _Stage:
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.peak = 0
+
+class _Sampler(threading.Thread):
+    """后台线程定期读取主线程的调用栈，按 阶段;文件:函数;... 汇总"""
+
+    def __init__(self, profiler, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.profiler = profiler
+        self.interval = interval
+        self.samples = Counter()
+        self._target = threading.main_thread().ident
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(self.profiler.active or '-')
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+class StageProfiler:
+    """按阶段记录墙钟时间、CPU 时间、tracemalloc 峰值与进程最大 RSS
+
+    每个阶段结束时重写一次报告，进程中途被杀（例如 OOM）时已完成的阶段仍有记录。
+    同名阶段多次出现时累加时间、取峰值的最大值。阶段可以嵌套，也可以在协程中跨 await 使用；
+    多个阶段在不同任务中同时进行时，tracemalloc 峰值只是近似值。
+    """
+
+    def __init__(self, name, mode='timers', output_dir=None):
+        self.name = name
+        self.mode = mode
+        self.output_dir = output_dir or os.environ.get(PROFILE_DIR_ENV) or PROFILE_DIR
+        self.started_at = time.time()
+        self.stages = {}
+        self.active = None
+        self._cprofile = None
+        self._sampler = None
+
+    def path(self, suffix):
+        return os.path.join(self.output_dir, self.name + suffix)
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        tracemalloc.start()
+        if self.mode == 'cprofile':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif self.mode == 'sample':
+            self._sampler = _Sampler(self)
+            self._sampler.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        parent = _current.get()
+        if parent is not None:
+            # 子阶段会重置峰值，先把父阶段到目前为止的峰值记下来
+            parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        record = _Stage(name, parent)
+        token = _current.set(record)
+        outer_active, self.active = self.active, name
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            record.peak = max(record.peak, tracemalloc.get_traced_memory()[1])
+            _current.reset(token)
+            self.active = outer_active
+            if parent is not None:
+                parent.peak = max(parent.peak, record.peak)
+            tracemalloc.reset_peak()
+            self._record(record, wall, cpu)
+
+    def _record(self, record, wall, cpu):
+        entry = self.stages.setdefault(record.name, {
+            'parent': record.parent.name if record.parent is not None else None,
+            'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_bytes': 0,
+        })
+        entry['calls'] += 1
+        entry['wall'] = round(entry['wall'] + wall, 4)
+        entry['cpu'] = round(entry['cpu'] + cpu, 4)
+        entry['peak_bytes'] = max(entry['peak_bytes'], record.peak)
+        entry['max_rss_kb'] = _max_rss_kb()
+        print(f"[profile] {record.name}: 墙钟 {wall:.3f}s，CPU {cpu:.3f}s，"
+              f"内存峰值 {record.peak / 1048576:.1f} MiB")
+        self.write_report()
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'mode': self.mode,
+            'python': sys.version.split()[0],
+            'started_at': round(self.started_at, 3),
+            'duration': round(time.time() - self.started_at, 3),
+            'max_rss_kb': _max_rss_kb(),
+            'stages': self.stages,
+        }
+
+    def write_report(self):
+        path = self.path('.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, indent=2, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.path('.prof'))
+            text = io.StringIO()
+            pstats.Stats(self._cprofile, stream=text).sort_stats('cumulative').print_stats(50)
+            with open(self.path('.prof.txt'), 'w', encoding='utf-8') as f:
+                f.write(text.getvalue())
+        if self._sampler is not None:
+            self._sampler.stop()
+            with open(self.path('.folded'), 'w', encoding='utf-8') as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in self._sampler.samples.most_common())
+        tracemalloc.stop()
+        self.write_report()
+        print(f"[profile] 报告已写入 {self.path('.json')}")
+
+def resolve_mode(value=None):
+    """--profile 的取值优先，否则读取 PROFILE_STAGES；未开启或取值无法识别时返回 None
+
+    PROFILE_STAGES 来自 workflow 的自由文本输入，写错时只警告，不影响脚本本身运行。
+    """
+    value = value if value is not None else os.environ.get(PROFILE_ENV, '')
+    value = value.strip().lower()
+    if value in ('', '0', 'false', 'no', 'off'):
+        return None
+    if value in ('1', 'true', 'yes', 'on'):
+        return 'timers'
+    if value not in MODES:
+        print(f"警告: 未知的 profiling 模式 {value!r}，可选 {', '.join(MODES)}；本次不记录", file=sys.stderr)
+        return None
+    return value
+
+def add_argument(parser):
+    parser.add_argument('--profile', nargs='?', const='timers', metavar='MODE',
+                        help=f"记录各阶段的时间与内存峰值，写入 {PROFILE_DIR}/；MODE 可选 {'/'.join(MODES)}"
+                             f"（也可设置 {PROFILE_ENV}）")
+
+@contextlib.contextmanager
+def profiling(name, mode=None):
+    """在 with 块内开启阶段记录；mode 为 None 时按环境变量决定，未开启时什么也不做"""
+    global _profiler
+    mode = resolve_mode(mode)
+    if mode is None:
+        yield None
+        return
+    _profiler = StageProfiler(name, mode)
+    _profiler.start()
+    try:
+        yield _profiler
+    finally:
+        _profiler.stop()
+        _profiler = None
+
+def stage(name):
+    """给一个阶段计时；未开启 profiling 时是空操作"""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
+
+def compare(old_path, new_path, threshold=0.2, min_seconds=0.05):
+    """比较两份报告，返回墙钟时间、CPU 时间或内存峰值增长超过 threshold 的阶段"""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)['stages']
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)['stages']
+    regressions = []
+    for name, after in new.items():
+        before = old.get(name)
+        if before is None:
+            continue
+        for key in ('wall', 'cpu', 'peak_bytes'):
+            floor = min_seconds if key != 'peak_bytes' else 1048576
+            if after[key] > max(before[key], floor) * (1 + threshold):
+                regressions.append((name, key, before[key], after[key]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比较两次运行的阶段报告")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.2, help="增长超过该比例视为退化")
+    args = parser.parse_args(argv)
+
+    regressions = compare(args.old, args.new, args.threshold)
+    for name, key, before, after in regressions:
+        print(f"{name}.{key}: {before} -> {after}")
+    if not regressions:
+        print("没有发现退化")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
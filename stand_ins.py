@@ -0,0 +1,292 @@
+import asyncio
+import base64
+import hashlib
+import os
+import random
+import socket
+import ssl
+import subprocess
+import time
+
+from aiohttp import web
+
+from dns_message import FLAG_TC, RCODE_NXDOMAIN, TYPE_A, TYPE_AAAA, TYPE_CNAME, encode_response, question_of
+
+class StandInConfig:
+    """本地替身服务器的行为：固定延迟、随机错误率与 429 限流"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.requests = 0
+
+def fake_answers(name, qtype):
+    """按域名哈希生成确定的解析结果：约一半落在 Cloudflare 段内，约 1/16 为 NXDOMAIN"""
+    digest = hashlib.blake2b(name.encode(), digest_size=8).digest()
+    if digest[0] % 16 == 0:
+        return None
+    if qtype == TYPE_A:
+        if digest[1] % 2:
+            return [f"104.{16 + digest[2] % 8}.{digest[3]}.{digest[4]}"]
+        return [f"93.184.{digest[3]}.{digest[4]}"]
+    if qtype == TYPE_AAAA and digest[5] % 2:
+        return [f"2606:4700:{digest[6]:x}::{digest[7]:x}"]
+    return []
+
+# 约 1/4 的域名是指向少数共享目标的 CNAME
+CNAME_SUFFIX = '.cdn.example.net'
+CNAME_TARGETS = 8
+
+def fake_cname(name):
+    if name.endswith(CNAME_SUFFIX):
+        return None
+    digest = hashlib.blake2b(name.encode(), digest_size=8).digest()
+    if digest[0] % 16 == 0 or digest[5] % 4:
+        return None
+    return f"edge{digest[6] % CNAME_TARGETS}{CNAME_SUFFIX}"
+
+def fake_records(name, qtype):
+    """替身 DNS 应答的记录 [(type, ttl, value)]，NXDOMAIN 时返回 None"""
+    target = fake_cname(name)
+    if target is not None:
+        return [(TYPE_CNAME, 300, target)] + [(qtype, 300, ip) for ip in fake_answers(target, qtype) or []]
+    ips = fake_answers(name, qtype)
+    if ips is None:
+        return None
+    return [(qtype, 300, ip) for ip in ips]
+
+def _dns_answer(query):
+    _, name, qtype = question_of(query)
+    records = fake_records(name, qtype)
+    if records is None:
+        return encode_response(query, [], RCODE_NXDOMAIN)
+    return encode_response(query, records)
+
+async def _apply_behaviour(config):
+    """返回需要直接回应的错误响应，正常情况返回 None"""
+    config.requests += 1
+    if config.latency:
+        await asyncio.sleep(config.latency)
+    roll = config.rng.random()
+    if roll < config.rate_limit_rate:
+        return web.Response(status=429, headers={'Retry-After': str(config.retry_after)})
+    if roll < config.rate_limit_rate + config.error_rate:
+        return web.Response(status=503)
+    return None
+
+def doh_app(config):
+    """同时支持 JSON (?name=&type=) 与 RFC 8484 (?dns= / POST) 的 DoH 替身"""
+
+    async def handle(request):
+        error = await _apply_behaviour(config)
+        if error is not None:
+            return error
+
+        if request.method == 'POST':
+            query = await request.read()
+        elif 'dns' in request.query:
+            encoded = request.query['dns']
+            query = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        else:
+            name = request.query.get('name', '').rstrip('.').lower()
+            qtype = TYPE_AAAA if request.query.get('type') in ('AAAA', '28') else TYPE_A
+            records = fake_records(name, qtype)
+            if records is None:
+                return web.json_response({'Status': RCODE_NXDOMAIN})
+            return web.json_response({
+                'Status': 0,
+                'Answer': [{'name': f"{name}.", 'type': rtype, 'TTL': ttl, 'data': value}
+                           for rtype, ttl, value in records],
+            }, content_type='application/dns-json')
+
+        return web.Response(body=_dns_answer(query), content_type='application/dns-message')
+
+    app = web.Application()
+    app.router.add_route('GET', '/dns-query', handle)
+    app.router.add_route('POST', '/dns-query', handle)
+    app.router.add_route('GET', '/resolve', handle)
+    return app
+
+# 模拟 bgp.he.net 页面中 #ipinfo 之外的大量无关内容
+_BGP_FILLER = ''.join(f'<tr><td><a href="/AS{13335 + i}">AS{13335 + i}</a></td><td>filler row {i}</td></tr>'
+                      for i in range(300))
+
+def bgp_page(domain):
+    ips = (fake_answers(domain, TYPE_A) or []) + (fake_answers(domain, TYPE_AAAA) or [])
+    links = ''.join(f'<a href="/ip/{ip}" title="{ip}">{ip}</a><br>' for ip in ips)
+    return (f'<html><head><title>{domain} - bgp.he.net</title></head><body>'
+            f'<div id="header"><table>{_BGP_FILLER}</table></div>'
+            f'<div id="dns" class="tabdata"><table>{_BGP_FILLER}</table></div>'
+            f'<div id="ipinfo" class="tabdata"><table><tr><td>{links}</td></tr></table></div>'
+            f'<div id="footer">{_BGP_FILLER}</div></body></html>')
+
+def bgp_app(config):
+    """bgp.he.net /dns/<domain> 页面替身"""
+
+    async def handle(request):
+        error = await _apply_behaviour(config)
+        if error is not None:
+            return error
+        return web.Response(text=bgp_page(request.match_info['domain']), content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/dns/{domain}', handle)
+    return app
+
+def synthetic_list(kind, count, seed=0):
+    """生成三种来源格式的域名列表：rules (DOMAIN/DOMAIN-SUFFIX)、plain、adblock"""
+    rng = random.Random(f"{kind}-{seed}")
+    lines = []
+    for i in range(count):
+        domain = f"{rng.getrandbits(32):08x}.site{i % 5000}.example{i % 97}.com"
+        if kind == 'rules':
+            lines.append(f"{'DOMAIN-SUFFIX' if i % 10 == 0 else 'DOMAIN'},{domain}")
+        elif kind == 'adblock':
+            lines.append(f"||{domain}^")
+        else:
+            lines.append(domain)
+    return '\n'.join(lines) + '\n'
+
+def list_app(config, lists):
+    """原始列表替身，lists 为 {名称: 文本}；支持 ETag 条件请求"""
+    etags = {name: '"' + hashlib.sha1(text.encode()).hexdigest() + '"' for name, text in lists.items()}
+
+    async def handle(request):
+        name = request.match_info['name']
+        if name not in lists:
+            return web.Response(status=404)
+        if request.headers.get('If-None-Match') == etags[name]:
+            return web.Response(status=304)
+        error = await _apply_behaviour(config)
+        if error is not None:
+            return error
+        return web.Response(text=lists[name], headers={'ETag': etags[name]})
+
+    app = web.Application()
+    app.router.add_get('/lists/{name}', handle)
+    return app
+
+def trace_app(config, colos=('HKG', 'NRT', 'SIN', 'LAX', 'SJC', 'FRA')):
+    """Cloudflare 边缘替身：按连接到的本地地址确定数据中心，
+    所有响应带 CF-Ray，/cdn-cgi/trace 返回 colo 字段"""
+
+    async def handle(request):
+        error = await _apply_behaviour(config)
+        if error is not None:
+            return error
+        local_ip = request.transport.get_extra_info('sockname')[0]
+        digest = hashlib.blake2b(local_ip.encode(), digest_size=8).digest()
+        colo = colos[digest[0] % len(colos)]
+        headers = {'CF-Ray': f"{digest.hex()}-{colo}", 'Server': 'cloudflare'}
+        if request.path != '/cdn-cgi/trace':
+            return web.Response(headers=headers)
+        text = (f"fl=1f1\nh={request.host}\nip={request.remote}\nts={time.time():.3f}\n"
+                f"visit_scheme={request.scheme}\ncolo={colo}\nhttp=http/1.1\nloc=XX\n")
+        return web.Response(text=text, headers=headers)
+
+    app = web.Application()
+    app.router.add_get('/', handle)
+    app.router.add_get('/cdn-cgi/trace', handle)
+    return app
+
+class _DnsStubProtocol(asyncio.DatagramProtocol):
+    def __init__(self, config, truncate_rate, drop_rate):
+        self.config = config
+        self.truncate_rate = truncate_rate
+        self.drop_rate = drop_rate
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.config.requests += 1
+        roll = self.config.rng.random()
+        if roll < self.drop_rate:
+            return
+        if roll < self.drop_rate + self.truncate_rate:
+            # 只回带 TC 标志的空响应，迫使客户端改用 TCP
+            response = bytearray(encode_response(data, []))
+            response[2] |= FLAG_TC >> 8
+        else:
+            response = _dns_answer(data)
+        if self.config.latency:
+            asyncio.get_running_loop().call_later(self.config.latency, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+async def start_dns_server(config, host='127.0.0.1', truncate_rate=0.0, drop_rate=0.0):
+    """UDP + TCP 的 DNS 替身，应答与 DoH 替身相同；按比例丢弃或截断 UDP 响应。
+    返回 (关闭函数, 端口)"""
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _DnsStubProtocol(config, truncate_rate, drop_rate), local_addr=(host, 0))
+    port = transport.get_extra_info('sockname')[1]
+    transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+    async def handle_tcp(reader, writer):
+        try:
+            while True:
+                length = int.from_bytes(await reader.readexactly(2), 'big')
+                response = _dns_answer(await reader.readexactly(length))
+                writer.write(len(response).to_bytes(2, 'big') + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_tcp, host, port)
+
+    async def close():
+        transport.close()
+        server.close()
+        await server.wait_closed()
+
+    return close, port
+
+def self_signed_context(directory):
+    """用 openssl 生成一次性的自签名证书，返回服务端 SSLContext；没有 openssl 时返回 None"""
+    cert, key = os.path.join(directory, 'stand_in.crt'), os.path.join(directory, 'stand_in.key')
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=stand-in', '-keyout', key, '-out', cert],
+                       check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+async def start_tcp_listener(host='127.0.0.1', port=0, ssl_context=None, delay=0.0):
+    """本地 TCP/TLS 监听替身，delay 推迟 TLS 握手的应答，返回 (server, 端口)"""
+
+    async def handle(reader, writer):
+        # 先暂停读取，ClientHello 留在内核缓冲区里，等 start_tls 接管
+        writer.transport.pause_reading()
+        try:
+            if ssl_context is not None:
+                await asyncio.sleep(delay)
+                await writer.start_tls(ssl_context)
+            else:
+                writer.transport.resume_reading()
+            await reader.read(1)
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    return server, server.sockets[0].getsockname()[1]
+
+async def start_app(app, host='127.0.0.1', port=0):
+    """启动应用并返回 (runner, 基础URL)，结束时调用 runner.cleanup()"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
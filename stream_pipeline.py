@@ -0,0 +1,189 @@
+import asyncio
+import ipaddress
+import signal
+
+import aiohttp
+
+from cidr_index import CidrIndex
+from doh_client import create_session
+from domain_store import normalize_domain
+from scheduler import WorkStealingScheduler
+from source_fetch import fetch_sources
+
+# 来源与解析器之间的队列长度，也是调度器积压的上限
+QUEUE_SIZE = 10000
+# 查询解析缓存时每批的域名数
+CACHE_BATCH = 500
+
+def covered_by(domain, suffixes):
+    """domain 的某个上级域名是 DOMAIN-SUFFIX 规则"""
+    labels = domain.split('.')
+    return any('.'.join(labels[i:]) in suffixes for i in range(1, len(labels)))
+
+def ip_sort_key(ip):
+    """与 unique_sorted_ips 相同的顺序：IPv4 在前，按数值排序"""
+    address = ipaddress.ip_address(ip)
+    return address.version, int(address)
+
+class StreamMatcher:
+    """解析结果到达时立即与 CIDR 匹配，累积优选域名及其地址
+
+    CIDR 列表与域名来源并发获取，它就绪之前到达的结果先暂存。
+    """
+
+    def __init__(self):
+        self.cidr_index = None
+        self.matches = {}  # 域名 -> 落在 CIDR 内的地址
+        self.resolved = 0
+        self._waiting = []
+
+    def set_index(self, cidr_index):
+        self.cidr_index = cidr_index
+        waiting, self._waiting = self._waiting, []
+        for domain, ips in waiting:
+            self._match(domain, ips)
+
+    def add(self, domain, ips):
+        self.resolved += 1
+        if self.cidr_index is None:
+            self._waiting.append((domain, ips))
+        else:
+            self._match(domain, ips)
+
+    def _match(self, domain, ips):
+        for ip in ips:
+            try:
+                if self.cidr_index.contains(ip):
+                    self.matches.setdefault(domain, set()).add(ip)
+            except ValueError:
+                print(f"无效的IP地址: {ip}")
+
+    def snapshot(self, suffixes=()):
+        """当前的 (优选域名列表, 优选IP列表)，去掉之后才出现的后缀规则所覆盖的子域名"""
+        domains = sorted(domain for domain in self.matches if not covered_by(domain, suffixes))
+        ips = set()
+        for domain in domains:
+            ips.update(self.matches[domain])
+        return domains, sorted(ips, key=ip_sort_key)
+
+class StreamPipeline:
+    """来源 → 有界队列 → 解析调度器 → CIDR 匹配，全部在同一个进程内流式完成
+
+    sources(add) 返回 fetch_sources 使用的来源列表，每个域名以 await add(domain, suffix) 送入。
+    emit(domains, ips, final) 输出当前结果：每隔 emit_interval 秒、收到 SIGUSR1 时输出部分结果，
+    结束时以 final=True 输出最终结果。与分片模式相同，已被后缀规则覆盖的子域名不出现在结果中；
+    只是子域名先于后缀规则到达时仍会被查询，在输出时才丢弃。
+    """
+
+    def __init__(self, sources, cidr_url, backends, emit, limiters=None, cache=None, metrics=None,
+                 queue_size=QUEUE_SIZE, emit_interval=60.0):
+        self.sources = sources
+        self.cidr_url = cidr_url
+        self.emit = emit
+        self.cache = cache
+        self.emit_interval = emit_interval
+        self.matcher = StreamMatcher()
+        self.scheduler = WorkStealingScheduler(backends, limiters, on_result=self._on_result, metrics=metrics,
+                                               max_backlog=queue_size)
+        self.suffixes = set()
+        self.failures = []
+        self.cached = 0
+        self._seen = set()
+        self._queue = asyncio.Queue(queue_size)
+
+    async def _add(self, domain, suffix=False):
+        domain = normalize_domain(domain)
+        if domain is None:
+            return
+        if suffix:
+            self.suffixes.add(domain)
+        if domain in self._seen or covered_by(domain, self.suffixes):
+            return
+        self._seen.add(domain)
+        await self._queue.put(domain)
+
+    async def _feed(self):
+        """从队列取出域名交给调度器；有解析缓存时整批查询，新鲜的直接匹配"""
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < CACHE_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            if self.cache is not None and batch:
+                fresh = self.cache.lookup(batch)
+                for domain, ips in fresh.items():
+                    self.matcher.add(domain, ips)
+                self.cached += len(fresh)
+                batch = [domain for domain in batch if domain not in fresh]
+            for domain in batch:
+                await self.scheduler.feed(domain)
+            if done:
+                await self.scheduler.close()
+                return
+
+    async def _produce(self, session):
+        await fetch_sources(session, self.sources(self._add))
+        await self._queue.put(None)
+
+    def _on_result(self, domain, result, resolver):
+        if result is None:
+            self.failures.append(domain)
+            return
+        if self.cache is not None:
+            self.cache.store(domain, result, resolver)
+        self.matcher.add(domain, result.ips)
+
+    async def _load_cidr(self, session):
+        async with session.get(self.cidr_url) as response:
+            cidr_index = CidrIndex.from_text(await response.text())
+        print(f"有效的CIDR数量: {len(cidr_index)}")
+        self.matcher.set_index(cidr_index)
+
+    def emit_now(self, final=False):
+        """输出当前已匹配的结果；CIDR 列表尚未就绪时跳过，避免输出空结果"""
+        if self.matcher.cidr_index is None:
+            return
+        domains, ips = self.matcher.snapshot(self.suffixes)
+        self.emit(domains, ips, final)
+        print(f"已送入 {len(self._seen)} 个域名，完成 {self.matcher.resolved} 个（缓存 {self.cached} 个），"
+              f"匹配 {len(domains)} 个域名 / {len(ips)} 个 IP")
+
+    async def _emit_periodically(self):
+        while True:
+            await asyncio.sleep(self.emit_interval)
+            self.emit_now()
+
+    def _install_signal(self):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.emit_now)
+            return True
+        except (AttributeError, NotImplementedError, RuntimeError):
+            return False  # Windows 或非主线程
+
+    async def run(self):
+        self.scheduler.hold()
+        signal_installed = self._install_signal()
+        emitter = asyncio.create_task(self._emit_periodically()) if self.emit_interval else None
+        try:
+            async with aiohttp.ClientSession() as fetch_session, create_session() as session:
+                tasks = [asyncio.create_task(self._produce(fetch_session)),
+                         asyncio.create_task(self._load_cidr(fetch_session)),
+                         asyncio.create_task(self._feed()),
+                         asyncio.create_task(self.scheduler.run(session))]
+                try:
+                    # 任一阶段出错立即结束：其余协程可能正等待有界队列，不取消会一直挂起
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                    for task in tasks:
+                        if task in done:
+                            task.result()
+                finally:
+                    for task in tasks:
+                        task.cancel()
+        finally:
+            if emitter is not None:
+                emitter.cancel()
+            if signal_installed:
+                asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+        self.emit_now(final=True)
@@ -1,13 +1,15 @@
 import aiohttp
+import argparse
 import asyncio
 
-from bs4 import BeautifulSoup
 import os
-import ipaddress
-import random
 import re
 
-from collections import defaultdict
+from bgp_pipeline import BgpPipeline
+from cidr_index import CidrIndex
+from domain_store import DomainStore
+from source_fetch import fetch_sources, parse_plain_line, parse_rule_line
+from stage_profile import add_argument, profiling, stage
 
 # 定义常量
 GROUP_1_URL = 'https://raw.githubusercontent.com/GuangYu-yu/ACL4SSR/refs/heads/main/matching_domains.list'
@@ -19,56 +21,51 @@ GROUP_3_URL = 'https://raw.githubusercontent.com/blackmatrix7/ios_rule_script/re
 CIDR_URL = 'https://raw.githubusercontent.com/GuangYu-yu/ACL4SSR/refs/heads/main/Clash/Cloudflare.txt'
 CACHED_CIDR_FILE = 'cached_cidr.txt'
 
+# bgp.he.net 查询的并发抓取数，解析阶段的进程数（0 表示在事件循环内解析）
+BGP_FETCH_WORKERS = 32
+BGP_PARSE_PROCESSES = 0
+
 async def fetch(session, url):
     async with session.get(url) as response:
         return await response.text()
 
-async def fetch_group_1(session):
+def parse_group_3_line(line):
+    match = re.search(r'\|\|([^\^]+)\^', line)
+    return match.group(1) if match else None
+
+async def fetch_group_1(session, store):
     print("正在获取第一组域名...")
-    text = await fetch(session, GROUP_1_URL)
-    domains = {}
-    for line in text.splitlines():
-        if line.startswith("DOMAIN") or line.startswith("DOMAIN-SUFFIX"):
-            parts = line.split(',')
-            if len(parts) == 2:
-                prefix, domain = parts
-                if domain not in domains:
-                    domains[domain] = {'prefix': prefix, 'ips': set()}
-    return domains
-
-async def fetch_group_2(session):
-    domains = {}
-    for url in GROUP_2_URLS:
-        print(f"正在获取第二组域名: {url}")
-        text = await fetch(session, url)
-        for line in text.splitlines():
-            domain = line.strip()
-            if domain and domain not in domains:
-                domains[domain] = {'prefix': '', 'ips': set()}
-    return domains
-
-async def fetch_group_3(session):
+
+    def add_rule(line):
+        parts = line.split(',')
+        if len(parts) == 2:
+            prefix, domain = parts
+            store.add(domain, suffix=(prefix == 'DOMAIN-SUFFIX'))
+
+    await fetch_sources(session, [(GROUP_1_URL, parse_rule_line, add_rule)])
+
+async def fetch_group_2(session, store):
+    print("正在获取第二组域名...")
+    await fetch_sources(session, [(url, parse_plain_line, store.add) for url in GROUP_2_URLS])
+
+async def fetch_group_3(session, store):
     print("正在获取第三组域名...")
-    text = await fetch(session, GROUP_3_URL)
-    domains = {}
-    for line in text.splitlines():
-        match = re.search(r'\|\|([^\^]+)\^', line)
-        if match:
-            domain = match.group(1)
-            if domain not in domains:
-                domains[domain] = {'prefix': '', 'ips': set()}
-    return domains
-
-async def query_ip_info(session, domain):
-    await asyncio.sleep(random.uniform(1, 3))  # 减少延迟时间
-    query_url = f"https://bgp.he.net/dns/{domain}#_ipinfo"
-    async with session.get(query_url) as response:
-        text = await response.text()
-    soup = BeautifulSoup(text, 'html.parser')
-    ip_info_div = soup.find('div', id='ipinfo')
-    if ip_info_div:
-        return {a.get('title') for a in ip_info_div.find_all('a') if a.get('href', '').startswith('/ip/')}
-    return set()
+    await fetch_sources(session, [(GROUP_3_URL, parse_group_3_line, store.add)])
+
+async def query_ip_info(session, domains):
+    """通过有界流水线查询 bgp.he.net，返回 {域名: IP集合}，只包含查询到 IP 的域名"""
+    domain_ips = {}
+
+    def on_result(domain, ips):
+        if ips:
+            domain_ips[domain] = ips
+
+    pipeline = BgpPipeline(session, on_result, fetch_workers=BGP_FETCH_WORKERS,
+                           parse_processes=BGP_PARSE_PROCESSES)
+    await pipeline.run(domains)
+    if pipeline.failed:
+        print(f"查询失败的域名数量: {pipeline.failed}")
+    return domain_ips
 
 async def load_and_cache_cidr_list(session):
     print("下载并缓存 CIDR 列表...")
@@ -81,14 +78,16 @@ async def load_and_cache_cidr_list(session):
     
     return cidr_list
 
-def load_cached_cidr_list():
+def load_cached_cidr_index():
     print("从缓存加载 CIDR 列表...")
     with open(CACHED_CIDR_FILE, 'r') as f:
-        return f.read().splitlines()
+        return CidrIndex.from_lines(line for line in f if '/' in line)
 
-def is_ip_in_cidr(ip, cidr_list):
-    ip_obj = ipaddress.ip_address(ip)
-    return any(ip_obj in ipaddress.ip_network(cidr.strip(), strict=False) for cidr in cidr_list if '/' in cidr)
+def is_ip_in_cidr(ip, cidr_index):
+    try:
+        return cidr_index.contains(ip)
+    except ValueError:
+        return False
 
 async def main():
     try:
@@ -96,56 +95,56 @@ async def main():
         
         async with aiohttp.ClientSession() as session:
             # 下载并缓存 CIDR 列表
-            await load_and_cache_cidr_list(session)
-
-            # 获取三组域名
-            domains_group_1 = await fetch_group_1(session)
-            domains_group_2 = await fetch_group_2(session)
-            domains_group_3 = await fetch_group_3(session)
-
-            # 合并所有域名
-            all_domains = {**domains_group_1, **domains_group_2, **domains_group_3}
-            
-            # 异步查询 IP 信息
-            tasks = [query_ip_info(session, domain) for domain in all_domains]
-            results = await asyncio.gather(*tasks)
-            
-            for domain, ips in zip(all_domains, results):
-                all_domains[domain]['ips'] = ips
+            with stage('fetch_cidr'):
+                await load_and_cache_cidr_list(session)
+
+            # 获取三组域名，合并到同一个域名集合
+            store = DomainStore()
+            with stage('fetch_sources'):
+                await asyncio.gather(fetch_group_1(session, store), fetch_group_2(session, store),
+                                     fetch_group_3(session, store))
+            with stage('freeze'):
+                store.freeze()
+
+            # 查询 IP 信息，只保留查询到 IP 的域名
+            with stage('bgp_lookup'):
+                domain_ips = await query_ip_info(session, store)
 
             # 添加日志记录
-            print(f"总域名数量: {len(all_domains)}")
-            print(f"查询到IP的域名数量: {sum(1 for domain in all_domains.values() if domain['ips'])}")
+            print(f"总域名数量: {len(store)}")
+            print(f"查询到IP的域名数量: {len(domain_ips)}")
 
             # 从缓存加载 CIDR 列表
-            cidr_list = load_cached_cidr_list()
-
-            # 保存优选域名和优选域名IP
-            优选域名 = set()
-            ipv4_set = set()
-            ipv6_set = set()
-
-            for domain, data in all_domains.items():
-                for ip in data['ips']:
-                    if is_ip_in_cidr(ip, cidr_list):
-                        优选域名.add(domain)
-                        if ':' in ip:  # IPv6
-                            ipv6_set.add(ip)
-                        else:  # IPv4
-                            ipv4_set.add(ip)
-                        break  # 找到一个匹配后跳出循环
-
-            # 写入优选域名
-            with open('优选域名.txt', 'w') as f_domains:
-                for domain in sorted(优选域名):
-                    f_domains.write(f"{domain}\n")
-
-            # 写入优选域名IP
-            with open('优选域名ip.txt', 'w') as f_ips:
-                for ip in sorted(ipv4_set):
-                    f_ips.write(f"{ip}\n")
-                for ip in sorted(ipv6_set):
-                    f_ips.write(f"{ip}\n")
+            with stage('match'):
+                cidr_index = load_cached_cidr_index()
+
+                # 保存优选域名和优选域名IP
+                优选域名 = set()
+                ipv4_set = set()
+                ipv6_set = set()
+
+                for domain, ips in domain_ips.items():
+                    for ip in ips:
+                        if is_ip_in_cidr(ip, cidr_index):
+                            优选域名.add(domain)
+                            if ':' in ip:  # IPv6
+                                ipv6_set.add(ip)
+                            else:  # IPv4
+                                ipv4_set.add(ip)
+                            break  # 找到一个匹配后跳出循环
+
+            with stage('write_outputs'):
+                # 写入优选域名
+                with open('优选域名.txt', 'w') as f_domains:
+                    for domain in sorted(优选域名):
+                        f_domains.write(f"{domain}\n")
+
+                # 写入优选域名IP
+                with open('优选域名ip.txt', 'w') as f_ips:
+                    for ip in sorted(ipv4_set):
+                        f_ips.write(f"{ip}\n")
+                    for ip in sorted(ipv6_set):
+                        f_ips.write(f"{ip}\n")
 
             print(f"匹配到的优选域名数量: {len(优选域名)}")
             print(f"优选IPv4地址数量: {len(ipv4_set)}")
@@ -165,4 +164,9 @@ async def main():
             print("已删除缓存的 CIDR 文件")
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    add_argument(parser)
+    args = parser.parse_args()
+
+    with profiling('extract_cloudflare_domains', args.profile):
+        asyncio.run(main())